@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+腾讯云 ASR 本地模拟服务
+
+实现录音文件识别的 CreateRecTask 和 DescribeTaskStatus 两个接口，校验
+TC3-HMAC-SHA256 签名，SourceType 0 时像真实服务一样从 Url 下载音频，
+请求带 CallbackUrl 时在识别完成后回调，并可配置延迟、
+失败率和限频，用于在不消耗真实额度的情况下测试和压测转写流程。
+
+用法:
+  python3 benchmarks/mock_asr_server.py --port 8765 --latency 0.05 --fail-rate 0.01
+  export TENCENT_ASR_ENDPOINT=http://127.0.0.1:8765
+  export TENCENT_SECRET_ID=mock-id TENCENT_SECRET_KEY=mock-key
+  python3 tencent_asr_batch.py --input ./audio --output ./transcripts --day 1 --yes
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === 默认配置 ===
+DEFAULT_SECRET_ID = "mock-id"
+DEFAULT_SECRET_KEY = "mock-key"
+SIGNATURE_MAX_SKEW = 300   # 请求时间戳允许的最大偏差（秒），与腾讯云一致
+AUDIO_KBPS = 32            # 没有时长信息时按该码率由音频字节数估算时长
+SENTENCE_SECONDS = 5       # 模拟识别结果中每句话的时长（秒）
+
+def _hmac_sha256(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+def tc3_signature(secret_key, date, service, string_to_sign):
+    """按 TC3-HMAC-SHA256 规则计算签名（独立实现，不依赖被测代码）"""
+    secret_date = _hmac_sha256(("TC3" + secret_key).encode(), date)
+    secret_service = _hmac_sha256(secret_date, service)
+    secret_signing = _hmac_sha256(secret_service, "tc3_request")
+    return hmac.new(secret_signing, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+class MockError(Exception):
+    """以腾讯云 API 错误格式返回给客户端的错误"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+class TokenBucket:
+    """每个接口一个令牌桶，超出 qps 时返回 RequestLimitExceeded"""
+
+    def __init__(self, qps):
+        self.qps = qps
+        self.tokens = qps
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.qps, self.tokens + (now - self.updated) * self.qps)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class MockAsrService:
+    """模拟服务的状态：密钥、任务表、故障注入配置和请求统计"""
+
+    def __init__(self, credentials=None, latency=0.0, fail_rate=0.0, task_fail_rate=0.0,
+                 qps=None, rtf=0.01, min_processing=0.5, audio_kbps=AUDIO_KBPS, seed=None,
+                 callback_drop_rate=0.0, quota_seconds=None):
+        self.credentials = credentials or {DEFAULT_SECRET_ID: DEFAULT_SECRET_KEY}
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.task_fail_rate = task_fail_rate
+        self.callback_drop_rate = callback_drop_rate
+        self.quota_seconds = quota_seconds
+        self.accepted_seconds = 0.0
+        self.rtf = rtf
+        self.min_processing = min_processing
+        self.audio_kbps = audio_kbps
+        self.buckets = {action: TokenBucket(rate) for action, rate in (qps or {}).items() if rate}
+        self.random = random.Random(seed)
+        self.tasks = {}
+        self.next_task_id = 1000
+        self.lock = threading.Lock()
+        self.stats = {
+            'requests': {},
+            'throttled': 0,
+            'injected_failures': 0,
+            'auth_failures': 0,
+            'tasks_created': 0,
+            'tasks_failed': 0,
+            'audio_seconds': 0.0,
+            'upload_bytes': 0,
+            'download_bytes': 0,
+            'download_failures': 0,
+            'callbacks_sent': 0,
+            'callbacks_dropped': 0,
+            'callbacks_failed': 0,
+            'quota_rejections': 0,
+        }
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def verify(self, headers, body):
+        """校验 TC3 签名，失败时抛出与腾讯云相同错误码的 MockError"""
+        auth = headers.get("Authorization", "")
+        try:
+            algorithm, rest = auth.split(" ", 1)
+            fields = dict(part.strip().split("=", 1) for part in rest.split(","))
+            secret_id, date, service, _ = fields["Credential"].split("/")
+            signed_headers = fields["SignedHeaders"]
+            signature = fields["Signature"]
+            timestamp = int(headers["X-TC-Timestamp"])
+        except (ValueError, KeyError):
+            raise MockError("AuthFailure.SignatureFailure", "Authorization 格式错误")
+        if algorithm != "TC3-HMAC-SHA256":
+            raise MockError("AuthFailure.SignatureFailure", f"不支持的签名算法 {algorithm}")
+        if abs(time.time() - timestamp) > SIGNATURE_MAX_SKEW:
+            raise MockError("AuthFailure.SignatureExpire", "签名已过期")
+        if datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d") != date:
+            raise MockError("AuthFailure.SignatureFailure", "Credential 日期与时间戳不符")
+        secret_key = self.credentials.get(secret_id)
+        if secret_key is None:
+            raise MockError("AuthFailure.SecretIdNotFound", f"未知的 SecretId {secret_id}")
+
+        names = signed_headers.split(";")
+        canonical_headers = "".join(f"{name}:{headers.get(name, '').strip()}\n" for name in names)
+        canonical_request = (
+            f"POST\n/\n\n{canonical_headers}\n{signed_headers}\n"
+            f"{hashlib.sha256(body).hexdigest()}"
+        )
+        string_to_sign = (
+            f"TC3-HMAC-SHA256\n{timestamp}\n{date}/{service}/tc3_request\n"
+            f"{hashlib.sha256(canonical_request.encode()).hexdigest()}"
+        )
+        expected = tc3_signature(secret_key, date, service, string_to_sign)
+        if not hmac.compare_digest(expected, signature):
+            raise MockError("AuthFailure.SignatureFailure", "签名不匹配")
+
+    def handle(self, action, headers, body):
+        """处理一次 API 调用，返回 Response 字段的内容"""
+        with self.lock:
+            self.stats['requests'][action] = self.stats['requests'].get(action, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            self.verify(headers, body)
+        except MockError:
+            self._count('auth_failures')
+            raise
+        bucket = self.buckets.get(action)
+        if bucket and not bucket.take():
+            self._count('throttled')
+            raise MockError("RequestLimitExceeded", "请求频率超过限制")
+        if self.fail_rate and self.random.random() < self.fail_rate:
+            self._count('injected_failures')
+            raise MockError("InternalError", "模拟的服务端内部错误")
+        try:
+            params = json.loads(body or b"{}")
+        except ValueError:
+            raise MockError("InvalidParameter", "请求体不是合法的 JSON")
+        if action == "CreateRecTask":
+            return self.create_task(params)
+        if action == "DescribeTaskStatus":
+            return self.describe_task(params)
+        raise MockError("InvalidAction", f"不支持的接口 {action}")
+
+    def create_task(self, params):
+        error = None
+        if params.get("SourceType") == 1:
+            if not params.get("Data"):
+                raise MockError("InvalidParameter", "缺少 Data")
+            size = len(base64.b64decode(params["Data"]))
+        elif params.get("SourceType") == 0:
+            if not params.get("Url"):
+                raise MockError("InvalidParameter", "缺少 Url")
+            size, error = self.download(params["Url"])
+        else:
+            raise MockError("InvalidParameter", "SourceType 只能为 0 或 1")
+        duration = size * 8 / (self.audio_kbps * 1000)
+        delay = max(self.min_processing, duration * self.rtf)
+        callback_url = params.get("CallbackUrl")
+        with self.lock:
+            if self.quota_seconds is not None and self.accepted_seconds + duration > self.quota_seconds:
+                self.stats['quota_rejections'] += 1
+                raise MockError("FailedOperation.UserHasNoFreeAmount", "Resource pack exhausted")
+            self.accepted_seconds += duration
+            task_id = self.next_task_id
+            self.next_task_id += 1
+            self.tasks[task_id] = {
+                'duration': duration,
+                'ready_at': time.time() + delay,
+                'failed': error is not None or self.random.random() < self.task_fail_rate,
+                'error': error,
+            }
+            self.stats['tasks_created'] += 1
+            self.stats['upload_bytes'] += size
+            drop = callback_url and self.random.random() < self.callback_drop_rate
+        if callback_url:
+            if drop:
+                self._count('callbacks_dropped')
+            else:
+                timer = threading.Timer(delay, self.send_callback, (task_id, callback_url))
+                timer.daemon = True
+                timer.start()
+        return {"Data": {"TaskId": task_id}}
+
+    def download(self, url):
+        """下载 Url 指向的音频，返回 (字节数, 错误信息)；下载失败的任务以 Status=3 结束"""
+        size = 0
+        try:
+            with urllib.request.urlopen(url, timeout=30) as resp:
+                while True:
+                    chunk = resp.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+        except (OSError, ValueError) as e:
+            self._count('download_failures')
+            return 0, f"音频下载失败: {e}"
+        self._count('download_bytes', size)
+        return size, None
+
+    def describe_task(self, params):
+        task_id = params.get("TaskId")
+        with self.lock:
+            task = self.tasks.get(task_id)
+        if task is None:
+            raise MockError("InvalidParameter", f"任务不存在 {task_id}")
+        return {"Data": self.task_data(task_id, task)}
+
+    def task_data(self, task_id, task):
+        """任务的当前状态，格式与 DescribeTaskStatus 返回的 Data 一致"""
+        data = {"TaskId": task_id, "AudioDuration": round(task['duration'], 3)}
+        if time.time() < task['ready_at']:
+            data.update(Status=1, StatusStr="doing", Result="", ErrorMsg="")
+        elif task['failed']:
+            data.update(Status=3, StatusStr="failed", Result="", ErrorMsg=task['error'] or "模拟的识别失败")
+            with self.lock:
+                if not task.get('reported'):
+                    task['reported'] = True
+                    self.stats['tasks_failed'] += 1
+        else:
+            data.update(Status=2, StatusStr="success", ErrorMsg="", **self.fake_result(task_id, task['duration']))
+            with self.lock:
+                if not task.get('reported'):
+                    task['reported'] = True
+                    self.stats['audio_seconds'] += task['duration']
+        return data
+
+    def send_callback(self, task_id, url):
+        """按腾讯云回调格式（表单 POST）把识别结果推送到 CallbackUrl"""
+        with self.lock:
+            task = self.tasks[task_id]
+        data = self.task_data(task_id, task)
+        fields = {
+            "code": 0 if data["Status"] == 2 else 1,
+            "message": data["ErrorMsg"] or "成功",
+            "requestId": task_id,
+            "appid": 0,
+            "projectid": 0,
+            "text": data.get("Result", ""),
+            "audioTime": data["AudioDuration"],
+            "resultDetail": json.dumps(data.get("ResultDetail") or [], ensure_ascii=False),
+        }
+        body = urllib.parse.urlencode(fields).encode()
+        request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/x-www-form-urlencoded"})
+        try:
+            with urllib.request.urlopen(request, timeout=10) as resp:
+                reply = json.loads(resp.read() or b"{}")
+            self._count('callbacks_sent' if reply.get("code") == 0 else 'callbacks_failed')
+        except (OSError, ValueError):
+            self._count('callbacks_failed')
+
+    @staticmethod
+    def fake_result(task_id, duration):
+        """生成与真实接口格式一致的识别结果（Result 文本和 ResultDetail）"""
+        lines = []
+        details = []
+        start = 0.0
+        index = 0
+        while start < duration:
+            end = min(duration, start + SENTENCE_SECONDS)
+            text = f"任务{task_id}第{index + 1}句。"
+            lines.append(f"[{int(start // 60)}:{start % 60:.3f},{int(end // 60)}:{end % 60:.3f},{index % 2}]  {text}")
+            length_ms = int(end * 1000) - int(start * 1000)
+            details.append({
+                "FinalSentence": text,
+                "StartMs": int(start * 1000),
+                "EndMs": int(end * 1000),
+                "SpeakerId": index % 2,
+                "WordsNum": 2,
+                "Words": [
+                    {"Word": text[:len(text) // 2], "OffsetStartMs": 0, "OffsetEndMs": length_ms // 2},
+                    {"Word": text[len(text) // 2:], "OffsetStartMs": length_ms // 2, "OffsetEndMs": length_ms},
+                ],
+            })
+            start = end
+            index += 1
+        return {"Result": "\n".join(lines) + ("\n" if lines else ""), "ResultDetail": details}
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        action = self.headers.get("X-TC-Action", "")
+        headers = {
+            "Authorization": self.headers.get("Authorization", ""),
+            "X-TC-Timestamp": self.headers.get("X-TC-Timestamp", ""),
+            "content-type": self.headers.get("Content-Type", ""),
+            "host": self.headers.get("Host", ""),
+            "x-tc-action": action.lower(),
+        }
+        request_id = str(uuid.uuid4())
+        try:
+            response = self.server.service.handle(action, headers, body)
+        except MockError as e:
+            response = {"Error": {"Code": e.code, "Message": e.message}}
+        response["RequestId"] = request_id
+        self._send({"Response": response})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send(self.server.service.snapshot())
+        else:
+            self.send_error(404)
+
+    def _send(self, obj):
+        data = json.dumps(obj, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class MockAsrServer:
+    """在后台线程运行的模拟服务，供基准测试在进程内启动
+
+    用法:
+      with MockAsrServer(MockAsrService(latency=0.02)) as server:
+          os.environ["TENCENT_ASR_ENDPOINT"] = server.url
+    """
+
+    def __init__(self, service=None, host="127.0.0.1", port=0):
+        self.service = service or MockAsrService()
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self.service
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-asr", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='腾讯云 ASR 本地模拟服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址（默认 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口（默认 8765）')
+    parser.add_argument('--secret-id', default=DEFAULT_SECRET_ID, help=f'接受的 SecretId（默认 {DEFAULT_SECRET_ID}）')
+    parser.add_argument('--secret-key', default=DEFAULT_SECRET_KEY, help=f'对应的 SecretKey（默认 {DEFAULT_SECRET_KEY}）')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求额外的响应延迟（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='请求返回 InternalError 的概率')
+    parser.add_argument('--task-fail-rate', type=float, default=0.0, help='任务识别失败（Status=3）的概率')
+    parser.add_argument('--qps-create', type=float, default=0, help='CreateRecTask 限频（次/秒，0 表示不限）')
+    parser.add_argument('--qps-describe', type=float, default=0, help='DescribeTaskStatus 限频（次/秒，0 表示不限）')
+    parser.add_argument('--rtf', type=float, default=0.01, help='模拟处理耗时 = 音频时长 × 该系数')
+    parser.add_argument('--min-processing', type=float, default=0.5, help='任务最短处理耗时（秒）')
+    parser.add_argument('--audio-kbps', type=float, default=AUDIO_KBPS, help=f'由字节数估算音频时长所用的码率（默认 {AUDIO_KBPS}）')
+    parser.add_argument('--callback-drop-rate', type=float, default=0.0, help='请求带 CallbackUrl 时不发送回调的概率')
+    parser.add_argument('--quota-seconds', type=float, help='账户可用的音频总秒数，超出后返回额度用完错误')
+    parser.add_argument('--seed', type=int, help='故障注入的随机种子')
+    args = parser.parse_args()
+
+    service = MockAsrService(
+        credentials={args.secret_id: args.secret_key},
+        latency=args.latency,
+        fail_rate=args.fail_rate,
+        task_fail_rate=args.task_fail_rate,
+        qps={"CreateRecTask": args.qps_create, "DescribeTaskStatus": args.qps_describe},
+        rtf=args.rtf,
+        min_processing=args.min_processing,
+        audio_kbps=args.audio_kbps,
+        seed=args.seed,
+        callback_drop_rate=args.callback_drop_rate,
+        quota_seconds=args.quota_seconds,
+    )
+    server = MockAsrServer(service, args.host, args.port)
+    print(f"模拟 ASR 服务已启动: {server.url}（统计信息: {server.url}/stats）")
+    print(f"  export TENCENT_ASR_ENDPOINT={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print()
+        print(json.dumps(service.snapshot(), ensure_ascii=False, indent=2))
+    finally:
+        server.httpd.server_close()
+
+if __name__ == "__main__":
+    main()
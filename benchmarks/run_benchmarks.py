@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+转写流程基准测试
+
+用 ffmpeg 生成合成音频，在本地模拟服务（mock_asr_server.py）上跑完整的
+run_day，统计吞吐量（文件/小时、音频小时/小时）、Python 内存峰值和各接口
+请求数；另有 split_audio、get_audio_duration、adjust_timestamps、save_outputs
+的微基准。
+结果写成 JSON，可用 --compare 与之前版本的结果对比。
+
+用法:
+  python3 benchmarks/run_benchmarks.py --output before.json
+  python3 benchmarks/run_benchmarks.py --output after.json --compare before.json
+  python3 benchmarks/run_benchmarks.py --only micro
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import tencent_asr_batch as asr
+from mock_asr_server import DEFAULT_SECRET_ID, DEFAULT_SECRET_KEY, MockAsrServer, MockAsrService
+
+# === 默认参数 ===
+BITRATE_KBPS = 32              # 合成音频码率，与模拟服务估算时长所用的码率一致
+RUN_DAY_DURATIONS = [60, 120, 180, 300, 450, 600, 900, 1500]  # 各文件时长（秒），超过 4.5MB 的会被切分
+SPLIT_DURATION = 2400          # split_audio 微基准使用的音频时长（秒）
+HEADER_CALLS = 200             # get_audio_duration 每种格式调用次数
+TIMESTAMP_LINES = 20000        # adjust_timestamps / save_outputs 微基准的结果行数
+
+def generate_audio(path, duration, bitrate_kbps=BITRATE_KBPS):
+    """用 ffmpeg 生成 16kHz 单声道的合成音频（正弦波叠加少量噪声）"""
+    subprocess.run([
+        asr.tool_path("ffmpeg"), '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}:sample_rate=16000',
+        '-f', 'lavfi', '-i', f'anoisesrc=amplitude=0.02:duration={duration}:sample_rate=16000',
+        '-filter_complex', 'amix=inputs=2', '-ac', '1', '-ar', '16000',
+        '-b:a', f'{bitrate_kbps}k', str(path)
+    ], check=True)
+    return path
+
+def timed(func, repeat):
+    """重复执行 repeat 次，返回每次耗时（秒）的列表"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+def summarize(times):
+    return {
+        'median_s': round(statistics.median(times), 6),
+        'min_s': round(min(times), 6),
+        'max_s': round(max(times), 6),
+        'repeat': len(times),
+    }
+
+def peak_rss_mb():
+    """进程的常驻内存峰值（MB），不支持的平台返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def reset_clients():
+    """丢弃已创建的客户端和限速器，使新的 API 地址和限速配置生效"""
+    with asr._clients_lock:
+        asr._clients.clear()
+    asr._rate_limiter = None
+
+# === run_day 端到端 ===
+def bench_run_day(work_dir, args):
+    input_dir = work_dir / "run_day_input"
+    output_dir = work_dir / "run_day_output"
+    input_dir.mkdir()
+    durations = RUN_DAY_DURATIONS * args.files_scale
+    for i, duration in enumerate(durations):
+        generate_audio(input_dir / f"bench_{i:03d}_{duration}s.mp3", duration)
+
+    service = MockAsrService(
+        credentials={DEFAULT_SECRET_ID: DEFAULT_SECRET_KEY},
+        latency=args.latency,
+        fail_rate=args.fail_rate,
+        qps={"CreateRecTask": args.mock_qps_create, "DescribeTaskStatus": args.mock_qps_describe},
+        rtf=args.mock_rtf,
+        min_processing=args.mock_min_processing,
+        audio_kbps=BITRATE_KBPS,
+        seed=args.seed,
+    )
+    # 让客户端的轮询节奏与模拟服务的处理耗时匹配，否则测到的只是轮询等待
+    asr.POLL_FIRST_DELAY = args.mock_min_processing
+    asr.POLL_RTF = args.mock_rtf
+    with MockAsrServer(service) as server:
+        asr.API_ENDPOINT = server.url
+        reset_clients()
+        tracemalloc.start()
+        start = time.perf_counter()
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            asr.run_day(1, input_dir, output_dir, output_dir / "temp_segments", output_dir / asr.PROGRESS_DB_NAME,
+                        DEFAULT_SECRET_ID, DEFAULT_SECRET_KEY, "ap-shanghai", auto_confirm=True,
+                        workers=args.workers, cache=None)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = service.snapshot()
+
+    completed = len(asr.ProgressStore(output_dir / asr.PROGRESS_DB_NAME).names("completed"))
+    audio_seconds = sum(durations)
+    return {
+        'files': len(durations),
+        'completed': completed,
+        'audio_hours': round(audio_seconds / 3600, 3),
+        'elapsed_s': round(elapsed, 3),
+        'files_per_hour': round(completed / elapsed * 3600, 1),
+        'audio_hours_per_hour': round(audio_seconds / elapsed, 1),
+        'python_peak_mb': round(peak / (1024 * 1024), 2),
+        'requests': stats['requests'],
+        'throttled': stats['throttled'],
+        'injected_failures': stats['injected_failures'],
+        'auth_failures': stats['auth_failures'],
+        'tasks_created': stats['tasks_created'],
+        'upload_mb': round(stats['upload_bytes'] / (1024 * 1024), 2),
+    }
+
+# === 微基准 ===
+def bench_split_audio(work_dir, args):
+    source = generate_audio(work_dir / "split_source.mp3", SPLIT_DURATION)
+    out_dir = work_dir / "split_output"
+    segments = []
+
+    def run():
+        shutil.rmtree(out_dir, ignore_errors=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            segments[:] = asr.split_audio(source, out_dir)
+
+    result = summarize(timed(run, args.repeat))
+    result.update(audio_seconds=SPLIT_DURATION, segments=len(segments),
+                  source_mb=round(source.stat().st_size / (1024 * 1024), 2))
+    return result
+
+def bench_get_audio_duration(work_dir, args):
+    results = {}
+    base = work_dir / "duration_source.mp3"
+    generate_audio(base, 600)
+    sources = {'.mp3': base}
+    for ext, codec in (('.wav', ['-c:a', 'pcm_s16le']), ('.m4a', ['-c:a', 'aac', '-b:a', '32k']),
+                       ('.flac', ['-c:a', 'flac'])):
+        path = work_dir / f"duration_source{ext}"
+        subprocess.run([asr.tool_path("ffmpeg"), '-y', '-v', 'error', '-i', str(base), *codec, str(path)], check=True)
+        sources[ext] = path
+    for ext, path in sources.items():
+        times = timed(lambda: asr.get_audio_duration(path), HEADER_CALLS)
+        results[ext.lstrip('.')] = {
+            'median_us': round(statistics.median(times) * 1e6, 1),
+            'calls': HEADER_CALLS,
+            'duration': round(asr.get_audio_duration(path), 3),
+        }
+    return results
+
+def bench_adjust_timestamps(work_dir, args):
+    text = "\n".join(
+        f"[{i * 5 // 60}:{i * 5 % 60:.3f},{(i * 5 + 5) // 60}:{(i * 5 + 5) % 60:.3f},{i % 2}]  第{i}句测试文本。"
+        for i in range(TIMESTAMP_LINES)
+    )
+    result = summarize(timed(lambda: asr.adjust_timestamps(text, 1234.5), args.repeat))
+    result['lines'] = TIMESTAMP_LINES
+    return result
+
+def bench_save_outputs(work_dir, args):
+    detail = [
+        {"FinalSentence": f"第{i}句测试文本。", "StartMs": i * 5000, "EndMs": i * 5000 + 5000, "SpeakerId": i % 2,
+         "Words": [{"Word": f"第{i}句", "OffsetStartMs": 0, "OffsetEndMs": 2500},
+                   {"Word": "测试文本。", "OffsetStartMs": 2500, "OffsetEndMs": 5000}]}
+        for i in range(TIMESTAMP_LINES)
+    ]
+    raw = [{"TaskId": 1, "Status": 2, "Result": "", "ResultDetail": detail}]
+    out_dir = work_dir / "save_outputs"
+    formats = tuple(asr.TRANSCRIPT_WRITERS)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            asr.save_outputs(out_dir, Path("bench.mp3"), asr.sentences_from_data(raw[0], 1234500), raw, formats)
+
+    result = summarize(timed(run, args.repeat))
+    result.update(lines=TIMESTAMP_LINES, formats=list(formats),
+                  output_mb=round(sum(p.stat().st_size for p in out_dir.iterdir()) / (1024 * 1024), 2))
+    return result
+
+BENCHMARKS = {
+    'run_day': ('e2e', bench_run_day),
+    'split_audio': ('micro', bench_split_audio),
+    'get_audio_duration': ('micro', bench_get_audio_duration),
+    'adjust_timestamps': ('micro', bench_adjust_timestamps),
+    'save_outputs': ('micro', bench_save_outputs),
+}
+
+# === 结果对比 ===
+def flatten(obj, prefix=""):
+    """把嵌套结果展开成 {'a.b.c': 数值}"""
+    items = {}
+    for key, value in obj.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[name] = value
+    return items
+
+def compare(current, baseline):
+    """打印与基线结果相比各指标的变化"""
+    now = flatten(current['results'])
+    before = flatten(baseline['results'])
+    print(f"\n与基线对比（{baseline['meta'].get('git_commit') or '未知版本'} → {current['meta'].get('git_commit') or '当前'}）:")
+    for name in sorted(now):
+        if name not in before:
+            continue
+        old, new = before[name], now[name]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "  n/a"
+        print(f"  {name:<50} {old:>12} → {new:<12} {change}")
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='转写流程基准测试（使用本地模拟服务，不消耗真实额度）')
+    parser.add_argument('--only', nargs='+', help='只运行指定的基准（名称，或 e2e / micro）')
+    parser.add_argument('--output', '-o', help='结果 JSON 文件（默认只打印到标准输出）')
+    parser.add_argument('--compare', help='与之前保存的结果 JSON 对比')
+    parser.add_argument('--repeat', type=int, default=3, help='微基准重复次数（默认 3）')
+    parser.add_argument('--files-scale', type=int, default=1, help=f'run_day 的文件数倍数（每倍 {len(RUN_DAY_DURATIONS)} 个）')
+    parser.add_argument('--workers', '-j', type=int, default=asr.MAX_WORKERS, help=f'run_day 并发数（默认 {asr.MAX_WORKERS}）')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟服务每个请求的延迟（秒）')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='模拟服务返回 InternalError 的概率')
+    parser.add_argument('--mock-rtf', type=float, default=0.002, help='模拟处理耗时 = 音频时长 × 该系数')
+    parser.add_argument('--mock-min-processing', type=float, default=0.3, help='模拟任务最短处理耗时（秒）')
+    parser.add_argument('--mock-qps-create', type=float, default=20, help='模拟服务 CreateRecTask 限频')
+    parser.add_argument('--mock-qps-describe', type=float, default=50, help='模拟服务 DescribeTaskStatus 限频')
+    parser.add_argument('--seed', type=int, default=1, help='故障注入的随机种子')
+    args = parser.parse_args()
+
+    try:
+        subprocess.run([asr.tool_path("ffmpeg"), '-version'], capture_output=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        print("未找到 ffmpeg，无法生成合成音频", file=sys.stderr)
+        sys.exit(1)
+
+    selected = [name for name, (group, _) in BENCHMARKS.items()
+                if not args.only or name in args.only or group in args.only]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="asr_bench_") as tmp:
+        for name in selected:
+            work_dir = Path(tmp) / name
+            work_dir.mkdir()
+            print(f"运行 {name} ...", file=sys.stderr)
+            results[name] = BENCHMARKS[name][1](work_dir, args)
+
+    report = {
+        'meta': {
+            'git_commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'peak_rss_mb': peak_rss_mb(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding='utf-8')
+        print(f"结果已写入 {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,11 @@ GitHub: https://github.com/twischen-dot/tencent-asr-batch
 使用方法：
   python3 tencent_asr_batch.py --input ./audio --output ./transcripts
   python3 tencent_asr_batch.py --status
+
+作为库使用（导入时不查找 ffmpeg、不读取密钥，也不导入 requests）：
+  from tencent_asr_batch import transcribe_many
+  for result in transcribe_many(["a.mp3", "b.m4a"]):
+      print(result.path, result.text if result.ok else result.error)
 """
 import os
 import sys
@@ -17,31 +22,56 @@ import time
 import base64
 import hmac
 import hashlib
+import logging
+import mimetypes
+import mmap
+import sqlite3
 import subprocess
 import shutil
+import tempfile
 import argparse
+import re
+import fnmatch
+import csv
+from glob import escape as glob_escape
+import heapq
+from bisect import bisect_left, bisect_right
+import random
+import secrets
+import socket
+import threading
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+requests = None  # 首次发送请求时由 load_requests() 导入
 
-try:
-    import requests
-except ImportError:
-    print("正在安装 requests...")
-    os.system(f"{sys.executable} -m pip install requests -q")
-    import requests
+def load_requests():
+    """延迟导入 requests，只做文件扫描或 --status 时不需要加载"""
+    global requests
+    if requests is None:
+        import requests as module
+        requests = module
+    return requests
 
 # === 从环境变量读取配置 ===
+DEFAULT_REGION = "ap-shanghai"
+
 def get_config():
     """获取配置，延迟检查以便显示帮助信息"""
     secret_id = os.getenv("TENCENT_SECRET_ID")
     secret_key = os.getenv("TENCENT_SECRET_KEY")
-    region = os.getenv("TENCENT_REGION", "ap-shanghai")
+    region = os.getenv("TENCENT_REGION", DEFAULT_REGION)
     
     if not secret_id or not secret_key:
         return None, None, region
     return secret_id, secret_key, region
 
-SECRET_ID, SECRET_KEY, REGION = get_config()
+# 由 main() 从环境变量读取；作为库使用时直接传入密钥
+SECRET_ID, SECRET_KEY, REGION = None, None, DEFAULT_REGION
 
 # === 支持的音频格式 ===
 SUPPORTED = {".m4a", ".mp3", ".wav", ".flac", ".aac", ".ogg"}
@@ -49,73 +79,469 @@ SUPPORTED = {".m4a", ".mp3", ".wav", ".flac", ".aac", ".ogg"}
 # === 转写参数 ===
 ENGINE_MODEL = "16k_zh"
 SPEAKER_NUM = 2
-POLL_SECONDS = 5
-MAX_TRIES = 120
+SPEAKER_DIARIZATION = 1
+RES_TEXT_FORMAT = 2        # 2: 返回带词级时间戳和标点的 ResultDetail
+OUTPUT_FORMATS = ("txt",)  # 默认写出的结果格式（另支持 srt、vtt、jsonl）
+
+# === 轮询配置 ===
+POLL_FIRST_DELAY = 3      # 首次查询的基础等待（秒）
+POLL_RTF = 0.05           # 预估服务端处理耗时 ≈ 音频时长 × 该系数
+POLL_BACKOFF = 1.5        # 每次未完成后查询间隔的放大倍数
+POLL_MAX_INTERVAL = 60    # 查询间隔上限（秒）
+POLL_JITTER = 0.2         # 查询间隔随机抖动比例（±20%）
+POLL_TIMEOUT_BASE = 600   # 超时时间 = 基础值 + 音频时长 × 系数
+POLL_TIMEOUT_FACTOR = 2
 
 # === 免费额度配置 ===
 FREE_HOURS_PER_DAY = 10  # 每天免费10小时
+PAID_HOURS_PER_DAY = 0   # 每天允许超出免费额度的付费时长（小时），0 表示只用免费额度
+# 额度或资源包用完时接口返回的错误码片段（如 FailedOperation.UserHasNoFreeAmount）
+QUOTA_ERROR_MARKERS = ("NoFreeAmount", "NoAmount", "ResourcePack")
 MAX_FILE_SIZE_MB = 4.5   # 切分阈值
-SEGMENT_DURATION = 180   # 每段3分钟
+SEGMENT_SIZE_RATIO = 0.92  # 片段目标大小占切分阈值的比例（留出封装开销余量）
+MIN_SEGMENT_DURATION = 30  # 片段时长下限（秒）
+SPLIT_MAX_ATTEMPTS = 3     # 片段仍超限时缩短时长重切的次数上限
+
+BEIJING_TZ = timezone(timedelta(hours=8))  # 免费额度按北京时间自然日重置
+
+# === 静音裁剪（--trim-silence） ===
+SILENCE_NOISE_DB = -35       # 低于该音量视为静音（dB）
+SILENCE_MIN_DURATION = 0.5   # 可作为切分点的最短静音（秒）
+SILENCE_DROP_DURATION = 3.0  # 长于该时长的静音不上传（秒）
+SILENCE_PADDING = 0.3        # 丢弃静音时两侧各保留的时长（秒）
+SILENCE_MIN_KEEP = 0.8       # 长静音之间短于该时长的有声区间（咔嗒声等，含两侧保留）不上传（秒）
+SILENCE_MIN_SAVING = 0.05    # 无需切分的文件，静音占比低于该值时整体上传
+
+# === 回调模式（--callback-url） ===
+CALLBACK_LISTEN = "0.0.0.0:8780"   # 本地接收回调的监听地址
+CALLBACK_SAFETY_DELAY = 300        # 回调模式下，预计完成后再等多久才开始兜底查询（秒）
+CALLBACK_SAFETY_INTERVAL = 300     # 兜底查询的最小间隔（秒）
+# 登记前先到达的回调最多暂存多久、多少条；未知或伪造 TaskId 的回调过期即丢弃，
+# 丢弃的真实任务仍会由兜底查询取得结果
+CALLBACK_EARLY_TTL = 600
+CALLBACK_EARLY_MAX = 1000
+CALLBACK_MAX_BODY = 16 * 1024 * 1024   # 回调请求体上限（字节），超过返回 413
+
+# === URL 上传模式（--url-source） ===
+URL_LISTEN = "0.0.0.0:8781"        # 内置文件服务的监听地址
+URL_LINK_TTL = 6 * 3600            # 签名链接有效期（秒），需覆盖服务端排队和下载的时间
+URL_MAX_FILE_SIZE_MB = 1024        # URL 方式单个文件的大小上限（腾讯云限制 1GB）
+URL_MAX_DURATION = 5 * 3600        # URL 方式单个文件的时长上限（腾讯云限制 5 小时）
+URL_CHUNK_SIZE = 256 * 1024        # 文件服务每次发送的字节数
+
+# === 预处理流水线 ===
+PREP_WORKERS = os.cpu_count() or 2   # 同时进行转码/切分的文件数（实际工作在 ffmpeg 子进程中）
+PREP_LOOKAHEAD = 4                   # 除正在上传的文件外，最多提前准备的文件数
+PREP_DISK_BUDGET_MB = 2048           # 已准备但未上传完的临时文件（转码/切分输出）总大小上限
+
+# === 转码（--transcode） ===
+# 码率阶梯（kbps）从高到低，取能让整个文件一次上传的最高一档，最低一档为语音识别可接受的下限
+TRANSCODE_FORMATS = {
+    'opus': {'ext': '.ogg', 'codec': 'libopus', 'bitrates': [32, 24, 16], 'options': ['-application', 'voip']},
+    'mp3': {'ext': '.mp3', 'codec': 'libmp3lame', 'bitrates': [48, 32, 24], 'options': []},
+}
+
+# === 守护模式 ===
+WATCH_INTERVAL = 10       # 轮询输入目录的间隔（秒）
+WATCH_SETTLE = 30         # 文件多久未修改才视为已写完（秒）
+WATCH_RESET_MARGIN = 5    # 额度用完后，等到北京时间零点再多等的秒数
+
+# === 多进程协作 ===
+LEASE_DIR_NAME = ".leases"   # 租约文件目录（在共享的输出目录下）
+LEASE_TTL = 300              # 租约有效期（秒），进程崩溃后最多这么久其他 worker 可接手
+LEASE_RENEW_INTERVAL = 60    # 处理中的文件多久续约一次（秒）
+
+# === 结果缓存 ===
+CACHE_DIR_NAME = ".asr_cache"        # 默认保存在输出目录下
+CACHE_MAX_MB = 512                   # 缓存总大小上限，超过后按 LRU 淘汰
+FINGERPRINT_FULL_BYTES = 4 * 1024 * 1024   # 不超过该大小的文件整体计算指纹
+FINGERPRINT_BLOCKS = 16              # 大文件均匀抽取的块数
+FINGERPRINT_BLOCK_BYTES = 64 * 1024  # 每块大小
+
+# === 并发配置 ===
+MAX_WORKERS = 4          # 同时处理（上传/轮询中）的文件数
+SEGMENT_WORKERS = 4      # 单个大文件同时转写的片段数
+PROBE_WORKERS = 8        # 扫描时并行探测音频信息的进程数
+
+# === 进度存储 ===
+PROGRESS_DB_NAME = "progress.db"          # 保存在输出目录
+LEGACY_PROGRESS_NAME = "progress.json"    # 旧版进度文件，首次运行时自动迁移
+# WAL 依赖共享内存映射，在网络文件系统上不可用；进度库位于这些文件系统上时改用 DELETE 日志
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "fuse.sshfs", "glusterfs",
+                       "fuse.glusterfs", "ceph", "fuse.ceph", "lustre", "afs", "gpfs")
+
+# === 运行指标 ===
+EVENT_LOG_NAME = "events.jsonl"      # 保存在输出目录，每行一个 JSON 事件
+EVENT_TAIL_BYTES = 1024 * 1024       # --status 从事件日志末尾读取的字节数
+
+# === 扫描索引 ===
+SCAN_INDEX_NAME = "scan_index.json"  # 保存在输出目录，按路径 + 大小 + 修改时间缓存探测结果
+SCAN_INDEX_VERSION = 2
+HEADER_READ_BYTES = 64 * 1024        # 解析音频头时单次最多读取的字节数
+
+# === API 配置 ===
+API_HOST = "asr.tencentcloudapi.com"
+API_VERSION = "2019-06-14"
+API_ENDPOINT = None        # 覆盖 API 地址，如本地模拟服务 http://127.0.0.1:8765；默认取环境变量 TENCENT_ASR_ENDPOINT
+API_RETRIES = 4            # 临时错误的最大重试次数
+RETRY_BASE_DELAY = 1       # 重试退避的基础等待（秒）
+RETRY_MAX_DELAY = 30       # 重试退避的等待上限（秒）
+HTTP_POOL_SIZE = 32        # 每个客户端的 keep-alive 连接数
+# 可重试的错误码（含其子错误码，如 RequestLimitExceeded.UinLimitExceeded）
+RETRYABLE_ERROR_CODES = ("RequestLimitExceeded", "InternalError", "ServiceUnavailable", "AuthFailure.SignatureExpire")
+# 非幂等的动作：超时、5xx、InternalError 时服务端可能已经建好（并计费）任务，重试会重复提交，
+# 只重试连接失败、限频等确定未被受理的错误
+NON_IDEMPOTENT_ACTIONS = ("CreateRecTask",)
+NON_IDEMPOTENT_RETRYABLE_CODES = ("RequestLimitExceeded", "AuthFailure.SignatureExpire")
+
+# === 限频配置 ===
+# 各 API 动作的请求速率上限（次/秒），默认取腾讯云录音文件识别的默认限频
+ACTION_QPS = {"CreateRecTask": 20, "DescribeTaskStatus": 50}
+THROTTLE_BACKOFF = 0.5     # 收到限频错误时速率乘以该系数
+THROTTLE_RECOVERY = 0.05   # 每次成功后速率恢复配置上限的比例
+THROTTLE_MIN_QPS = 0.5     # 自动降速的下限（次/秒）
+
+# === 上传配置 ===
+UPLOAD_CHUNK_BYTES = 3 * 64 * 1024   # 流式 base64 编码的块大小（必须是 3 的倍数）
 
 # === 工具路径 ===
+# 除 PATH 外额外查找的目录（launchd 等环境的 PATH 通常不含 Homebrew）
+TOOL_SEARCH_PATHS = ["/opt/homebrew/bin", "/opt/homebrew/sbin", "/usr/local/bin", "/usr/bin", "/bin", "/usr/sbin", "/sbin"]
+
 def find_tool(tool_name):
-    """查找工具的完整路径"""
-    # 确保 PATH 包含常见路径
-    os.environ['PATH'] = '/opt/homebrew/bin:/opt/homebrew/sbin:/usr/local/bin:/usr/bin:/bin:/usr/sbin:/sbin:' + os.environ.get('PATH', '')
-    
-    common_paths = [
-        "/opt/homebrew/bin",
-        "/usr/local/bin",
-        "/usr/bin",
-        "/bin"
-    ]
-    
-    tool_path = shutil.which(tool_name)
-    if tool_path:
-        return tool_path
-    
-    for path in common_paths:
-        full_path = os.path.join(path, tool_name)
-        if os.path.exists(full_path) and os.access(full_path, os.X_OK):
-            return full_path
-    
-    return None
+    """查找工具的完整路径（不修改当前进程的 PATH）"""
+    search_path = os.pathsep.join(TOOL_SEARCH_PATHS + [os.environ.get('PATH', '')])
+    return shutil.which(tool_name, path=search_path)
+
+_tool_paths = {}
+
+def tool_path(tool_name):
+    """工具路径，首次使用时查找并缓存；找不到时返回工具名，由调用处报错"""
+    path = _tool_paths.get(tool_name)
+    if path is None:
+        path = _tool_paths[tool_name] = find_tool(tool_name) or tool_name
+    return path
 
-FFMPEG = find_tool("ffmpeg") or "ffmpeg"
-FFPROBE = find_tool("ffprobe") or "ffprobe"
+def __getattr__(name):
+    # 兼容旧的模块常量 FFMPEG / FFPROBE，访问时才查找
+    if name in ("FFMPEG", "FFPROBE"):
+        return tool_path(name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # === 颜色输出 ===
+# 静默期间（见 quiet_console）以下输出改为记录到这个 logger，不再打印到终端
+logger = logging.getLogger("tencent_asr_batch")
+_quiet = 0
+_quiet_lock = threading.Lock()
+
+@contextmanager
+def quiet_console():
+    """期间本进程的 print_* 输出改走 logging（库调用时不污染宿主程序的标准输出）"""
+    global _quiet
+    with _quiet_lock:
+        _quiet += 1
+    try:
+        yield
+    finally:
+        with _quiet_lock:
+            _quiet -= 1
+
+def _output(level, label, msg):
+    if _quiet:
+        logger.log(level, msg)
+    else:
+        print(f"{label} {msg}")
+
 def print_info(msg):
-    print(f"\033[0;32m[信息]\033[0m {msg}")
+    _output(logging.INFO, "\033[0;32m[信息]\033[0m", msg)
 
 def print_error(msg):
-    print(f"\033[0;31m[错误]\033[0m {msg}")
+    _output(logging.ERROR, "\033[0;31m[错误]\033[0m", msg)
 
 def print_step(msg):
-    print(f"\033[0;34m[步骤]\033[0m {msg}")
+    _output(logging.INFO, "\033[0;34m[步骤]\033[0m", msg)
 
 def print_warning(msg):
-    print(f"\033[1;33m[警告]\033[0m {msg}")
+    _output(logging.WARNING, "\033[1;33m[警告]\033[0m", msg)
 
 def print_success(msg):
-    print(f"\033[0;32m[成功]\033[0m {msg}")
+    _output(logging.INFO, "\033[0;32m[成功]\033[0m", msg)
 
 # === 时长工具 ===
-def get_audio_duration(file_path):
-    """获取音频时长（秒）"""
+# === 音频头解析（纯 Python，读取少量字节即可得到时长） ===
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 2.5: [11025, 12000, 8000]}
+AAC_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+def _skip_id3(f):
+    """跳过 ID3v2 标签，返回音频数据起始偏移"""
+    f.seek(0)
+    head = f.read(10)
+    if len(head) == 10 and head[:3] == b'ID3':
+        size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        return 10 + size + (10 if head[5] & 0x10 else 0)
+    return 0
+
+def _parse_mp3_frame_header(b):
+    """解析 MPEG Layer III 帧头，返回 (version, bitrate_kbps, sample_rate, padding, mono) 或 None"""
+    if len(b) < 4 or b[0] != 0xFF or (b[1] & 0xE0) != 0xE0:
+        return None
+    version = {3: 1, 2: 2, 0: 2.5}.get((b[1] >> 3) & 0x03)
+    layer = (b[1] >> 1) & 0x03
+    br_index = b[2] >> 4
+    sr_index = (b[2] >> 2) & 0x03
+    if version is None or layer != 1 or br_index in (0, 15) or sr_index == 3:
+        return None
+    bitrate = MP3_BITRATES[1 if version == 1 else 2][br_index]
+    sample_rate = MP3_SAMPLE_RATES[version][sr_index]
+    return version, bitrate, sample_rate, (b[2] >> 1) & 0x01, (b[3] >> 6) == 3
+
+def _mp3_frame_length(version, bitrate, sample_rate, padding):
+    return (144 if version == 1 else 72) * bitrate * 1000 // sample_rate + padding
+
+def _read_mp3_header(f, file_size):
+    start = _skip_id3(f)
+    f.seek(start)
+    buf = f.read(HEADER_READ_BYTES)
+    # 找到第一个后面紧跟另一个合法帧头的同步字，避免误判
+    for i in range(len(buf) - 4):
+        hdr = _parse_mp3_frame_header(buf[i:i + 4])
+        if not hdr:
+            continue
+        version, bitrate, sample_rate, padding, mono = hdr
+        frame_len = _mp3_frame_length(version, bitrate, sample_rate, padding)
+        if i + frame_len + 4 <= len(buf) and not _parse_mp3_frame_header(buf[i + frame_len:i + frame_len + 4]):
+            continue
+        break
+    else:
+        return None
+    samples_per_frame = 1152 if version == 1 else 576
+    frame = buf[i:i + frame_len]
+    
+    # Xing/Info（VBR 或 LAME CBR）：位于 side info 之后
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    xing = frame[4 + side_info:4 + side_info + 12]
+    if xing[:4] in (b'Xing', b'Info') and int.from_bytes(xing[4:8], 'big') & 0x01:
+        frames = int.from_bytes(xing[8:12], 'big')
+        duration = frames * samples_per_frame / sample_rate
+    # VBRI（Fraunhofer 编码器）：固定位于帧头后 32 字节
+    elif frame[36:40] == b'VBRI':
+        frames = int.from_bytes(frame[50:54], 'big')
+        duration = frames * samples_per_frame / sample_rate
+    else:
+        # 没有 VBR 头时按 CBR 计算
+        audio_bytes = file_size - start - i
+        f.seek(max(0, file_size - 128))
+        if f.read(3) == b'TAG':
+            audio_bytes -= 128
+        duration = audio_bytes * 8 / (bitrate * 1000)
+    return {'duration': duration, 'codec': 'mp3', 'bitrate': int(file_size * 8 / duration) if duration else 0}
+
+def _read_wav_header(f, file_size):
+    f.seek(0)
+    head = f.read(12)
+    if head[:4] != b'RIFF' or head[8:12] != b'WAVE':
+        return None
+    fmt = None
+    pos = 12
+    while pos + 8 <= min(file_size, HEADER_READ_BYTES):
+        f.seek(pos)
+        chunk = f.read(8)
+        chunk_id, size = chunk[:4], int.from_bytes(chunk[4:8], 'little')
+        if chunk_id == b'fmt ':
+            fmt = f.read(16)
+        elif chunk_id == b'data':
+            if fmt is None:
+                return None
+            audio_format = int.from_bytes(fmt[0:2], 'little')
+            byte_rate = int.from_bytes(fmt[8:12], 'little')
+            bits = int.from_bytes(fmt[14:16], 'little')
+            # 流式写入的 WAV 可能未回填 data 长度，按文件实际大小计算
+            if size in (0, 0xFFFFFFFF) or pos + 8 + size > file_size:
+                size = file_size - pos - 8
+            if not byte_rate:
+                return None
+            codec = {1: f'pcm_s{bits}le', 3: f'pcm_f{bits}le'}.get(audio_format, f'wav_0x{audio_format:04x}')
+            if audio_format == 1 and bits == 8:
+                codec = 'pcm_u8'
+            return {'duration': size / byte_rate, 'codec': codec, 'bitrate': byte_rate * 8}
+        pos += 8 + size + (size & 1)
+    return None
+
+def _read_flac_header(f, file_size):
+    start = _skip_id3(f)
+    f.seek(start)
+    head = f.read(42)
+    if head[:4] != b'fLaC' or (head[4] & 0x7F) != 0:
+        return None
+    info = head[8:42]
+    sample_rate = (info[10] << 12) | (info[11] << 4) | (info[12] >> 4)
+    total_samples = ((info[13] & 0x0F) << 32) | int.from_bytes(info[14:18], 'big')
+    if not sample_rate or not total_samples:
+        return None
+    duration = total_samples / sample_rate
+    return {'duration': duration, 'codec': 'flac', 'bitrate': int(file_size * 8 / duration)}
+
+def _find_mp4_atom(f, start, end, name):
+    """在 [start, end) 范围内查找指定 atom，返回 (内容起始, 内容结束)"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        head = f.read(8)
+        if len(head) < 8:
+            return None
+        size = int.from_bytes(head[:4], 'big')
+        header_len = 8
+        if size == 1:
+            size = int.from_bytes(f.read(8), 'big')
+            header_len = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_len:
+            return None
+        if head[4:8] == name:
+            return pos + header_len, pos + size
+        pos += size
+    return None
+
+def _read_m4a_header(f, file_size):
+    moov = _find_mp4_atom(f, 0, file_size, b'moov')
+    if not moov:
+        return None
+    mvhd = _find_mp4_atom(f, moov[0], moov[1], b'mvhd')
+    if not mvhd:
+        return None
+    f.seek(mvhd[0])
+    body = f.read(32)
+    if body[0] == 1:
+        timescale = int.from_bytes(body[20:24], 'big')
+        length = int.from_bytes(body[24:32], 'big')
+    else:
+        timescale = int.from_bytes(body[12:16], 'big')
+        length = int.from_bytes(body[16:20], 'big')
+    if not timescale:
+        return None
+    duration = length / timescale
+    
+    # 编码取第一个 trak 的 stsd 首个条目
+    codec = 'aac'
+    box = moov
+    for name in (b'trak', b'mdia', b'minf', b'stbl', b'stsd'):
+        box = _find_mp4_atom(f, box[0], box[1], name)
+        if not box:
+            break
+    else:
+        f.seek(box[0] + 12)
+        codec = {b'mp4a': 'aac', b'alac': 'alac', b'Opus': 'opus', b'fLaC': 'flac'}.get(f.read(4), codec)
+    return {'duration': duration, 'codec': codec, 'bitrate': int(file_size * 8 / duration) if duration else 0}
+
+def _read_ogg_header(f, file_size):
+    f.seek(0)
+    first = f.read(HEADER_READ_BYTES)
+    if first[:4] != b'OggS':
+        return None
+    packet = first[27 + first[26]:]
+    if packet[:7] == b'\x01vorbis':
+        codec, rate, pre_skip = 'vorbis', int.from_bytes(packet[12:16], 'little'), 0
+    elif packet[:8] == b'OpusHead':
+        codec, rate, pre_skip = 'opus', 48000, int.from_bytes(packet[10:12], 'little')
+    else:
+        return None
+    # 最后一个 Ogg 页的 granule position 即总采样数
+    f.seek(max(0, file_size - HEADER_READ_BYTES))
+    tail = f.read(HEADER_READ_BYTES)
+    pos = tail.rfind(b'OggS')
+    while pos >= 0:
+        granule = int.from_bytes(tail[pos + 6:pos + 14], 'little', signed=True)
+        if granule > 0:
+            duration = max(0, granule - pre_skip) / rate
+            return {'duration': duration, 'codec': codec, 'bitrate': int(file_size * 8 / duration) if duration else 0}
+        pos = tail.rfind(b'OggS', 0, pos)
+    return None
+
+def _read_aac_header(f, file_size):
+    # ADTS 没有总时长字段：扫描开头若干帧求平均帧长，按文件大小估算
+    start = _skip_id3(f)
+    f.seek(start)
+    buf = f.read(HEADER_READ_BYTES)
+    pos = frames = 0
+    sample_rate = None
+    while pos + 7 <= len(buf):
+        if buf[pos] != 0xFF or (buf[pos + 1] & 0xF6) != 0xF0:
+            return None
+        sr_index = (buf[pos + 2] >> 2) & 0x0F
+        if sr_index >= len(AAC_SAMPLE_RATES):
+            return None
+        sample_rate = AAC_SAMPLE_RATES[sr_index]
+        frame_len = ((buf[pos + 3] & 0x03) << 11) | (buf[pos + 4] << 3) | (buf[pos + 5] >> 5)
+        if frame_len < 7 or pos + frame_len > len(buf):
+            break
+        pos += frame_len
+        frames += 1
+    if not frames:
+        return None
+    duration = (file_size - start) / (pos / frames) * 1024 / sample_rate
+    return {'duration': duration, 'codec': 'aac', 'bitrate': int(file_size * 8 / duration)}
+
+HEADER_READERS = {
+    '.wav': _read_wav_header,
+    '.mp3': _read_mp3_header,
+    '.flac': _read_flac_header,
+    '.m4a': _read_m4a_header,
+    '.ogg': _read_ogg_header,
+    '.aac': _read_aac_header,
+}
+
+def read_audio_header(file_path):
+    """从文件头读取时长、编码和码率，无法解析时返回 None"""
+    reader = HEADER_READERS.get(Path(file_path).suffix.lower())
+    if reader is None:
+        return None
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            info = reader(f, file_size)
+    except (OSError, IndexError, ValueError, ZeroDivisionError):
+        return None
+    if info and info['duration'] > 0:
+        return info
+    return None
+
+def probe_audio(file_path):
+    """读取时长（秒）、编码和码率（bit/s），失败时对应字段为 0/None
+    
+    优先解析文件头，只有无法解析时才启动 ffprobe。
+    """
+    info = read_audio_header(file_path)
+    if info:
+        return info
+    info = {'duration': 0, 'codec': None, 'bitrate': 0}
     try:
         result = subprocess.run(
-            [FFPROBE, '-v', 'quiet', '-show_entries', 'format=duration',
-             '-of', 'default=noprint_wrappers=1:nokey=1', str(file_path)],
+            [tool_path("ffprobe"), '-v', 'quiet', '-select_streams', 'a:0',
+             '-show_entries', 'format=duration,bit_rate:stream=codec_name',
+             '-of', 'json', str(file_path)],
             capture_output=True, text=True, timeout=10
         )
         if result.returncode == 0 and result.stdout.strip():
-            duration = result.stdout.strip()
-            if duration != 'N/A':
-                return float(duration)
+            data = json.loads(result.stdout)
+            fmt = data.get('format', {})
+            streams = data.get('streams') or [{}]
+            if fmt.get('duration', 'N/A') != 'N/A':
+                info['duration'] = float(fmt['duration'])
+            if fmt.get('bit_rate', 'N/A') != 'N/A':
+                info['bitrate'] = int(fmt['bit_rate'])
+            info['codec'] = streams[0].get('codec_name')
     except Exception:
         pass
-    return 0
+    return info
+
+def get_audio_duration(file_path):
+    """获取音频时长（秒）"""
+    return probe_audio(file_path)['duration']
 
 def format_duration(seconds):
     """格式化时长"""
@@ -128,318 +554,2674 @@ def format_duration(seconds):
         return f"{minutes}分{secs}秒"
     return f"{secs}秒"
 
+# === 文件工具 ===
+def temp_path(path):
+    """原子写入 path 用的临时文件名
+    
+    带上主机名、进程号和线程号：多个进程（可能在不同主机上）共用输出目录时，
+    各自写自己的临时文件再 os.replace，不会互相覆盖或把对方的临时文件改走。
+    """
+    path = Path(path)
+    return path.with_name(f"{path.name}.{socket.gethostname()}-{os.getpid()}-{threading.get_ident()}.tmp")
+
+def filesystem_type(path):
+    """path 所在文件系统的类型（读取 /proc/mounts），无法判断时返回 None"""
+    try:
+        with open("/proc/mounts", 'r', encoding='utf-8') as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return None
+    path = str(Path(path).resolve())
+    best, fs_type = "", None
+    for mount_point, mount_type in mounts:
+        # 挂载点中的空格等字符以八进制转义，如 \040
+        mount_point = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), mount_point)
+        inside = path == mount_point or path.startswith(mount_point.rstrip('/') + '/')
+        if inside and len(mount_point) >= len(best):
+            best, fs_type = mount_point, mount_type
+    return fs_type
+
 # === 进度管理 ===
+class ProgressStore:
+    """基于 SQLite 的进度存储
+    
+    每个文件一行，状态更新是单行写入；WAL 模式下崩溃不会损坏已提交的记录，
+    多个线程（各自持有连接）或多个进程可以同时写入。首次打开时自动导入
+    同目录下旧版的 progress.json。
+    
+    journal_mode 默认自动选择：本地磁盘用 WAL；网络文件系统（NFS、SMB 等，
+    见 NETWORK_FILESYSTEMS）不支持 WAL 的共享内存，改用 DELETE 日志，
+    依赖文件系统的文件锁在多台机器间互斥。
+    """
+    
+    def __init__(self, db_path, journal_mode=None):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        if journal_mode is None:
+            journal_mode = "DELETE" if filesystem_type(self.db_path.parent) in NETWORK_FILESYSTEMS else "WAL"
+        self.journal_mode = journal_mode.upper()
+        self._local = threading.local()
+        conn = self._conn()
+        with conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    name TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    content_hash TEXT,
+                    duration REAL NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS files_status ON files(status);
+                CREATE TABLE IF NOT EXISTS segments (
+                    file_name TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    source_sig TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    start_time REAL NOT NULL,
+                    duration REAL NOT NULL,
+                    task_id INTEGER,
+                    result TEXT,
+                    PRIMARY KEY (file_name, idx)
+                );
+                CREATE TABLE IF NOT EXISTS usage (
+                    task_id TEXT PRIMARY KEY,
+                    day TEXT NOT NULL,
+                    seconds REAL NOT NULL,
+                    recorded_at TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS usage_day ON usage(day);
+                CREATE TABLE IF NOT EXISTS quota_exhausted (
+                    account TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    recorded_at TEXT NOT NULL,
+                    PRIMARY KEY (account, day)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            """)
+        self._ensure_column("segments", "account", "TEXT")
+        self._ensure_column("segments", "offsets", "TEXT")
+        self._ensure_column("usage", "account", "TEXT")
+        self._ensure_column("usage", "file_name", "TEXT")
+        self._ensure_column("usage", "estimated", "REAL")
+        self._migrate_json(self.db_path.with_name(LEGACY_PROGRESS_NAME))
+    
+    def _ensure_column(self, table, column, decl):
+        """给旧版数据库补上新增的列"""
+        conn = self._conn()
+        columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            try:
+                with conn:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            except sqlite3.OperationalError as e:
+                # 其他进程同时打开数据库时可能已经加上了
+                if "duplicate column" not in str(e):
+                    raise
+    
+    def _conn(self):
+        """每个线程一个连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30)
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            # 只有 WAL 下 NORMAL 才不会因崩溃损坏数据库
+            conn.execute("PRAGMA synchronous=" + ("NORMAL" if self.journal_mode == "WAL" else "FULL"))
+            self._local.conn = conn
+        return conn
+    
+    def _migrate_json(self, json_file):
+        """导入旧版 progress.json，导入后改名为 progress.json.migrated"""
+        if not json_file.exists():
+            return
+        try:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except (OSError, ValueError) as e:
+            print_warning(f"无法读取旧版进度文件 {json_file}: {e}")
+            return
+        now = legacy.get("last_update") or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = self._conn()
+        with conn:
+            # 先写失败再写完成：同一文件失败后又完成的，以完成为准
+            for status in ("failed", "completed"):
+                conn.executemany(
+                    "INSERT OR REPLACE INTO files (name, status, updated_at) VALUES (?, ?, ?)",
+                    [(name, status, now) for name in legacy.get(status, [])]
+                )
+        os.replace(json_file, json_file.with_name(json_file.name + ".migrated"))
+        print_info(f"已将 {json_file.name} 迁移到 {self.db_path.name}")
+    
+    def _set(self, name, status, duration=0, content_hash=None, error=None):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO files (name, status, content_hash, duration, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (name, status, content_hash, duration, error, now)
+            )
+    
+    def mark_completed(self, name, duration=0, content_hash=None):
+        """记录文件转写完成"""
+        self._set(name, "completed", duration, content_hash)
+    
+    def mark_failed(self, name, error=None, content_hash=None):
+        """记录文件转写失败"""
+        self._set(name, "failed", content_hash=content_hash, error=str(error) if error else None)
+    
+    def mark_partial(self, name):
+        """记录文件已完成部分片段（跨天切分）"""
+        self._set(name, "partial")
+    
+    def mark_deferred(self, name, error=None, content_hash=None):
+        """记录文件因额度用完未能提交，额度重置后重试"""
+        self._set(name, "deferred", content_hash=content_hash, error=str(error) if error else None)
+    
+    def status_of(self, name):
+        """返回文件状态（completed/failed/partial/deferred），没有记录时返回 None"""
+        row = self._conn().execute("SELECT status FROM files WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+    
+    def names(self, status):
+        """指定状态的所有文件名"""
+        rows = self._conn().execute("SELECT name FROM files WHERE status = ?", (status,))
+        return {row[0] for row in rows}
+    
+    def last_update(self):
+        row = self._conn().execute("SELECT MAX(updated_at) FROM files").fetchone()
+        return row[0]
+    
+    def snapshot(self):
+        """以旧版 progress.json 的结构返回当前进度，partial 为各文件已完成片段的秒数"""
+        rows = self._conn().execute(
+            "SELECT file_name, SUM(duration) FROM segments WHERE result IS NOT NULL GROUP BY file_name"
+        )
+        completed = self.names("completed")
+        hashes = self._conn().execute(
+            "SELECT name, content_hash FROM files WHERE status = 'completed' AND content_hash IS NOT NULL"
+        )
+        return {
+            "completed": sorted(completed),
+            "completed_hashes": dict(hashes),
+            "failed": sorted(self.names("failed")),
+            "deferred": sorted(self.names("deferred")),
+            "partial": {name: seconds for name, seconds in rows if name not in completed},
+            "last_update": self.last_update(),
+        }
+    
+    # --- 实际用量 ---
+    def record_usage(self, task_id, seconds, day=None, account=None, file_name=None, estimated=None):
+        """记录一个任务的计费时长（秒），按北京时间日期和账号归档；同一 TaskId 只记一次
+        
+        seconds 为接口返回的 AudioDuration，estimated 为提交前探测的时长，用于核对估算偏差。
+        """
+        day = day or beijing_today()
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO usage (task_id, day, seconds, recorded_at, account, file_name, estimated) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (str(task_id), str(day), seconds, now, account, file_name, estimated))
+    
+    def usage_on(self, day, account=None):
+        """某天（北京时间）已计费的秒数，指定 account 时只统计该账号"""
+        if account is None:
+            row = self._conn().execute("SELECT SUM(seconds) FROM usage WHERE day = ?", (str(day),)).fetchone()
+        else:
+            row = self._conn().execute("SELECT SUM(seconds) FROM usage WHERE day = ? AND account = ?",
+                                       (str(day), account)).fetchone()
+        return row[0] or 0
+    
+    def usage_summary(self, day):
+        """某天各账号的 {账号: (任务数, 计费秒数, 估算秒数)}，估算只统计有记录的任务"""
+        rows = self._conn().execute(
+            "SELECT account, COUNT(*), SUM(seconds), SUM(estimated) FROM usage WHERE day = ? GROUP BY account",
+            (str(day),)
+        )
+        return {account: (count, seconds or 0, estimated or 0) for account, count, seconds, estimated in rows}
+    
+    def mark_exhausted(self, account, day=None):
+        """记录账号当天的额度已被服务端判定用完（以接口报错为准，不论账本余额）"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO quota_exhausted (account, day, recorded_at) VALUES (?, ?, ?)",
+                         (account or "", str(day or beijing_today()), now))
+    
+    def is_exhausted(self, account, day=None):
+        row = self._conn().execute("SELECT 1 FROM quota_exhausted WHERE account = ? AND day = ?",
+                                   (account or "", str(day or beijing_today()))).fetchone()
+        return row is not None
+    
+    def reset(self):
+        """清空所有进度"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM files")
+            conn.execute("DELETE FROM segments")
+    
+    # --- 片段断点 ---
+    def load_segments(self, name, source_sig):
+        """读取文件的片段断点；源文件已变化（source_sig 不同）时丢弃旧断点"""
+        rows = self._conn().execute(
+            "SELECT idx, source_sig, path, start_time, duration, task_id, result, offsets "
+            "FROM segments WHERE file_name = ? ORDER BY idx", (name,)
+        ).fetchall()
+        if any(row[1] != source_sig for row in rows):
+            self.clear_segments(name)
+            return []
+        segments = []
+        for idx, _, path, start_time, duration, task_id, result, offsets in rows:
+            seg = {
+                'index': idx,
+                'path': Path(path),
+                'start_time': start_time,
+                'duration': duration,
+                'task_id': task_id,
+                'result': json.loads(result) if result else None,
+            }
+            if offsets:
+                seg['offsets'] = [tuple(pair) for pair in json.loads(offsets)]
+            segments.append(seg)
+        return segments
+    
+    def save_segments(self, name, source_sig, segments):
+        """记录切分结果（覆盖该文件原有的断点）"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM segments WHERE file_name = ?", (name,))
+            conn.executemany(
+                "INSERT INTO segments (file_name, idx, source_sig, path, start_time, duration, offsets) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(name, seg['index'], source_sig, str(seg['path']), seg['start_time'], seg['duration'],
+                  json.dumps(seg['offsets']) if seg.get('offsets') else None)
+                 for seg in segments]
+            )
+    
+    def set_segment_task(self, name, index, task_id, account=None):
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE segments SET task_id = ?, account = ? WHERE file_name = ? AND idx = ?",
+                         (task_id, account, name, index))
+    
+    def segment_account(self, name):
+        """断点中已提交任务所属的账号（TaskId 只能用提交它的账号查询）"""
+        row = self._conn().execute(
+            "SELECT account FROM segments WHERE file_name = ? AND task_id IS NOT NULL AND account IS NOT NULL LIMIT 1",
+            (name,)
+        ).fetchone()
+        return row[0] if row else None
+    
+    def set_segment_result(self, name, index, data):
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE segments SET result = ? WHERE file_name = ? AND idx = ?",
+                         (json.dumps(data, ensure_ascii=False), name, index))
+    
+    def clear_segments(self, name):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM segments WHERE file_name = ?", (name,))
+
 def load_progress(progress_file):
     """加载进度"""
-    if Path(progress_file).exists():
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {
-        "completed": [],
-        "failed": [],
-        "day1_duration": 0,
-        "day2_duration": 0,
-        "total_duration": 0,
-        "last_update": None
-    }
-
-def save_progress(progress_file, progress):
-    """保存进度"""
-    progress["last_update"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open(progress_file, 'w', encoding='utf-8') as f:
-        json.dump(progress, f, ensure_ascii=False, indent=2)
+    return ProgressStore(progress_file).snapshot()
+
+# === 运行指标 ===
+class Metrics:
+    """各阶段耗时、字节数、重试和查询次数的结构化记录
+    
+    每个事件是一个 dict（event 为阶段名，seconds 为耗时），打开事件日志后
+    逐行写入 JSONL；同时按阶段累计，供 Prometheus 指标文件和运行汇总使用。
+    context() 设置的字段（如文件名、片段序号）会附加到当前线程的所有事件上。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._file = None
+        self.run_id = None
+        self.totals = {}
+    
+    def open(self, log_path):
+        """开始一次运行：追加写入事件日志并清零累计值"""
+        self.close()
+        Path(log_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            self._file = open(log_path, 'a', encoding='utf-8')
+            self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S-") + f"{os.getpid()}"
+            self.totals = {}
+    
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+    
+    def current(self):
+        """当前线程的上下文字段"""
+        return dict(getattr(self._local, 'context', {}))
+    
+    @contextmanager
+    def context(self, **fields):
+        """在代码块内给当前线程的事件附加字段"""
+        previous = self.current()
+        self._local.context = {**previous, **fields}
+        try:
+            yield
+        finally:
+            self._local.context = previous
+    
+    def emit(self, event, **fields):
+        """记录一个事件"""
+        record = {'ts': round(time.time(), 3), 'run': self.run_id, 'event': event, **self.current(), **fields}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        key = (event, fields.get('action', ''))
+        with self._lock:
+            total = self.totals.setdefault(key, {'count': 0, 'errors': 0, 'seconds': 0.0, 'bytes': 0,
+                                                 'retries': 0, 'polls': 0})
+            total['count'] += 1
+            total['errors'] += 0 if fields.get('ok', True) else 1
+            total['seconds'] += fields.get('seconds', 0)
+            total['bytes'] += fields.get('bytes', 0)
+            total['retries'] += max(0, fields.get('attempts', 1) - 1)
+            total['polls'] += fields.get('polls', 0)
+            if self._file:
+                self._file.write(line + "\n")
+                self._file.flush()
+    
+    @contextmanager
+    def stage(self, event, **fields):
+        """计时一个阶段；代码块可以往 yield 出的 dict 里补充字段，异常时记为失败"""
+        info = dict(fields)
+        start = time.perf_counter()
+        try:
+            yield info
+        except BaseException as e:
+            info.setdefault('ok', False)
+            info.setdefault('error', str(e) or type(e).__name__)
+            raise
+        else:
+            info.setdefault('ok', True)
+        finally:
+            self.emit(event, seconds=round(time.perf_counter() - start, 4), **info)
+    
+    def summary(self):
+        """按阶段汇总：{阶段: {count, errors, seconds, bytes, retries, polls}}"""
+        with self._lock:
+            return {f"{event}:{action}" if action else event: dict(total)
+                    for (event, action), total in self.totals.items()}
+    
+    def write_prometheus(self, path):
+        """以 Prometheus 文本格式写出累计指标（原子替换，适合 node_exporter textfile 采集）"""
+        with self._lock:
+            totals = {key: dict(total) for key, total in self.totals.items()}
+        series = [
+            ("asr_stage_events_total", "各阶段事件数", 'count'),
+            ("asr_stage_errors_total", "各阶段失败次数", 'errors'),
+            ("asr_stage_seconds_total", "各阶段累计耗时（秒）", 'seconds'),
+            ("asr_stage_bytes_total", "各阶段处理的字节数", 'bytes'),
+            ("asr_stage_retries_total", "API 重试次数", 'retries'),
+            ("asr_stage_polls_total", "任务状态查询次数", 'polls'),
+        ]
+        lines = []
+        for name, help_text, field in series:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (event, action), total in sorted(totals.items()):
+                labels = f'stage="{event}"' + (f',action="{action}"' if action else "")
+                lines.append(f"{name}{{{labels}}} {total[field]:g}")
+        lines.append("# HELP asr_last_run_timestamp_seconds 最近一次运行结束的时间")
+        lines.append("# TYPE asr_last_run_timestamp_seconds gauge")
+        lines.append(f"asr_last_run_timestamp_seconds {time.time():.0f}")
+        tmp_path = temp_path(path)
+        tmp_path.write_text("\n".join(lines) + "\n", encoding='utf-8')
+        os.replace(tmp_path, path)
+
+metrics = Metrics()
+
+STAGE_LABELS = {
+    'probe': '探测音频信息',
+    'transcode': '转码',
+    'split': '切分',
+    'api:CreateRecTask': '上传并创建任务',
+    'api:DescribeTaskStatus': '查询任务状态',
+    'poll': '等待识别（排队 + 处理）',
+    'save': '保存结果',
+    'segment': '片段（合计）',
+    'file': '文件（合计）',
+}
+
+def load_last_run(log_path):
+    """从事件日志末尾找出最近一次运行的 run 汇总事件，没有时返回 None"""
+    try:
+        with open(log_path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - EVENT_TAIL_BYTES))
+            lines = f.read().decode('utf-8', errors='replace').splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        if '"event": "run"' not in line:
+            continue
+        try:
+            return json.loads(line)
+        except ValueError:
+            continue
+    return None
 
 # === 腾讯云API ===
-def sign_tc3(service, host, action, version, payload, timestamp, secret_id, secret_key, region):
-    """生成腾讯云 TC3-HMAC-SHA256 签名"""
-    date = datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d")
-    ct = "application/json; charset=utf-8"
-    payload_str = json.dumps(payload)
-    canonical_request = (
-        f"POST\n/\n\n"
-        f"content-type:{ct}\nhost:{host}\nx-tc-action:{action.lower()}\n\n"
-        f"content-type;host;x-tc-action\n"
-        f"{hashlib.sha256(payload_str.encode()).hexdigest()}"
-    )
-    credential_scope = f"{date}/{service}/tc3_request"
-    string_to_sign = (
-        "TC3-HMAC-SHA256\n"
-        f"{timestamp}\n"
-        f"{credential_scope}\n"
-        f"{hashlib.sha256(canonical_request.encode()).hexdigest()}"
-    )
-    def _hmac(key, msg):
-        return hmac.new(key, msg.encode(), hashlib.sha256).digest()
-    secret_date = _hmac(("TC3"+secret_key).encode(), date)
-    secret_service = hmac.new(secret_date, service.encode(), hashlib.sha256).digest()
-    secret_signing = hmac.new(secret_service, b"tc3_request", hashlib.sha256).digest()
-    signature = hmac.new(secret_signing, string_to_sign.encode(), hashlib.sha256).hexdigest()
-    auth = (
-        f"TC3-HMAC-SHA256 Credential={secret_id}/{credential_scope}, "
-        f"SignedHeaders=content-type;host;x-tc-action, Signature={signature}"
-    )
-    return {
-        "Authorization": auth,
-        "Content-Type": ct,
-        "Host": host,
-        "X-TC-Action": action,
-        "X-TC-Timestamp": str(timestamp),
-        "X-TC-Version": version,
-        "X-TC-Region": region,
-    }
-
-def create_task(audio_path, secret_id, secret_key, region):
+def sign_tc3(service, host, action, version, payload, timestamp, secret_id, secret_key, region, payload_hash=None):
+    """生成腾讯云 TC3-HMAC-SHA256 签名
+    
+    payload 可以是 dict、已序列化的 str/bytes；请求体很大时可直接传入
+    预先计算好的 payload_hash（十六进制 SHA-256），避免再序列化一次。
+    """
+    return get_client(secret_id, secret_key, region).sign_tc3(
+        service, host, action, version, payload, timestamp, payload_hash=payload_hash)
+
+class Base64JsonBody:
+    """以文件对象形式流式生成 CreateRecTask 的 JSON 请求体
+    
+    音频通过 mmap 映射后分块做 base64 编码，夹在 JSON 前后缀之间输出。
+    总长度可直接算出，SHA-256 增量计算，因此签名和发送都不需要在内存中
+    拼出完整请求体，单个上传的内存占用约为 UPLOAD_CHUNK_BYTES。
+    """
+    
+    _PLACEHOLDER = "@@AUDIO_DATA@@"
+    
+    def __init__(self, audio_path, payload):
+        self._file = open(audio_path, "rb")
+        self.data_len = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.data_len else b""
+        payload = dict(payload, Data=self._PLACEHOLDER, DataLen=self.data_len)
+        prefix, suffix = json.dumps(payload).split(self._PLACEHOLDER)
+        self._prefix = prefix.encode()
+        self._suffix = suffix.encode()
+        self._length = len(self._prefix) + 4 * ((self.data_len + 2) // 3) + len(self._suffix)
+        self._chunks = None
+        self._buffer = b""
+    
+    def __len__(self):
+        return self._length
+    
+    def _iter_chunks(self):
+        yield self._prefix
+        # 块大小是 3 的倍数，各块的 base64 结果可以直接拼接
+        for offset in range(0, self.data_len, UPLOAD_CHUNK_BYTES):
+            yield base64.b64encode(self._mmap[offset:offset + UPLOAD_CHUNK_BYTES])
+        yield self._suffix
+    
+    def sha256(self):
+        """计算请求体的 SHA-256（十六进制），不影响 read 的位置"""
+        digest = hashlib.sha256()
+        for chunk in self._iter_chunks():
+            digest.update(chunk)
+        return digest.hexdigest()
+    
+    def rewind(self):
+        """回到请求体开头，用于重新发送"""
+        self._chunks = None
+        self._buffer = b""
+    
+    def read(self, size=-1):
+        if self._chunks is None:
+            self._chunks = self._iter_chunks()
+        if size is None or size < 0:
+            data = self._buffer + b"".join(self._chunks)
+            self._buffer = b""
+            return data
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+    
+    def close(self):
+        if self.data_len:
+            self._mmap.close()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+class TencentApiError(RuntimeError):
+    """接口返回的 Response.Error"""
+    
+    def __init__(self, code, message, request_id=None):
+        self.code = code
+        self.message = message
+        self.request_id = request_id
+        super().__init__(f"{message} ({code})")
+
+def is_retryable(exc, idempotent=True):
+    """判断错误是否为可重试的临时错误（网络、5xx、限频、服务端内部错误）
+    
+    idempotent 为 False 时（如 CreateRecTask）只重试请求确定未被受理的错误：
+    请求发出前的连接失败（见 connect_failed）、HTTP 429 和 NON_IDEMPOTENT_RETRYABLE_CODES。
+    """
+    if isinstance(exc, TencentApiError):
+        codes = RETRYABLE_ERROR_CODES if idempotent else NON_IDEMPOTENT_RETRYABLE_CODES
+        return any(exc.code == c or exc.code.startswith(c + ".") for c in codes)
+    requests = load_requests()
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else 0
+        return status == 429 or (idempotent and status >= 500)
+    if not idempotent:
+        return connect_failed(exc)
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+def connect_failed(exc):
+    """错误是否发生在请求发出之前：连接超时、连接被拒绝或域名解析失败
+    
+    连接中途断开（Connection aborted、RemoteDisconnected）和读超时时，请求体
+    可能已经送达并被受理，不算在内。
+    """
+    requests = load_requests()
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+    if not isinstance(exc, requests.ConnectionError):
+        return False
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+    reason = exc.args[0] if exc.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return isinstance(reason, NewConnectionError)
+
+def is_quota_exhausted(exc):
+    """判断错误是否为免费额度或资源包已用完（Resource pack exhausted）"""
+    if not isinstance(exc, TencentApiError):
+        return False
+    return any(marker in exc.code for marker in QUOTA_ERROR_MARKERS) or "exhausted" in exc.message.lower()
+
+def retry_delay(attempt):
+    """第 attempt 次重试前的等待时间：指数增长，一半固定一半随机"""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def poll_schedule(duration):
+    """根据音频时长计算首次查询延迟和超时时间（秒）"""
+    first_delay = POLL_FIRST_DELAY + duration * POLL_RTF
+    timeout = POLL_TIMEOUT_BASE + duration * POLL_TIMEOUT_FACTOR
+    return first_delay, timeout
+
+def next_poll_interval(interval):
+    """指数退避 + 随机抖动，返回下一次查询前的等待时间"""
+    interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+    return interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+class RateLimiter:
+    """按 API 动作分别限速的令牌桶，进程内所有线程共享
+    
+    遇到限频错误时把该动作的速率乘以 THROTTLE_BACKOFF，之后每次成功
+    按配置速率的 THROTTLE_RECOVERY 比例逐步恢复；同时统计等待时间。
+    """
+    
+    def __init__(self, rates):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        for action, qps in rates.items():
+            self.set_rate(action, qps)
+    
+    def set_rate(self, action, qps):
+        """设置某个动作的速率上限（次/秒），qps <= 0 表示不限速"""
+        with self._lock:
+            self._buckets[action] = {
+                'max_rate': qps,
+                'rate': qps,
+                'tokens': max(1.0, qps),
+                'updated': time.monotonic(),
+                'waited': 0.0,
+                'throttled': 0,
+            }
+    
+    def acquire(self, action):
+        """取一个令牌，不足时阻塞等待；返回本次等待的秒数"""
+        with self._lock:
+            bucket = self._buckets.get(action)
+            if bucket is None or bucket['max_rate'] <= 0:
+                return 0.0
+            now = time.monotonic()
+            rate = bucket['rate']
+            bucket['tokens'] = min(max(1.0, rate), bucket['tokens'] + (now - bucket['updated']) * rate)
+            bucket['updated'] = now
+            # 先预占令牌（可以为负），在锁外睡眠，后来者按顺序排在后面
+            bucket['tokens'] -= 1
+            wait = -bucket['tokens'] / rate if bucket['tokens'] < 0 else 0.0
+            bucket['waited'] += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+    
+    def on_throttled(self, action):
+        """收到限频错误：降低速率并清空积攒的令牌"""
+        with self._lock:
+            bucket = self._buckets.get(action)
+            if bucket is None or bucket['max_rate'] <= 0:
+                return
+            bucket['rate'] = max(THROTTLE_MIN_QPS, bucket['rate'] * THROTTLE_BACKOFF)
+            bucket['tokens'] = min(bucket['tokens'], 0.0)
+            bucket['throttled'] += 1
+    
+    def on_success(self, action):
+        """请求成功：速率逐步恢复到上限"""
+        with self._lock:
+            bucket = self._buckets.get(action)
+            if bucket is None or bucket['rate'] >= bucket['max_rate']:
+                return
+            bucket['rate'] = min(bucket['max_rate'], bucket['rate'] + bucket['max_rate'] * THROTTLE_RECOVERY)
+    
+    def stats(self):
+        """各动作的当前速率、累计等待秒数和被限频次数"""
+        with self._lock:
+            return {
+                action: {'rate': b['rate'], 'waited': b['waited'], 'throttled': b['throttled']}
+                for action, b in self._buckets.items()
+            }
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter():
+    """进程内共享的限速器"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(ACTION_QPS)
+        return _rate_limiter
+
+def is_throttled(exc):
+    """是否为限频错误"""
+    if isinstance(exc, TencentApiError):
+        return exc.code.startswith("RequestLimitExceeded")
+    requests = load_requests()
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code == 429
+    return False
+
+class AsrClient:
+    """腾讯云 ASR 客户端
+    
+    复用带连接池的 keep-alive 会话，按 UTC 日期缓存派生的签名密钥，
+    对网络错误、5xx 和限频等临时错误做带抖动的退避重试。可在多个线程间共享。
+    """
+    
+    def __init__(self, secret_id, secret_key, region, host=API_HOST, retries=API_RETRIES, pool_size=HTTP_POOL_SIZE,
+                 rate_limiter=None, endpoint=None):
+        self.secret_id = secret_id
+        self.secret_key = secret_key
+        self.region = region
+        # endpoint（或环境变量 TENCENT_ASR_ENDPOINT）指向其他地址时，签名使用其中的主机名
+        endpoint = endpoint or API_ENDPOINT or os.getenv("TENCENT_ASR_ENDPOINT")
+        self.url = endpoint.rstrip("/") if endpoint else f"https://{host}"
+        self.host = urlparse(endpoint).netloc if endpoint else host
+        self.retries = retries
+        self.retry_count = 0
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        requests = load_requests()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._signing_keys = {}
+        self._lock = threading.Lock()
+    
+    def signing_key(self, service, date):
+        """TC3 派生签名密钥，同一 UTC 日期内只计算一次"""
+        key = self._signing_keys.get((service, date))
+        if key is None:
+            secret_date = hmac.new(("TC3" + self.secret_key).encode(), date.encode(), hashlib.sha256).digest()
+            secret_service = hmac.new(secret_date, service.encode(), hashlib.sha256).digest()
+            key = hmac.new(secret_service, b"tc3_request", hashlib.sha256).digest()
+            with self._lock:
+                self._signing_keys = {(service, date): key}
+        return key
+    
+    def sign_tc3(self, service, host, action, version, payload, timestamp, payload_hash=None):
+        """生成 TC3-HMAC-SHA256 签名请求头"""
+        date = datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime("%Y-%m-%d")
+        ct = "application/json; charset=utf-8"
+        if payload_hash is None:
+            if isinstance(payload, dict):
+                payload = json.dumps(payload)
+            if isinstance(payload, str):
+                payload = payload.encode()
+            payload_hash = hashlib.sha256(payload).hexdigest()
+        canonical_request = (
+            f"POST\n/\n\n"
+            f"content-type:{ct}\nhost:{host}\nx-tc-action:{action.lower()}\n\n"
+            f"content-type;host;x-tc-action\n"
+            f"{payload_hash}"
+        )
+        credential_scope = f"{date}/{service}/tc3_request"
+        string_to_sign = (
+            "TC3-HMAC-SHA256\n"
+            f"{timestamp}\n"
+            f"{credential_scope}\n"
+            f"{hashlib.sha256(canonical_request.encode()).hexdigest()}"
+        )
+        signature = hmac.new(self.signing_key(service, date), string_to_sign.encode(), hashlib.sha256).hexdigest()
+        auth = (
+            f"TC3-HMAC-SHA256 Credential={self.secret_id}/{credential_scope}, "
+            f"SignedHeaders=content-type;host;x-tc-action, Signature={signature}"
+        )
+        return {
+            "Authorization": auth,
+            "Content-Type": ct,
+            "Host": host,
+            "X-TC-Action": action,
+            "X-TC-Timestamp": str(timestamp),
+            "X-TC-Version": version,
+            "X-TC-Region": self.region,
+        }
+    
+    def call(self, action, body, timeout=30, retries=None):
+        """发送一次 API 请求并返回 Response；临时错误自动重试
+        
+        body 为 dict、bytes 或 Base64JsonBody（每次重试会从头重新发送）。
+        retries 为最多重试次数，默认为客户端的 retries；传 0 时不在本线程内退避等待。
+        """
+        if isinstance(body, dict):
+            body = json.dumps(body).encode()
+        if retries is None:
+            retries = self.retries
+        with metrics.stage("api", action=action, bytes=len(body)) as info:
+            return self._send(action, body, timeout, retries, info)
+    
+    def _send(self, action, body, timeout, retries, info):
+        payload_hash = body.sha256() if isinstance(body, Base64JsonBody) else hashlib.sha256(body).hexdigest()
+        attempt = 0
+        while True:
+            info['attempts'] = attempt + 1
+            try:
+                if isinstance(body, Base64JsonBody):
+                    body.rewind()
+                self.rate_limiter.acquire(action)
+                # 每次重试都重新签名，避免时间戳过期
+                headers = self.sign_tc3("asr", self.host, action, API_VERSION, body, int(time.time()),
+                                        payload_hash=payload_hash)
+                r = self.session.post(self.url, headers=headers, data=body, timeout=timeout)
+                r.raise_for_status()
+                resp = r.json().get("Response", {})
+                if "Error" in resp:
+                    raise TencentApiError(resp["Error"].get("Code", ""), resp["Error"].get("Message", ""),
+                                          resp.get("RequestId"))
+                self.rate_limiter.on_success(action)
+                return resp
+            except Exception as e:
+                if is_throttled(e):
+                    self.rate_limiter.on_throttled(action)
+                if attempt >= retries or not is_retryable(e, action not in NON_IDEMPOTENT_ACTIONS):
+                    raise
+                delay = retry_delay(attempt)
+                attempt += 1
+                with self._lock:
+                    self.retry_count += 1
+                print_warning(f"      {action} 失败，{delay:.1f} 秒后第 {attempt} 次重试: {e}")
+                time.sleep(delay)
+    
+    def create_task(self, audio_path, callback_url=None, url=None):
+        """创建转写任务，返回 TaskId；指定 callback_url 时识别完成后由服务端推送结果
+        
+        指定 url 时由服务端从该地址下载音频（SourceType 0），不再内联上传。
+        """
+        payload = {
+            "EngineModelType": ENGINE_MODEL,
+            "ChannelNum": 1,
+            "ResTextFormat": RES_TEXT_FORMAT,
+            "SourceType": 0 if url else 1,
+            "SpeakerDiarization": SPEAKER_DIARIZATION,
+            "SpeakerNumber": SPEAKER_NUM,
+        }
+        if callback_url:
+            payload["CallbackUrl"] = callback_url
+        if url:
+            payload["Url"] = url
+            resp = self.call("CreateRecTask", payload)
+            return resp["Data"]["TaskId"]
+        with Base64JsonBody(audio_path, payload) as body:
+            resp = self.call("CreateRecTask", body, timeout=120)
+        return resp["Data"]["TaskId"]
+    
+    def describe_task(self, task_id, retries=None):
+        """查询一次任务状态，返回 Response.Data；retries 同 call"""
+        return self.call("DescribeTaskStatus", {"TaskId": task_id}, retries=retries).get("Data", {})
+    
+    def poll_result(self, task_id, duration=0):
+        """轮询任务结果（单任务、阻塞式）"""
+        interval, timeout = poll_schedule(duration)
+        deadline = time.time() + timeout
+        with metrics.stage("poll", task_id=task_id, polls=0) as info:
+            while time.time() + interval <= deadline:
+                time.sleep(interval)
+                info['polls'] += 1
+                data = self.describe_task(task_id)
+                status = data.get("Status")
+                if status == 2:
+                    return data
+                if status == 3:
+                    raise RuntimeError(data.get("ErrorMsg", "未知错误"))
+                print(f"      [{task_id}] 第 {info['polls']} 次查询：处理中...")
+                interval = next_poll_interval(interval)
+            raise TimeoutError("转写超时")
+
+def get_client(secret_id, secret_key, region):
+    """按密钥和地域复用 AsrClient，模块级函数共享同一个连接池"""
+    key = (secret_id, secret_key, region)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = AsrClient(secret_id, secret_key, region)
+        return client
+
+def create_task(audio_path, secret_id, secret_key, region, callback_url=None, url=None):
     """创建转写任务"""
-    with open(audio_path, "rb") as f:
-        data = f.read()
-    payload = {
-        "EngineModelType": ENGINE_MODEL,
-        "ChannelNum": 1,
-        "ResTextFormat": 0,
-        "SourceType": 1,
-        "Data": base64.b64encode(data).decode(),
-        "DataLen": len(data),
-        "SpeakerDiarization": 1,
-        "SpeakerNumber": SPEAKER_NUM,
-    }
-    ts = int(time.time())
-    headers = sign_tc3("asr", "asr.tencentcloudapi.com", "CreateRecTask", "2019-06-14", payload, ts, secret_id, secret_key, region)
-    r = requests.post("https://asr.tencentcloudapi.com", headers=headers, json=payload, timeout=120)
-    r.raise_for_status()
-    resp = r.json()
-    if "Error" in resp.get("Response", {}):
-        raise RuntimeError(resp["Response"]["Error"]["Message"])
-    return resp["Response"]["Data"]["TaskId"]
-
-def poll_result(task_id, secret_id, secret_key, region):
-    """轮询任务结果"""
-    for i in range(MAX_TRIES):
-        time.sleep(POLL_SECONDS)
-        payload = {"TaskId": task_id}
-        ts = int(time.time())
-        headers = sign_tc3("asr", "asr.tencentcloudapi.com", "DescribeTaskStatus", "2019-06-14", payload, ts, secret_id, secret_key, region)
-        r = requests.post("https://asr.tencentcloudapi.com", headers=headers, json=payload, timeout=30)
-        r.raise_for_status()
-        data = r.json().get("Response", {}).get("Data", {})
+    return get_client(secret_id, secret_key, region).create_task(audio_path, callback_url, url)
+
+def describe_task(task_id, secret_id, secret_key, region):
+    """查询一次任务状态，返回 Response.Data"""
+    return get_client(secret_id, secret_key, region).describe_task(task_id)
+
+def poll_result(task_id, secret_id, secret_key, region, duration=0):
+    """轮询任务结果（单任务、阻塞式）"""
+    return get_client(secret_id, secret_key, region).poll_result(task_id, duration)
+
+class TaskPoller:
+    """统一轮询器：一个后台线程跟踪所有未完成的 TaskId
+    
+    每个任务按音频时长安排首次查询，之后指数退避；查询经由 client 的
+    限速器，与其他调用共享 DescribeTaskStatus 的速率上限（--qps-describe）。传入 callbacks
+    （CallbackReceiver）时结果主要由回调推送，查询只作为迟迟收不到
+    回调时的兜底，首次查询推迟 CALLBACK_SAFETY_DELAY 秒且间隔不小于
+    CALLBACK_SAFETY_INTERVAL 秒。
+    """
+    
+    def __init__(self, client, callbacks=None):
+        self.client = client
+        self.request_count = 0
+        self.callback_count = 0
+        self.callbacks = callbacks
+        self.callback_url = callbacks.url if callbacks else None
+        self._tasks = {}
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="TaskPoller", daemon=True)
+        self._thread.start()
+        if callbacks:
+            callbacks.attach(self)
+    
+    def submit(self, task_id, duration=0):
+        """登记一个 TaskId，返回在任务完成时得到 Response.Data 的 Future"""
+        future = Future()
+        interval, timeout = poll_schedule(duration)
+        now = time.time()
+        min_interval = 0
+        if self.callbacks:
+            interval += CALLBACK_SAFETY_DELAY
+            min_interval = CALLBACK_SAFETY_INTERVAL
+        entry = {
+            'task_id': task_id,
+            'future': future,
+            'interval': interval,
+            'min_interval': min_interval,
+            'deadline': now + max(timeout, interval),
+            'tries': 0,
+            'submitted': now,
+            'context': metrics.current(),
+            'done': False,
+        }
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("轮询器已关闭")
+            self._tasks[task_id] = entry
+            self._push(now + interval, entry)
+        # 回调可能先于登记到达
+        if self.callbacks:
+            data = self.callbacks.take_early(task_id)
+            if data is not None:
+                self.complete(task_id, data)
+        return future
+    
+    def complete(self, task_id, data):
+        """由回调送达任务结果；不是本轮询器登记的任务时返回 False"""
+        with self._cond:
+            entry = self._tasks.get(task_id)
+        if entry is None:
+            return False
+        self.callback_count += 1
         status = data.get("Status")
-        if status in (0, 1):
-            print(f"      [{i+1}] 处理中...")
-            continue
         if status == 2:
-            return data
+            self._finish(entry, data, via="callback")
+        else:
+            self._finish(entry, error=RuntimeError(data.get("ErrorMsg") or "未知错误"), via="callback")
+        return True
+    
+    def wait(self, task_id, duration=0):
+        """登记并阻塞等待任务结果"""
+        return self.submit(task_id, duration).result()
+    
+    def close(self):
+        """停止后台线程，未完成的任务以异常结束"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        for _, _, entry in self._heap:
+            self._finish(entry, error=RuntimeError("轮询器已关闭"))
+        self._heap = []
+        if self.callbacks:
+            self.callbacks.detach(self)
+    
+    def _push(self, due, entry):
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, entry))
+        self._cond.notify()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if self._heap:
+                        wait = self._heap[0][0] - time.time()
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                if self._closed:
+                    return
+                _, _, entry = heapq.heappop(self._heap)
+                if entry['done']:
+                    continue
+            self._check(entry)
+    
+    def _finish(self, entry, data=None, error=None, via="poll"):
+        """结束一个任务并记录等待时长（服务端排队 + 处理）和查询次数；重复结束时忽略"""
+        with self._cond:
+            if entry['done']:
+                return
+            entry['done'] = True
+            self._tasks.pop(entry['task_id'], None)
+        metrics.emit("poll", task_id=entry['task_id'], seconds=round(time.time() - entry['submitted'], 3),
+                     polls=entry['tries'], via=via, ok=error is None, error=str(error) if error else None,
+                     **entry['context'])
+        if error is None:
+            entry['future'].set_result(data)
+        else:
+            entry['future'].set_exception(error)
+    
+    def _check(self, entry):
+        task_id = entry['task_id']
+        entry['tries'] += 1
+        self.request_count += 1
+        try:
+            with metrics.context(**entry['context']):
+                # 轮询线程只有一个，不在客户端里退避重试，以免耽误其他任务的查询
+                data = self.client.describe_task(task_id, retries=0)
+        except Exception as e:
+            if not is_retryable(e):
+                self._finish(entry, error=e)
+                return
+            # 临时错误不判定任务失败，按轮询间隔退避后继续查询直到超时
+            print_warning(f"      [{task_id}] 查询失败，稍后重试: {e}")
+            data = {}
+        status = data.get("Status")
+        if status == 2:
+            self._finish(entry, data)
+            return
         if status == 3:
-            raise RuntimeError(data.get("ErrorMsg", "未知错误"))
-    raise TimeoutError("转写超时")
+            self._finish(entry, error=RuntimeError(data.get("ErrorMsg", "未知错误")))
+            return
+        entry['interval'] = max(next_poll_interval(entry['interval']), entry['min_interval'])
+        due = time.time() + entry['interval']
+        if due > entry['deadline']:
+            self._finish(entry, error=TimeoutError(f"转写超时（已查询 {entry['tries']} 次）"))
+            return
+        with self._cond:
+            if self._closed:
+                self._finish(entry, error=RuntimeError("轮询器已关闭"))
+                return
+            self._push(due, entry)
+
+class _CallbackHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        receiver = self.server.receiver
+        # 先核对令牌和长度，不为无关请求读取请求体
+        if not urlparse(self.path).path.rstrip("/").endswith("/" + receiver.token):
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= CALLBACK_MAX_BODY:
+            self.send_error(413 if length > 0 else 400)
+            return
+        body = self.rfile.read(length).decode("utf-8", errors="replace")
+        fields = {key: values[0] for key, values in parse_qs(body, keep_blank_values=True).items()}
+        try:
+            receiver.deliver(fields)
+            reply = {"code": 0, "message": "成功"}
+        except (KeyError, ValueError) as e:
+            reply = {"code": 1, "message": f"回调内容无法解析: {e}"}
+        data = json.dumps(reply, ensure_ascii=False).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def log_message(self, format, *args):
+        pass
+
+class CallbackReceiver:
+    """接收 CreateRecTask 回调的本地 HTTP 服务
+    
+    腾讯云在识别完成后向 CallbackUrl 以表单形式 POST 结果（requestId 即
+    TaskId，code 为 0 表示成功）。public_url 是服务端能访问到的地址（经
+    反向代理或内网穿透转发到 listen），后面附加随机令牌，其他路径一律 404。
+    收到的结果转换成 DescribeTaskStatus 的 Data 格式交给对应的 TaskPoller。
+    """
+    
+    def __init__(self, public_url, listen=CALLBACK_LISTEN):
+        host, _, port = listen.rpartition(":")
+        self.token = secrets.token_urlsafe(16)
+        self.url = f"{public_url.rstrip('/')}/{self.token}"
+        self._pollers = []
+        self._early = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host or "0.0.0.0", int(port)), _CallbackHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.receiver = self
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="CallbackReceiver", daemon=True)
+        self._thread.start()
+    
+    def attach(self, poller):
+        with self._lock:
+            self._pollers.append(poller)
+    
+    def detach(self, poller):
+        with self._lock:
+            if poller in self._pollers:
+                self._pollers.remove(poller)
+    
+    def take_early(self, task_id):
+        """取出登记前就已到达的回调结果"""
+        with self._lock:
+            received_at, data = self._early.pop(task_id, (0, None))
+        if time.time() - received_at > CALLBACK_EARLY_TTL:
+            return None
+        return data
+    
+    def _keep_early(self, task_id, data):
+        """暂存还没有轮询器登记的回调（调用方持有 _lock）；按到达顺序淘汰过期和超出上限的条目"""
+        now = time.time()
+        self._early.pop(task_id, None)
+        self._early[task_id] = (now, data)
+        while self._early:
+            oldest_id, (received_at, _) = next(iter(self._early.items()))
+            if now - received_at <= CALLBACK_EARLY_TTL and len(self._early) <= CALLBACK_EARLY_MAX:
+                break
+            del self._early[oldest_id]
+    
+    def deliver(self, fields):
+        """处理一次回调"""
+        task_id = int(fields["requestId"])
+        code = int(fields.get("code") or 0)
+        data = {
+            "TaskId": task_id,
+            "Status": 2 if code == 0 else 3,
+            "StatusStr": "success" if code == 0 else "failed",
+            "Result": fields.get("text", ""),
+            "ErrorMsg": fields.get("message", "") if code else "",
+            "AudioDuration": float(fields.get("audioTime") or 0),
+            "ResultDetail": json.loads(fields["resultDetail"]) if fields.get("resultDetail") else None,
+        }
+        with self._lock:
+            for poller in self._pollers:
+                if poller.complete(task_id, data):
+                    return
+            self._keep_early(task_id, data)
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+class _FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    
+    def do_HEAD(self):
+        self._serve(send_body=False)
+    
+    def do_GET(self):
+        self._serve(send_body=True)
+    
+    def _serve(self, send_body):
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        path = self.server.source.resolve(parsed.path, query.get("expires", ""), query.get("sig", ""))
+        if path is None:
+            self.send_error(403)
+            return
+        try:
+            size = path.stat().st_size
+        except OSError:
+            self.send_error(404)
+            return
+        start, end = 0, size - 1
+        ranged = parse_byte_range(self.headers.get("Range"), size)
+        if ranged is False:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if ranged:
+            start, end = ranged
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if not send_body:
+            return
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(URL_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+        self.server.source.count_bytes(end - start + 1 - remaining)
+    
+    def log_message(self, format, *args):
+        pass
+
+def parse_byte_range(header, size):
+    """解析单个 Range 请求头，返回 (start, end)；没有或无法识别时返回 None，越界返回 False"""
+    m = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header or "")
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if m.group(1):
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    else:
+        start = max(0, size - int(m.group(2)))
+        end = size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+class AudioFileServer:
+    """以限时签名链接对外提供音频文件的本地 HTTP 服务（支持 Range）
+    
+    public_url 是服务端能访问到的地址（经反向代理或内网穿透转发到 listen）。
+    每个发布的文件得到 /<随机 ID>/<文件名>?expires=...&sig=... 形式的链接，
+    签名密钥每次运行随机生成，过期、篡改或已撤销的链接一律 403。
+    """
+    
+    def __init__(self, public_url, listen=URL_LISTEN, ttl=URL_LINK_TTL):
+        host, _, port = listen.rpartition(":")
+        self.public_url = public_url.rstrip("/")
+        self.ttl = ttl
+        self.bytes_served = 0
+        self._key = secrets.token_bytes(32)
+        self._files = {}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host or "0.0.0.0", int(port)), _FileHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.source = self
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="AudioFileServer", daemon=True)
+        self._thread.start()
+    
+    def _sign(self, file_id, expires):
+        return hmac.new(self._key, f"{file_id}:{expires}".encode(), hashlib.sha256).hexdigest()
+    
+    def publish(self, path):
+        """发布文件，返回签名链接"""
+        path = Path(path)
+        file_id = secrets.token_urlsafe(12)
+        expires = int(time.time() + self.ttl)
+        with self._lock:
+            self._files[file_id] = path
+        return (f"{self.public_url}/{file_id}/{quote(path.name)}"
+                f"?expires={expires}&sig={self._sign(file_id, expires)}")
+    
+    def unpublish(self, url):
+        """撤销链接，之后的下载请求返回 403"""
+        file_id = urlparse(url).path.rstrip("/").split("/")[-2]
+        with self._lock:
+            self._files.pop(file_id, None)
+    
+    def resolve(self, request_path, expires, sig):
+        """校验请求，返回对应的本地文件；无效时返回 None"""
+        parts = request_path.rstrip("/").split("/")
+        if len(parts) < 2 or not expires.isdigit() or int(expires) < time.time():
+            return None
+        file_id = unquote(parts[-2])
+        if not hmac.compare_digest(self._sign(file_id, int(expires)), sig):
+            return None
+        with self._lock:
+            return self._files.get(file_id)
+    
+    def count_bytes(self, n):
+        with self._lock:
+            self.bytes_served += n
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self._thread.join()
+
+class S3AudioSource:
+    """把音频上传到 S3 兼容存储（如 MinIO），以预签名链接提供给服务端
+    
+    bucket_url 形如 s3://bucket/prefix；endpoint 为自建存储的地址，密钥按
+    boto3 的规则（AWS_ACCESS_KEY_ID 等环境变量或配置文件）读取。识别完成后删除对象。
+    """
+    
+    def __init__(self, bucket_url, endpoint=None, ttl=URL_LINK_TTL):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("S3 上传需要安装 boto3: pip install boto3")
+        parsed = urlparse(bucket_url)
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.strip("/")
+        self.ttl = ttl
+        self.bytes_served = 0
+        self.client = boto3.client("s3", endpoint_url=endpoint or os.getenv("AWS_ENDPOINT_URL"))
+        self._keys = {}
+        self._lock = threading.Lock()
+    
+    def publish(self, path):
+        path = Path(path)
+        key = "/".join(filter(None, [self.prefix, secrets.token_urlsafe(12), path.name]))
+        self.client.upload_file(str(path), self.bucket, key)
+        url = self.client.generate_presigned_url("get_object", Params={"Bucket": self.bucket, "Key": key},
+                                                 ExpiresIn=self.ttl)
+        with self._lock:
+            self._keys[url] = key
+            self.bytes_served += path.stat().st_size
+        return url
+    
+    def unpublish(self, url):
+        with self._lock:
+            key = self._keys.pop(url, None)
+        if key:
+            try:
+                self.client.delete_object(Bucket=self.bucket, Key=key)
+            except Exception as e:
+                print_warning(f"删除 S3 对象失败 {key}: {e}")
+    
+    def close(self):
+        with self._lock:
+            urls = list(self._keys)
+        for url in urls:
+            self.unpublish(url)
+
+def open_audio_source(url_source, listen=URL_LISTEN, s3_endpoint=None):
+    """按 --url-source 创建音频来源：s3:// 开头为对象存储，否则为内置文件服务的公网地址"""
+    if url_source.startswith("s3://"):
+        return S3AudioSource(url_source, s3_endpoint)
+    return AudioFileServer(url_source, listen)
+
+# === 音频处理 ===
+def segment_duration_for(file_size, duration):
+    """按实测码率计算片段时长，使每段略小于 MAX_FILE_SIZE_MB"""
+    if duration <= 0 or file_size <= 0:
+        return MIN_SEGMENT_DURATION
+    bytes_per_second = file_size / duration
+    target_bytes = MAX_FILE_SIZE_MB * 1024 * 1024 * SEGMENT_SIZE_RATIO
+    return max(MIN_SEGMENT_DURATION, target_bytes / bytes_per_second)
+
+def split_audio(file_path, output_dir, segment_duration=None):
+    """使用 ffmpeg segment 复用器一次性切分音频文件
+    
+    不指定 segment_duration 时按码率计算片段时长；若个别片段（VBR 码率波动）
+    仍超过上限，则缩短片段时长重新切分。
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    stem = Path(file_path).stem
+    ext = Path(file_path).suffix
+    
+    duration = get_audio_duration(file_path)
+    if duration == 0:
+        print_error(f"无法获取音频时长: {file_path}")
+        return []
+    
+    if segment_duration is None:
+        segment_duration = segment_duration_for(Path(file_path).stat().st_size, duration)
+    limit_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+    
+    for attempt in range(SPLIT_MAX_ATTEMPTS):
+        estimated = int(duration // segment_duration) + 1
+        print_info(f"音频时长: {duration:.1f}秒，按 {segment_duration:.0f} 秒/段切分，约 {estimated} 段")
+        
+        for old in Path(output_dir).glob(f"{glob_escape(stem)}_part*{ext}"):
+            old.unlink()
+        list_file = Path(output_dir) / f"{stem}_segments.csv"
+        pattern = Path(output_dir) / f"{stem.replace('%', '%%')}_part%03d{ext}"
+        
+        # 单个 ffmpeg 进程顺序读一遍输入，由 segment 复用器在数据包边界切出所有片段，
+        # 实际起止时间写入 CSV 列表，用作时间戳偏移
+        cmd = [
+            tool_path("ffmpeg"), '-y', '-v', 'error', '-i', str(file_path),
+            '-map', '0:a', '-c', 'copy',
+            '-f', 'segment',
+            '-segment_time', f"{segment_duration:.3f}",
+            '-segment_list', str(list_file),
+            '-segment_list_type', 'csv',
+            '-reset_timestamps', '1',
+            str(pattern)
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0 or not list_file.exists():
+            print_error(f"切分失败: {result.stderr.strip()[-200:]}")
+            return []
+        
+        segments = []
+        with open(list_file, 'r', encoding='utf-8', newline='') as f:
+            for i, row in enumerate(csv.reader(f)):
+                if len(row) < 3:
+                    continue
+                seg_path = Path(output_dir) / row[0]
+                start_time = float(row[1])
+                segments.append({
+                    'path': seg_path,
+                    'start_time': start_time,
+                    'duration': float(row[2]) - start_time,
+                    'index': i
+                })
+        list_file.unlink()
+        
+        oversized = [seg for seg in segments if seg['path'].stat().st_size > limit_bytes]
+        if not oversized:
+            break
+        print_warning(f"  {len(oversized)} 个片段超过 {MAX_FILE_SIZE_MB} MB，缩短片段时长重新切分")
+        segment_duration *= SEGMENT_SIZE_RATIO * limit_bytes / max(seg['path'].stat().st_size for seg in oversized)
+    
+    for seg in segments:
+        print_info(f"  切分片段 {seg['index']+1}/{len(segments)}: {seg['path'].name} ({seg['duration']:.1f}秒)")
+    return segments
 
-# === 音频处理 ===
-def split_audio(file_path, output_dir, segment_duration=SEGMENT_DURATION):
-    """使用 ffmpeg 切分音频文件"""
+def choose_transcode_bitrate(duration, fmt):
+    """在码率阶梯中选出能让整个文件一次上传的最高码率（kbps）
+    
+    时长太长、最低码率也放不下时返回最低码率，之后照常切分。
+    """
+    target_bytes = MAX_FILE_SIZE_MB * 1024 * 1024 * SEGMENT_SIZE_RATIO
+    ladder = TRANSCODE_FORMATS[fmt]['bitrates']
+    for kbps in ladder:
+        if duration * kbps * 1000 / 8 <= target_bytes:
+            return kbps
+    return ladder[-1]
+
+def transcode_audio(file_path, output_dir, fmt='opus', duration=None):
+    """转码为 16kHz 单声道的紧凑格式，返回输出文件路径
+    
+    16k_zh 引擎只需要 16kHz 单声道，转码后体积通常只有原文件的几分之一，
+    大多数文件无需切分。输出已存在且比源文件新时直接复用。
+    """
+    spec = TRANSCODE_FORMATS[fmt]
+    file_path = Path(file_path)
+    output_file = Path(output_dir) / f"{file_path.name}{spec['ext']}"
+    if output_file.exists() and output_file.stat().st_mtime >= file_path.stat().st_mtime:
+        return output_file
+    
+    if duration is None:
+        duration = get_audio_duration(file_path)
+    kbps = choose_transcode_bitrate(duration, fmt)
     Path(output_dir).mkdir(parents=True, exist_ok=True)
-    stem = Path(file_path).stem
-    ext = Path(file_path).suffix
+    # 先写临时文件再改名，中断不会留下半截的输出
+    tmp_file = output_file.with_name(f"{file_path.name}.tmp{spec['ext']}")
+    cmd = [
+        tool_path("ffmpeg"), '-y', '-v', 'error', '-i', str(file_path),
+        '-map', '0:a:0', '-ac', '1', '-ar', '16000',
+        '-c:a', spec['codec'], '-b:a', f"{kbps}k", *spec['options'],
+        str(tmp_file)
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0 or not tmp_file.exists():
+        raise RuntimeError(f"转码失败: {result.stderr.strip()[-200:]}")
+    os.replace(tmp_file, output_file)
+    size_mb = output_file.stat().st_size / (1024 * 1024)
+    print_info(f"{file_path.name} 转码为 {fmt} {kbps}kbps: {size_mb:.2f} MB")
+    return output_file
+
+def detect_silences(file_path):
+    """用 ffmpeg silencedetect 找出所有静音区间 [(start, end), ...]，失败时返回 None"""
+    cmd = [
+        tool_path("ffmpeg"), '-hide_banner', '-nostats', '-i', str(file_path),
+        '-map', '0:a:0', '-af', f"silencedetect=noise={SILENCE_NOISE_DB}dB:d={SILENCE_MIN_DURATION}",
+        '-f', 'null', '-'
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, errors='replace')
+    if result.returncode != 0:
+        return None
+    silences = []
+    start = None
+    for line in result.stderr.splitlines():
+        m = re.search(r"silence_start: (-?[\d.]+)", line)
+        if m:
+            start = max(0.0, float(m.group(1)))
+            continue
+        m = re.search(r"silence_end: ([\d.]+)", line)
+        if m and start is not None:
+            silences.append((start, float(m.group(1))))
+            start = None
+    if start is not None:
+        # 静音一直持续到文件末尾
+        silences.append((start, float('inf')))
+    return silences
+
+def plan_silence_segments(duration, silences, max_len):
+    """根据静音区间规划片段，每个片段是原文件上若干有声区间的列表 [[(start, end), ...], ...]
+    
+    长于 SILENCE_DROP_DURATION 的静音（两端各保留 SILENCE_PADDING）被丢弃，两段长静音
+    之间短于 SILENCE_MIN_KEEP 的有声区间也一并丢弃。单个有声区间超过 max_len 时，
+    优先在靠近上限的静音中点处切开，找不到静音才在上限处硬切。切好的区间按顺序
+    拼成片段，每个片段合计不超过 max_len。
+    """
+    keep = []
+    cursor = 0.0
+    for start, end in silences:
+        end = min(end, duration)
+        if end - start >= SILENCE_DROP_DURATION:
+            cut_start = start + SILENCE_PADDING if start > 0 else 0.0
+            cut_end = end - SILENCE_PADDING if end < duration else duration
+            if cut_start > cursor:
+                keep.append((cursor, cut_start))
+            cursor = max(cursor, cut_end)
+    if cursor < duration:
+        keep.append((cursor, duration))
+    if len(keep) > 1:
+        keep = [(start, end) for start, end in keep if end - start >= SILENCE_MIN_KEEP]
+    
+    midpoints = [(start + min(end, duration)) / 2 for start, end in silences]
+    pieces = []
+    for start, end in keep:
+        while end - start > max_len:
+            limit = start + max_len
+            candidates = [m for m in midpoints if start + max_len / 2 <= m <= limit]
+            cut = candidates[-1] if candidates else limit
+            pieces.append((start, cut))
+            start = cut
+        if end - start > 0.05:
+            pieces.append((start, end))
+    
+    segments = []
+    length = max_len
+    for start, end in pieces:
+        if length + (end - start) > max_len:
+            segments.append([])
+            length = 0.0
+        segments[-1].append((start, end))
+        length += end - start
+    return segments
+
+def _concat_quote(path):
+    """ffconcat 列表中的文件路径：单引号包裹，内部的单引号转义"""
+    return "'" + str(path).replace("'", "'\\''") + "'"
+
+def split_audio_on_silence(file_path, output_dir):
+    """在静音处切分音频，并丢弃长静音以减少计费时长
     
+    每个片段由原文件上的若干有声区间拼接而成（concat 复用器，流复制不重新编码），
+    片段的 offsets 为各区间的 [(片段内偏移, 原文件偏移), ...]（秒），由
+    remap_sentences 把识别结果的时间映射回原文件。去掉的静音不足
+    SILENCE_MIN_SAVING 且文件无需切分时返回 []，由调用方按原方式处理。
+    """
+    file_path = Path(file_path)
     duration = get_audio_duration(file_path)
     if duration == 0:
-        print_error(f"无法获取音频时长: {file_path}")
+        return []
+    silences = detect_silences(file_path)
+    if silences is None:
+        print_warning(f"静音检测失败，按常规方式处理: {file_path.name}")
         return []
     
-    num_segments = int(duration // segment_duration) + 1
-    print_info(f"音频时长: {duration:.1f}秒，将切分为 {num_segments} 段")
+    file_size = file_path.stat().st_size
+    max_len = segment_duration_for(file_size, duration)
+    planned = plan_silence_segments(duration, silences, max_len)
+    kept = sum(end - start for ranges in planned for start, end in ranges)
+    if not planned or (file_size <= MAX_FILE_SIZE_MB * 1024 * 1024 and duration - kept < duration * SILENCE_MIN_SAVING):
+        return []
+    print_info(f"{file_path.name} 静音裁剪: 保留 {format_duration(kept)} / {format_duration(duration)}，"
+               f"共 {len(planned)} 段")
     
+    # 每段一个 ffmpeg 进程：concat 复用器按 inpoint/outpoint 定位读取各区间并首尾相接，
+    # 下一区间的时间戳紧接在上一区间的标称时长之后，与 offsets 一致
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    stem = file_path.stem
+    ext = file_path.suffix
+    source = _concat_quote(file_path.resolve())
     segments = []
-    for i in range(num_segments):
-        start_time = i * segment_duration
+    for i, ranges in enumerate(planned):
         output_file = Path(output_dir) / f"{stem}_part{i:03d}{ext}"
-        
+        list_file = Path(output_dir) / f"{stem}_part{i:03d}.ffconcat"
+        offsets = []
+        length = 0.0
+        lines = ["ffconcat version 1.0"]
+        for start, end in ranges:
+            offsets.append((length, start))
+            length += end - start
+            lines += [f"file {source}", f"inpoint {start:.3f}", f"outpoint {end:.3f}"]
+        list_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
         cmd = [
-            FFMPEG, '-y', '-i', str(file_path),
-            '-ss', str(start_time),
-            '-t', str(segment_duration),
-            '-c', 'copy',
-            str(output_file)
+            tool_path("ffmpeg"), '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', str(list_file),
+            '-map', '0:a', '-c', 'copy', str(output_file)
         ]
-        
         result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode == 0 and output_file.exists():
-            segments.append({
-                'path': output_file,
-                'start_time': start_time,
-                'index': i
-            })
-            print_info(f"  切分片段 {i+1}/{num_segments}: {output_file.name}")
-        else:
-            print_warning(f"  切分片段 {i+1} 失败")
-    
+        list_file.unlink()
+        if result.returncode != 0 or not output_file.exists():
+            raise RuntimeError(f"切分片段 {i+1} 失败: {result.stderr.strip()[-200:]}")
+        segments.append({
+            'path': output_file,
+            'start_time': ranges[0][0],
+            'duration': length,
+            'index': i,
+            'offsets': offsets,
+        })
     return segments
 
-def adjust_timestamps(result_text, offset_seconds):
-    """调整时间戳偏移"""
-    lines = result_text.strip().split('\n')
-    adjusted_lines = []
+# === 识别结果 ===
+# Result 文本中的一行，如 "[1:5.020,1:8.380,0]  文本"（不开启说话人分离时没有第三项）
+RESULT_LINE_RE = re.compile(r"\[(\d+):(\d+(?:\.\d*)?),(\d+):(\d+(?:\.\d*)?)(?:,(\d+))?\]\s*(.*)")
+
+class Sentence:
+    """一句识别结果
+    
+    start_ms/end_ms 为相对原文件的毫秒数，speaker 为说话人编号（没有时为 None），
+    words 为 (词, 句内起始毫秒, 句内结束毫秒) 元组，来自 ResultDetail 的 Words。
+    """
+    __slots__ = ('start_ms', 'end_ms', 'speaker', 'text', 'words')
     
-    for line in lines:
-        if not line.strip():
+    def __init__(self, start_ms, end_ms, speaker, text, words=()):
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.speaker = speaker
+        self.text = text
+        self.words = words
+    
+    def row(self):
+        """紧凑的列表形式，用于缓存"""
+        return [self.start_ms, self.end_ms, self.speaker, self.text, [list(w) for w in self.words]]
+    
+    @classmethod
+    def from_row(cls, row):
+        start_ms, end_ms, speaker, text, words = row
+        return cls(start_ms, end_ms, speaker, text, tuple(tuple(w) for w in words))
+
+class TextNote(Sentence):
+    """没有可靠时间戳的说明行：缺失片段的占位，或 Result 中无法解析的行"""
+    __slots__ = ()
+
+def parse_result_text(result_text, offset_ms=0):
+    """解析 Result 文本为句子列表，时间加上 offset_ms；无法识别的行原样保留为一句"""
+    sentences = []
+    last_ms = offset_ms
+    for line in result_text.splitlines():
+        line = line.strip()
+        if not line:
             continue
-        try:
-            bracket_end = line.index(']')
-            timestamp_part = line[1:bracket_end]
-            text_part = line[bracket_end+1:].strip()
-            
-            parts = timestamp_part.split(',')
-            if len(parts) >= 3:
-                def parse_time(t):
-                    t = t.strip()
-                    if ':' in t:
-                        parts = t.split(':')
-                        return float(parts[0]) * 60 + float(parts[1])
-                    return float(t)
-                
-                def format_time(seconds):
-                    mins = int(seconds // 60)
-                    secs = seconds % 60
-                    return f"{mins}:{secs:.3f}"
-                
-                start = parse_time(parts[0]) + offset_seconds
-                end = parse_time(parts[1]) + offset_seconds
-                speaker = parts[2].strip()
-                
-                adjusted_line = f"[{format_time(start)},{format_time(end)},{speaker}]  {text_part}"
-                adjusted_lines.append(adjusted_line)
-            else:
-                adjusted_lines.append(line)
-        except:
-            adjusted_lines.append(line)
+        m = RESULT_LINE_RE.fullmatch(line)
+        if m is None:
+            sentences.append(TextNote(last_ms, last_ms, None, line))
+            continue
+        start_ms = round((int(m.group(1)) * 60 + float(m.group(2))) * 1000) + offset_ms
+        last_ms = round((int(m.group(3)) * 60 + float(m.group(4))) * 1000) + offset_ms
+        speaker = int(m.group(5)) if m.group(5) is not None else None
+        sentences.append(Sentence(start_ms, last_ms, speaker, m.group(6)))
+    return sentences
+
+def sentences_from_data(data, offset_ms=0):
+    """由 DescribeTaskStatus（或回调）的 Data 构建句子列表
     
-    return '\n'.join(adjusted_lines)
+    优先使用结构化的 ResultDetail（RES_TEXT_FORMAT >= 1 时返回），
+    没有时（如旧的断点和缓存）退回解析 Result 文本。
+    """
+    detail = data.get("ResultDetail")
+    if not detail:
+        return parse_result_text(data.get("Result") or "", offset_ms)
+    return [
+        Sentence(d.get("StartMs", 0) + offset_ms, d.get("EndMs", 0) + offset_ms, d.get("SpeakerId"),
+                 d.get("FinalSentence", ""),
+                 tuple((w.get("Word", ""), w.get("OffsetStartMs", 0), w.get("OffsetEndMs", 0))
+                       for w in d.get("Words") or ()))
+        for d in detail
+    ]
 
-def process_single_file(file_path, temp_dir, secret_id, secret_key, region):
-    """处理单个文件"""
-    file_size_mb = file_path.stat().st_size / (1024 * 1024)
-    stem = file_path.stem
+def remap_sentences(sentences, offsets):
+    """把拼接片段中的句子时间映射回原文件时间轴
+    
+    offsets 为 [(片段内偏移, 原文件偏移), ...]（秒），见 split_audio_on_silence。
+    正好落在两个区间接缝处的时间，起点归后一区间，终点归前一区间。
+    """
+    starts = [round(seg_offset * 1000) for seg_offset, _ in offsets]
+    shifts = [round(original * 1000) - start for start, (_, original) in zip(starts, offsets)]
+    
+    def shift(ms, side=bisect_right):
+        return ms + shifts[max(0, side(starts, ms) - 1)]
+    
+    result = []
+    for s in sentences:
+        start_ms = shift(s.start_ms)
+        words = tuple((word, shift(s.start_ms + begin) - start_ms, shift(s.start_ms + end, bisect_left) - start_ms)
+                      for word, begin, end in s.words)
+        result.append(type(s)(start_ms, shift(s.end_ms, bisect_left), s.speaker, s.text, words))
+    return result
+
+def format_result_time(ms):
+    """Result 文本使用的 m:ss.sss 格式"""
+    return f"{ms // 60000}:{ms % 60000 / 1000:.3f}"
+
+def adjust_timestamps(result_text, offset_seconds):
+    """调整 Result 文本的时间戳偏移，返回同样格式的文本"""
+    sentences = parse_result_text(result_text, round(offset_seconds * 1000))
+    return "".join(_txt_entry(i, s) for i, s in enumerate(sentences, 1)).rstrip("\n")
+
+class MissingSegmentsError(RuntimeError):
+    """部分片段转写失败，携带其余片段拼接出的结果"""
+    
+    def __init__(self, missing, sentences, raw_data_list):
+        self.missing = missing
+        self.sentences = sentences
+        self.raw_data_list = raw_data_list
+        indexes = ", ".join(str(i + 1) for i, _ in missing)
+        super().__init__(f"{len(missing)} 个片段转写失败（片段 {indexes}）: {missing[0][1]}")
+
+class QuotaExhausted(Exception):
+    """今天的额度（免费额度加付费预算）不够提交任务，留待北京时间零点重置后"""
+
+class SegmentsDeferred(Exception):
+    """文件只完成了今天计划内的片段，其余片段留待以后"""
+    
+    def __init__(self, done_seconds, remaining_seconds):
+        self.done_seconds = done_seconds
+        self.remaining_seconds = remaining_seconds
+        super().__init__(f"剩余 {format_duration(remaining_seconds)} 留待以后")
+
+def segment_dir(temp_dir, file_path):
+    """文件切分片段的临时目录；按完整文件名区分，call.mp3 和 call.wav 互不覆盖"""
+    return Path(temp_dir) / Path(file_path).name
+
+def prepare_segments(file_path, temp_dir, duration=0, store=None, trim_silence=False, audio_path=None,
+                     whole_file=False):
+    """准备待上传的片段：沿用断点，或按静音/按大小切分，小文件直接作为一个片段
     
-    if file_size_mb <= MAX_FILE_SIZE_MB:
-        print_info(f"文件大小: {file_size_mb:.2f} MB（直接上传）")
-        task_id = create_task(file_path, secret_id, secret_key, region)
-        print_info(f"TaskId: {task_id}")
-        data = poll_result(task_id, secret_id, secret_key, region)
-        return data.get("Result", ""), [data]
+    返回的片段带有 task_id 和 result 字段；新的切分结果会写入 store 的断点。
+    whole_file 为 True（URL 上传模式）时，不超过 URL 方式上限的文件不再按大小切分。
+    其余参数含义同 process_single_file。
+    """
+    st = file_path.stat()
+    audio_path = Path(audio_path) if audio_path else file_path
+    file_size_mb = audio_path.stat().st_size / (1024 * 1024)
+    name = file_path.name
+    source_sig = f"{st.st_size}:{st.st_mtime_ns}"
+    temp_seg_dir = segment_dir(temp_dir, file_path)
+    
+    # 断点：源文件未变化且未完成片段的切分文件都还在时直接沿用
+    segments = store.load_segments(name, source_sig) if store else []
+    if segments and not all(seg['result'] is not None or seg['path'].exists() for seg in segments):
+        segments = []
+    if segments:
+        finished = sum(1 for seg in segments if seg['result'] is not None)
+        print_info(f"{name} 从断点继续: {finished}/{len(segments)} 个片段已完成")
     else:
-        print_info(f"文件大小: {file_size_mb:.2f} MB（需要切分）")
-        
-        temp_seg_dir = Path(temp_dir) / stem
         if temp_seg_dir.exists():
             shutil.rmtree(temp_seg_dir)
-        
-        segments = split_audio(file_path, temp_seg_dir)
+        if trim_silence:
+            with metrics.stage("split", method="silence", bytes=audio_path.stat().st_size) as info:
+                segments = split_audio_on_silence(audio_path, temp_seg_dir)
+                info['segments'] = len(segments)
         if not segments:
-            raise RuntimeError("切分失败")
-        
-        all_results = []
-        all_texts = []
-        
+            if file_size_mb <= MAX_FILE_SIZE_MB or (
+                    whole_file and file_size_mb <= URL_MAX_FILE_SIZE_MB and duration <= URL_MAX_DURATION):
+                print_info(f"{name} 文件大小: {file_size_mb:.2f} MB（直接上传）")
+                segments = [{'path': audio_path, 'start_time': 0, 'duration': duration, 'index': 0}]
+            else:
+                print_info(f"{name} 文件大小: {file_size_mb:.2f} MB（需要切分）")
+                with metrics.stage("split", method="size", bytes=audio_path.stat().st_size) as info:
+                    segments = split_audio(audio_path, temp_seg_dir)
+                    if not segments:
+                        raise RuntimeError("切分失败")
+                    info['segments'] = len(segments)
+    for seg in segments:
+        seg.setdefault('task_id', None)
+        seg.setdefault('result', None)
+    if store and not any(seg['task_id'] for seg in segments):
+        store.save_segments(name, source_sig, segments)
+    return segments
+
+def process_single_file(file_path, temp_dir, secret_id, secret_key, region, duration=0, poller=None, store=None,
+                        max_seconds=None, trim_silence=False, audio_path=None, account=None, segments=None,
+                        callback_url=None, source=None, pool=None, leases=None):
+    """处理单个文件
+    
+    传入 poller 时由统一轮询器等待结果，否则逐个阻塞轮询。传入 store 时
+    每个片段的切分结果、TaskId 和识别结果都即时写入进度库，中断后重跑
+    只会继续轮询在途任务、补传真正缺失的片段。指定 max_seconds 时本次
+    最多转写这么长的未完成片段，其余片段抛出 SegmentsDeferred 留待以后。
+    trim_silence 为 True 时在静音处切分并去掉长静音，见 split_audio_on_silence。
+    audio_path 为实际上传的音频（如 transcode_audio 的输出），默认即 file_path；
+    进度和断点仍以原文件为准。account 为凭据池中的账号名，用于按账号记录用量。
+    segments 为 prepare_segments 提前准备好的片段，不传时在这里准备。
+    callback_url 为回调地址，通常传入 poller.callback_url。source 为
+    open_audio_source 创建的音频来源，指定时以链接提交（SourceType 0），不再内联上传。
+    传入 pool（CredentialPool）时每个新任务提交前按账本检查 account 今天的剩余
+    额度，不够时不再提交并抛出 QuotaExhausted；已完成部分片段的文件抛出
+    SegmentsDeferred。传入 leases（LeaseManager）时每个新任务提交前确认仍持有
+    该文件的租约，已被其他 worker 接手时不再提交并抛出 LeaseLost，避免重复计费。
+    """
+    audio_path = Path(audio_path) if audio_path else file_path
+    stem = file_path.stem
+    name = file_path.name
+    temp_seg_dir = segment_dir(temp_dir, file_path)
+    if segments is None:
+        segments = prepare_segments(file_path, temp_dir, duration, store, trim_silence, audio_path)
+    
+    def wait_result(task_id, seconds):
+        if poller is not None:
+            return poller.wait(task_id, seconds)
+        return poll_result(task_id, secret_id, secret_key, region, seconds)
+    
+    split = segments[0]['path'] != audio_path
+    total = len(segments)
+    
+    # 跨天切分：按顺序挑选不超过 max_seconds 的未完成片段（至少一段，保证有进展）
+    deferred = []
+    if max_seconds is not None:
+        budget = max_seconds
         for seg in segments:
-            seg_path = seg['path']
-            seg_start = seg['start_time']
-            seg_size_mb = seg_path.stat().st_size / (1024 * 1024)
-            
-            print_info(f"  转写片段 {seg['index']+1}/{len(segments)}: {seg_path.name} ({seg_size_mb:.2f} MB)")
-            
+            if seg['result'] is not None or seg['task_id']:
+                continue
+            if seg['duration'] <= budget or budget == max_seconds:
+                budget -= seg['duration']
+            else:
+                deferred.append(seg)
+        segments = [seg for seg in segments if seg not in deferred]
+    
+    file_context = metrics.current()
+    
+    def transcribe_segment(seg):
+        if seg['result'] is not None:
+            return seg['result']
+        with metrics.context(**file_context, segment=seg['index']), \
+                metrics.stage("segment", audio_seconds=seg['duration']) as info:
+            data = _transcribe_segment(seg)
+            info['billed_seconds'] = data.get("AudioDuration") or seg['duration']
+            return data
+    
+    def _transcribe_segment(seg):
+        seg_path = seg['path']
+        data = None
+        task_id = seg['task_id']
+        if task_id:
+            # 上次运行已提交的任务：继续轮询，不重复上传
+            print_info(f"    {seg_path.name} 继续轮询 TaskId: {task_id}")
+            try:
+                data = wait_result(task_id, seg['duration'])
+            except TimeoutError:
+                raise
+            except RuntimeError as e:
+                print_warning(f"    {seg_path.name} 原任务不可用，重新提交: {e}")
+        if data is None:
+            if split:
+                seg_size_mb = seg_path.stat().st_size / (1024 * 1024)
+                print_info(f"  {stem} 转写片段 {seg['index']+1}/{total}: {seg_path.name} ({seg_size_mb:.2f} MB)")
+            if leases is not None:
+                leases.check(name)
+            if pool is not None and not pool.admit(store, account, seg['duration']):
+                raise QuotaExhausted(f"今日额度不足，{seg_path.name} 留待额度重置后转写")
+            url = None
+            try:
+                if source:
+                    url = source.publish(seg_path)
+                try:
+                    task_id = create_task(seg_path, secret_id, secret_key, region, callback_url, url)
+                except TencentApiError as e:
+                    if not is_quota_exhausted(e):
+                        raise
+                    # 以服务端为准：今天不再向这个账号提交
+                    if store:
+                        store.mark_exhausted(account)
+                    raise QuotaExhausted(f"服务端额度已用完: {e}")
+                if store:
+                    store.set_segment_task(name, seg['index'], task_id, account)
+                print_info(f"    {seg_path.name} TaskId: {task_id}")
+                data = wait_result(task_id, seg['duration'])
+                record(seg, task_id, data)
+                return data
+            finally:
+                if url:
+                    source.unpublish(url)
+                # 计费已记入账本（或任务未成功）后才释放预占
+                if pool is not None:
+                    pool.settle(account, seg['duration'])
+        record(seg, task_id, data)
+        return data
+    
+    def record(seg, task_id, data):
+        if store:
+            store.set_segment_result(name, seg['index'], data)
+            store.record_usage(task_id, data.get("AudioDuration") or seg['duration'], account=account,
+                               file_name=name, estimated=seg['duration'])
+    
+    # 同一文件的片段并发提交（受 SEGMENT_WORKERS 限制），完成后再按 index 顺序拼接
+    done = {}
+    missing = []
+    with ThreadPoolExecutor(max_workers=min(SEGMENT_WORKERS, total)) as executor:
+        futures = {executor.submit(transcribe_segment, seg): seg for seg in segments}
+        for future in as_completed(futures):
+            seg = futures[future]
             try:
-                task_id = create_task(seg_path, secret_id, secret_key, region)
-                print_info(f"    TaskId: {task_id}")
-                data = poll_result(task_id, secret_id, secret_key, region)
-                result_text = data.get("Result", "")
-                
-                adjusted_text = adjust_timestamps(result_text, seg_start)
-                all_texts.append(adjusted_text)
-                all_results.append(data)
-                
-                print_info(f"    ✅ 片段转写完成")
+                done[seg['index']] = future.result()
+                if split:
+                    print_info(f"    ✅ {seg['path'].name} 转写完成")
             except Exception as e:
-                print_error(f"    ✗ 片段转写失败: {e}")
-        
-        shutil.rmtree(temp_seg_dir)
-        
-        merged_text = '\n'.join(all_texts)
-        return merged_text, all_results
+                if split:
+                    print_error(f"    ✗ {seg['path'].name} 转写失败: {e}")
+                missing.append((seg['index'], e))
+    
+    # 租约已被接手：结果交给新的持有者，这里不保存也不记失败
+    for _, e in missing:
+        if isinstance(e, LeaseLost):
+            raise e
+    
+    # 只因额度不足而未提交的片段留待额度重置后，不算失败
+    if missing and all(isinstance(e, QuotaExhausted) for _, e in missing):
+        done_seconds = sum(seg['duration'] for seg in segments if seg['result'] is None and seg['index'] in done)
+        if split and done_seconds:
+            remaining = sum(seg['duration'] for seg in segments + deferred if seg['index'] not in done)
+            raise SegmentsDeferred(done_seconds, remaining)
+        raise missing[0][1]
+    
+    if not split:
+        if missing:
+            raise missing[0][1]
+        if store:
+            store.clear_segments(name)
+        data = done[0]
+        return sentences_from_data(data), [data]
+    
+    if deferred and not missing:
+        done_seconds = sum(seg['duration'] for seg in segments if seg['result'] is None and seg['index'] in done)
+        raise SegmentsDeferred(done_seconds, sum(seg['duration'] for seg in deferred))
+    
+    # 片段偏移按毫秒直接加到句子时间上，不再重新解析文本
+    all_results = []
+    sentences = []
+    for seg in sorted(segments + deferred, key=lambda x: x['index']):
+        offset_ms = round(seg['start_time'] * 1000)
+        offsets = seg.get('offsets')
+        data = done.get(seg['index'])
+        if data is None:
+            # 缺失的片段在结果中显式标出，不再悄悄跳过
+            end_ms = offset_ms + round(seg['duration'] * 1000)
+            if offsets:
+                end_ms = round((offsets[-1][1] + seg['duration'] - offsets[-1][0]) * 1000)
+            sentences.append(TextNote(offset_ms, end_ms, None,
+                                      f"[片段 {seg['index']+1} 缺失: {format_duration(seg['start_time'])} 起]"))
+            continue
+        if offsets:
+            sentences.extend(remap_sentences(sentences_from_data(data), offsets))
+        else:
+            sentences.extend(sentences_from_data(data, offset_ms))
+        all_results.append(data)
+    
+    if missing:
+        # 保留切分文件和断点，下次只补传缺失的片段
+        raise MissingSegmentsError(sorted(missing, key=lambda x: x[0]), sentences, all_results)
+    
+    shutil.rmtree(temp_seg_dir, ignore_errors=True)
+    if store:
+        store.clear_segments(name)
+    return sentences, all_results
+
+def _srt_time(ms, sep=","):
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}{sep}{ms % 1000:03d}"
+
+def _cue_text(s):
+    if s.speaker is None or isinstance(s, TextNote):
+        return s.text
+    return f"[说话人{s.speaker}] {s.text}"
+
+def _txt_header(audio_path):
+    return (f"转写文件：{audio_path.name}\n"
+            f"转写时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"转写工具：腾讯云ASR\n"
+            + "=" * 60 + "\n\n")
+
+def _txt_entry(i, s):
+    if isinstance(s, TextNote):
+        return s.text + "\n"
+    speaker = f",{s.speaker}" if s.speaker is not None else ""
+    return f"[{format_result_time(s.start_ms)},{format_result_time(s.end_ms)}{speaker}]  {s.text}\n"
+
+def _srt_entry(i, s):
+    return f"{i}\n{_srt_time(s.start_ms)} --> {_srt_time(s.end_ms)}\n{_cue_text(s)}\n\n"
 
-def save_outputs(output_dir, audio_path, result_text, raw_data_list):
-    """保存转写结果"""
+def _vtt_entry(i, s):
+    return f"{_srt_time(s.start_ms, '.')} --> {_srt_time(s.end_ms, '.')}\n{_cue_text(s)}\n\n"
+
+def _jsonl_entry(i, s):
+    entry = {"start_ms": s.start_ms, "end_ms": s.end_ms, "speaker": s.speaker, "text": s.text}
+    if isinstance(s, TextNote):
+        entry["note"] = True
+    if s.words:
+        entry["words"] = [{"word": w, "start_ms": s.start_ms + a, "end_ms": s.start_ms + b} for w, a, b in s.words]
+    return json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n"
+
+# 结果格式 -> (文件头, 每句的写法)
+TRANSCRIPT_WRITERS = {
+    'txt': (_txt_header, _txt_entry),
+    'srt': (None, _srt_entry),
+    'vtt': (lambda audio_path: "WEBVTT\n\n", _vtt_entry),
+    'jsonl': (None, _jsonl_entry),
+}
+
+def save_outputs(output_dir, audio_path, sentences, raw_data_list, formats=OUTPUT_FORMATS):
+    """保存转写结果，返回写出的文件列表"""
+    with metrics.stage("save") as info:
+        paths = _save_outputs(output_dir, audio_path, sentences, raw_data_list, formats)
+        info['bytes'] = sum(p.stat().st_size for p in paths)
+    return paths
+
+def _save_outputs(output_dir, audio_path, sentences, raw_data_list, formats):
+    """一次遍历句子，同时流式写出各格式的文件；原始 JSON 紧凑写出"""
     Path(output_dir).mkdir(parents=True, exist_ok=True)
     stem = Path(audio_path).stem
     raw_path = Path(output_dir) / f"{stem}.json"
-    txt_path = Path(output_dir) / f"{stem}.txt"
     
     with open(raw_path, "w", encoding="utf-8") as f:
-        json.dump(raw_data_list, f, ensure_ascii=False, indent=2)
+        json.dump(raw_data_list, f, ensure_ascii=False, separators=(',', ':'))
+    
+    paths = [Path(output_dir) / f"{stem}.{fmt}" for fmt in formats]
+    files = [open(path, "w", encoding="utf-8") for path in paths]
+    try:
+        writers = []
+        for fmt, f in zip(formats, files):
+            header, entry = TRANSCRIPT_WRITERS[fmt]
+            if header:
+                f.write(header(Path(audio_path)))
+            writers.append((f.write, entry))
+        for i, sentence in enumerate(sentences, 1):
+            for write, entry in writers:
+                write(entry(i, sentence))
+    finally:
+        for f in files:
+            f.close()
+    
+    print_info(f"保存转写结果: {', '.join(str(p) for p in paths)}")
+    return paths + [raw_path]
+
+# === 结果缓存 ===
+def audio_fingerprint(file_path):
+    """快速内容指纹：小文件整体哈希，大文件取均匀分布的若干块加文件大小"""
+    size = os.path.getsize(file_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        if size <= FINGERPRINT_FULL_BYTES:
+            digest.update(f.read())
+        else:
+            step = (size - FINGERPRINT_BLOCK_BYTES) / (FINGERPRINT_BLOCKS - 1)
+            for i in range(FINGERPRINT_BLOCKS):
+                f.seek(int(i * step))
+                digest.update(f.read(FINGERPRINT_BLOCK_BYTES))
+    return digest.hexdigest()
+
+def result_cache_key(content_hash):
+    """缓存键：内容指纹 + 影响识别结果的引擎参数"""
+    params = f"{content_hash}|{ENGINE_MODEL}|{SPEAKER_NUM}|{SPEAKER_DIARIZATION}|{RES_TEXT_FORMAT}"
+    return hashlib.sha256(params.encode()).hexdigest()
+
+class ResultCache:
+    """按内容寻址的转写结果缓存
+    
+    每条结果一个 JSON 文件，命中时更新修改时间；总大小超过上限时按修改时间
+    从旧到新淘汰（LRU）。改名或复制的录音直接从缓存取结果，不再消耗额度。
+    """
+    
+    def __init__(self, cache_dir, max_bytes=CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total = sum(p.stat().st_size for p in self.cache_dir.glob("*.json"))
+    
+    def _path(self, key):
+        return self.cache_dir / f"{key}.json"
+    
+    def get(self, key):
+        """返回 (sentences, raw_data_list)，未命中时返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if 'sentences' in entry:
+            return [Sentence.from_row(row) for row in entry['sentences']], entry['raw']
+        # 旧版缓存只保存了文本
+        return parse_result_text(entry['text']), entry['raw']
+    
+    def put(self, key, sentences, raw_data_list):
+        """写入一条结果；缓存只是优化，写入失败（磁盘满、目录被清理等）只警告不抛出"""
+        path = self._path(key)
+        tmp_path = temp_path(path)
+        rows = [s.row() for s in sentences]
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'sentences': rows, 'raw': raw_data_list}, f, ensure_ascii=False, separators=(',', ':'))
+            size = tmp_path.stat().st_size
+            with self._lock:
+                try:
+                    old = path.stat().st_size
+                except FileNotFoundError:
+                    old = 0
+                os.replace(tmp_path, path)
+                self._total += size - old
+                if self._total > self.max_bytes:
+                    self._evict()
+        except OSError as e:
+            tmp_path.unlink(missing_ok=True)
+            print_warning(f"写入结果缓存失败: {e}")
+    
+    def _evict(self):
+        # 其他进程可能共用同一缓存目录，条目随时会被删掉
+        entries = []
+        for p in self.cache_dir.glob("*.json"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        entries.sort()
+        for _, size, p in entries:
+            if self._total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            self._total -= size
+
+# === 多进程协作 ===
+class FileClaimed(Exception):
+    """文件已被其他 worker 领取或完成"""
+
+class LeaseLost(FileClaimed):
+    """处理途中租约被其他 worker 接手（如续约不及时过期），当前 worker 放弃该文件"""
+
+class LeaseManager:
+    """基于共享目录中租约文件的工作领取
+    
+    领取文件时用 O_CREAT|O_EXCL 创建 <文件名>.lease，内容为持有者和到期时间；
+    处理期间后台线程定期续约。进程崩溃后租约过期，其他 worker（可以在另一台
+    挂载同一输出目录的机器上）即可接手，同一文件不会被同时处理。
+    租约被接手的文件记为丢失，处理方在每次提交任务前调用 check() 及时放弃。
+    """
+    
+    def __init__(self, lease_dir, ttl=LEASE_TTL, worker_id=None):
+        self.lease_dir = Path(lease_dir)
+        self.lease_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self._held = {}
+        self._lost = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew_loop, name="lease-renew", daemon=True)
+        self._thread.start()
+    
+    def _path(self, name):
+        return self.lease_dir / f"{name}.lease"
+    
+    def _content(self):
+        return json.dumps({'worker': self.worker_id, 'expires': time.time() + self.ttl})
+    
+    def _read(self, path):
+        """读取租约，文件不存在时返回 None；内容不完整时按修改时间估算到期时间"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            try:
+                return {'worker': None, 'expires': path.stat().st_mtime + self.ttl}
+            except FileNotFoundError:
+                return None
+    
+    def acquire(self, name):
+        """尝试领取文件，成功返回 True"""
+        path = self._path(name)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_expired(path):
+                    return False
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(self._content())
+            with self._lock:
+                self._held[name] = path
+                self._lost.discard(name)
+            return True
+        return False
     
-    with open(txt_path, "w", encoding="utf-8") as f:
-        f.write(f"转写文件：{audio_path.name}\n")
-        f.write(f"转写时间：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"转写工具：腾讯云ASR\n")
-        f.write("=" * 60 + "\n\n")
-        f.write(result_text)
+    def _break_expired(self, path):
+        """清除过期租约；租约仍有效时返回 False"""
+        lease = self._read(path)
+        if lease is None:
+            return True
+        if lease['expires'] > time.time():
+            return False
+        # 先改名再删除：多个 worker 同时发现过期时只有一个改名成功
+        stale = path.with_name(f"{path.name}.{self.worker_id}.stale")
+        try:
+            os.rename(path, stale)
+        except FileNotFoundError:
+            return True
+        lease = self._read(stale)
+        if lease and lease['expires'] > time.time():
+            # 改名期间别的 worker 已经重新领取，把租约还回去
+            try:
+                os.link(stale, path)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return False
+        os.unlink(stale)
+        return True
+    
+    def check(self, name):
+        """确认仍持有 name 的租约，已被其他 worker 接手时抛出 LeaseLost"""
+        with self._lock:
+            path = self._held.get(name)
+            lost = name in self._lost
+        if not lost and path is not None:
+            lease = self._read(path)
+            lost = not lease or lease.get('worker') != self.worker_id
+            if lost:
+                self._mark_lost(name)
+        if lost:
+            raise LeaseLost("租约已被其他 worker 接手，放弃处理")
+    
+    def _mark_lost(self, name):
+        with self._lock:
+            self._held.pop(name, None)
+            self._lost.add(name)
+        print_warning(f"{name} 的租约已被其他 worker 接手，停止提交新任务")
+    
+    def release(self, name):
+        """释放自己持有的租约"""
+        with self._lock:
+            path = self._held.pop(name, None)
+            self._lost.discard(name)
+        if path is None:
+            return
+        lease = self._read(path)
+        if lease and lease.get('worker') == self.worker_id:
+            path.unlink(missing_ok=True)
+    
+    def _renew_loop(self):
+        while not self._stop.wait(LEASE_RENEW_INTERVAL):
+            with self._lock:
+                held = list(self._held.items())
+            for name, path in held:
+                lease = self._read(path)
+                # 已过期的租约随时可能被其他 worker 接手，再覆盖会让两边都以为持有，只能放弃
+                if not lease or lease.get('worker') != self.worker_id or lease['expires'] <= time.time():
+                    self._mark_lost(name)
+                    continue
+                tmp_path = path.with_name(f"{path.name}.{self.worker_id}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(self._content())
+                os.replace(tmp_path, path)
+                # 读取和替换之间租约仍可能被接手，替换后再确认一次
+                lease = self._read(path)
+                if not lease or lease.get('worker') != self.worker_id:
+                    self._mark_lost(name)
+    
+    def close(self):
+        """停止续约并释放全部租约"""
+        self._stop.set()
+        self._thread.join()
+        for name in list(self._held):
+            self.release(name)
+
+def load_credentials(credentials_file, default_region, paid_hours=PAID_HOURS_PER_DAY):
+    """读取凭据池文件
+    
+    文件格式（JSON 列表）：
+      [{"name": "a", "secret_id": "...", "secret_key": "...", "region": "ap-shanghai", "free_hours": 10,
+        "paid_hours": 0}, ...]
+    name、region、free_hours、paid_hours 可省略，paid_hours 默认取参数 paid_hours。
+    """
+    with open(credentials_file, 'r', encoding='utf-8') as f:
+        accounts = json.load(f)
+    for account in accounts:
+        account.setdefault('name', account['secret_id'])
+        account.setdefault('region', default_region)
+        account.setdefault('free_hours', FREE_HOURS_PER_DAY)
+        account.setdefault('paid_hours', paid_hours)
+    return accounts
+
+class CredentialPool:
+    """多个腾讯云账号组成的凭据池
+    
+    每个账号的额度（免费额度加付费预算 paid_hours）按北京时间自然日单独统计，
+    以进度库 usage 表中接口返回的实际计费时长为准；新文件分配给今天剩余额度
+    最多的账号；本进程已分配但尚未计费的时长先预留，避免并发的文件都挤到
+    同一个账号。提交每个任务前用 admit() 再按账本检查一次，额度用完即停。
+    """
+    
+    def __init__(self, accounts):
+        self.accounts = {a['name']: a for a in accounts}
+        for account in self.accounts.values():
+            account.setdefault('paid_hours', PAID_HOURS_PER_DAY)
+        self._reserved = {name: 0 for name in self.accounts}
+        self._inflight = {name: 0 for name in self.accounts}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def single(cls, secret_id, secret_key, region, paid_hours=PAID_HOURS_PER_DAY):
+        return cls([{'name': secret_id, 'secret_id': secret_id, 'secret_key': secret_key,
+                     'region': region, 'free_hours': FREE_HOURS_PER_DAY, 'paid_hours': paid_hours}])
+    
+    def limit(self, name):
+        """账号每天可用的秒数（免费额度加付费预算）"""
+        account = self.accounts[name]
+        return (account['free_hours'] + account['paid_hours']) * 3600
+    
+    def daily_seconds(self):
+        """所有账号每天可用的秒数之和"""
+        return sum(self.limit(name) for name in self.accounts)
     
-    print_info(f"保存转写文本: {txt_path}")
-    return txt_path
+    def remaining(self, store, name, day=None):
+        """账号今天剩余的秒数（可能为负，表示已超出）；服务端报告额度用完时为 0"""
+        day = day or beijing_today()
+        if store.is_exhausted(name, day):
+            return 0
+        return self.limit(name) - store.usage_on(day, name)
+    
+    def remaining_total(self, store, day=None):
+        """所有账号今天剩余秒数之和"""
+        return sum(max(0, self.remaining(store, name, day)) for name in self.accounts)
+    
+    def admit(self, store, name, seconds):
+        """提交一个任务前检查额度：扣除在途任务后仍够 seconds 时预占并返回 True"""
+        with self._lock:
+            if self.remaining(store, name) - self._inflight[name] < seconds:
+                return False
+            self._inflight[name] += seconds
+            return True
+    
+    def settle(self, name, seconds):
+        """任务已记入账本（或未成功）后释放 admit() 的预占"""
+        with self._lock:
+            self._inflight[name] -= seconds
+    
+    def acquire(self, store, seconds, prefer=None):
+        """为一个文件挑选账号并预留时长；prefer 为断点任务所属账号"""
+        with self._lock:
+            if prefer in self.accounts:
+                name = prefer
+            else:
+                name = max(self.accounts, key=lambda n: self.remaining(store, n) - self._reserved[n])
+            self._reserved[name] += seconds
+            return self.accounts[name]
+    
+    def release(self, account, seconds):
+        with self._lock:
+            self._reserved[account['name']] -= seconds
+
+# === 预处理流水线 ===
+class PrepPipeline:
+    """有界的预处理流水线：上传线程处理前面的文件时，提前准备后面的文件
+    
+    prepare(item) 在独立的线程池中执行（转码、切分由 ffmpeg 子进程完成，
+    不占用 GIL），按批次顺序提前启动。已启动但尚未 release 的文件数不超过
+    limit，其临时文件预估大小之和不超过 disk_budget 字节；上传线程 get()
+    到尚未启动的文件时立即启动，不会因为预算而互相等待。
+    """
+    
+    def __init__(self, items, prepare, workers=PREP_WORKERS, limit=PREP_LOOKAHEAD,
+                 disk_budget=PREP_DISK_BUDGET_MB * 1024 * 1024, estimate=None):
+        self._prepare = prepare
+        self._estimate = estimate or (lambda item: 0)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self._pending = list(items)
+        self._futures = {}
+        self._reserved = {}
+        self._limit = max(1, limit)
+        self._disk_budget = disk_budget
+        self._disk_used = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._fill()
+    
+    def _start(self, item):
+        """在锁内调用：启动一个文件的预处理"""
+        key = id(item)
+        for i, pending in enumerate(self._pending):
+            if pending is item:
+                del self._pending[i]
+                break
+        size = self._estimate(item)
+        self._reserved[key] = size
+        self._disk_used += size
+        self._futures[key] = self._executor.submit(self._prepare, item)
+    
+    def _fill(self):
+        with self._lock:
+            while self._pending and not self._closed and len(self._reserved) < self._limit:
+                size = self._estimate(self._pending[0])
+                if self._reserved and self._disk_used + size > self._disk_budget:
+                    break
+                self._start(self._pending[0])
+    
+    def get(self, item):
+        """等待并返回 item 的预处理结果（异常原样抛出）"""
+        with self._lock:
+            if id(item) not in self._futures:
+                self._start(item)
+            future = self._futures[id(item)]
+        return future.result()
+    
+    def release(self, item):
+        """item 已上传完（临时文件已清理），腾出预算给后面的文件"""
+        with self._lock:
+            self._futures.pop(id(item), None)
+            self._disk_used -= self._reserved.pop(id(item), 0)
+        self._fill()
+    
+    def close(self):
+        """停止启动新的预处理并等待进行中的完成"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
 
 # === 主逻辑 ===
-def scan_files(input_dir):
-    """扫描所有音频文件并计算时长"""
+def probe_file(file_path):
+    """探测音频信息并计算内容指纹"""
+    info = probe_audio(file_path)
+    info['content_hash'] = audio_fingerprint(file_path)
+    return info
+
+def load_scan_index(index_file):
+    """加载扫描索引：{路径: {size, mtime_ns, duration, codec, bitrate}}"""
+    if index_file and Path(index_file).exists():
+        try:
+            with open(index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == SCAN_INDEX_VERSION:
+                return data.get("files", {})
+        except (OSError, ValueError):
+            print_warning(f"扫描索引损坏，将重新扫描: {index_file}")
+    return {}
+
+def save_scan_index(index_file, entries):
+    """原子写入扫描索引"""
+    Path(index_file).parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = temp_path(index_file)
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({"version": SCAN_INDEX_VERSION, "files": entries}, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_file, index_file)
+
+def scan_files(input_dir, index_file=None, workers=PROBE_WORKERS, settle_seconds=0):
+    """扫描所有音频文件并计算时长
+    
+    指定 index_file 时，路径、大小、修改时间都未变的文件直接复用索引中的
+    探测结果（含内容指纹），只有新增或变化的文件才会并行探测。
+    settle_seconds 大于 0 时跳过最近仍在修改（可能还没写完）的文件。
+    """
     print_info("扫描音频文件...")
-    files = []
+    index = load_scan_index(index_file)
+    
+    entries = {}
+    to_probe = []
+    settled_before = time.time() - settle_seconds
     for p in sorted(Path(input_dir).iterdir()):
         if p.suffix.lower() in SUPPORTED and p.is_file():
-            duration = get_audio_duration(p)
-            files.append({
-                'path': p,
-                'name': p.name,
-                'duration': duration,
-                'size_mb': p.stat().st_size / (1024 * 1024)
-            })
+            st = p.stat()
+            if settle_seconds and st.st_mtime > settled_before:
+                continue
+            key = str(p)
+            cached = index.get(key)
+            if cached and cached['size'] == st.st_size and cached['mtime_ns'] == st.st_mtime_ns:
+                entries[key] = cached
+            else:
+                entries[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+                to_probe.append(p)
+    
+    if to_probe:
+        print_info(f"探测 {len(to_probe)} 个新增或变化的文件（已缓存 {len(entries) - len(to_probe)} 个）")
+        with metrics.stage("probe", files=len(to_probe), bytes=sum(entries[str(p)]['size'] for p in to_probe)), \
+                ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for p, info in zip(to_probe, executor.map(probe_file, to_probe)):
+                entries[str(p)].update(info)
+    
+    if index_file:
+        # 探测失败（时长为 0）的文件不写入索引，下次重新探测；其他目录的条目原样保留
+        kept = {k: v for k, v in index.items() if Path(k).parent != Path(input_dir)}
+        kept.update({k: v for k, v in entries.items() if v.get('duration')})
+        if to_probe or len(kept) != len(index):
+            save_scan_index(index_file, kept)
+    
+    files = []
+    for key, entry in entries.items():
+        p = Path(key)
+        files.append({
+            'path': p,
+            'name': p.name,
+            'duration': entry.get('duration', 0),
+            'size_mb': entry['size'] / (1024 * 1024),
+            'codec': entry.get('codec'),
+            'bitrate': entry.get('bitrate', 0),
+            'content_hash': entry.get('content_hash'),
+        })
     return files
 
-def plan_batches(files, progress):
-    """规划分批处理"""
+def beijing_today():
+    """北京时间的当前日期（免费额度按北京时间自然日重置）"""
+    return datetime.now(BEIJING_TZ).date()
+
+def seconds_until_reset():
+    """距离下一次额度重置（北京时间零点）的秒数"""
+    now = datetime.now(BEIJING_TZ)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+def load_plan_rules(plan_file):
+    """读取优先级/截止日期规则
+    
+    文件格式（JSON 列表，按顺序匹配第一条）：
+      [{"match": "客户A_*.mp3", "priority": 10, "deadline": "2026-10-20"}, ...]
+    """
+    if not plan_file:
+        return []
+    with open(plan_file, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+    for rule in rules:
+        rule.setdefault('priority', 0)
+        rule.setdefault('deadline', None)
+        if rule['deadline']:
+            rule['deadline'] = datetime.strptime(rule['deadline'], "%Y-%m-%d").date()
+    return rules
+
+def match_plan_rule(name, rules):
+    for rule in rules:
+        if fnmatch.fnmatch(name, rule['match']):
+            return rule
+    return {'priority': 0, 'deadline': None}
+
+class _CapacityTree:
+    """每天剩余额度的最大值线段树，O(log n) 找到最早能放下给定时长的一天"""
+    
+    def __init__(self, capacities):
+        self.size = 1
+        while self.size < len(capacities):
+            self.size *= 2
+        self.tree = [-1.0] * (2 * self.size)
+        self.tree[self.size:self.size + len(capacities)] = capacities
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+    
+    def get(self, i):
+        return self.tree[self.size + i]
+    
+    def set(self, i, value):
+        i += self.size
+        self.tree[i] = value
+        i //= 2
+        while i:
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+            i //= 2
+    
+    def first_fit(self, need):
+        """剩余额度 >= need 的最早一天，没有时返回 -1"""
+        if self.tree[1] < need:
+            return -1
+        i = 1
+        while i < self.size:
+            i = 2 * i if self.tree[2 * i] >= need else 2 * i + 1
+        return i - self.size
+
+def plan_days(files, progress, used_today=0, rules=None, day_capacity=None):
+    """把待处理文件装箱到多天的免费额度里
+    
+    按（截止日期、优先级、时长）排序后做首次适应装箱：需要切分的大文件可以
+    在片段边界处拆到多天，第 1 天（今天）的额度扣除今天已实际计费的时长。
+    已部分完成的文件只计剩余时长。day_capacity 为每天的免费秒数（默认单账号
+    额度）。返回 {'days': [...], 'late': [...]}。
+    """
+    rules = rules or []
     completed = set(progress.get("completed", []))
-    pending = [f for f in files if f['name'] not in completed]
-    pending.sort(key=lambda x: x['duration'])
-    
-    day1_files = []
-    day2_files = []
-    day1_duration = 0
-    day2_duration = 0
-    
-    for f in pending:
-        duration_hours = f['duration'] / 3600
-        if day1_duration + duration_hours <= FREE_HOURS_PER_DAY:
-            day1_files.append(f)
-            day1_duration += duration_hours
-        else:
-            day2_files.append(f)
-            day2_duration += duration_hours
+    completed_hashes = progress.get("completed_hashes", {})
+    done_seconds = progress.get("partial", {})
+    day_capacity = day_capacity or FREE_HOURS_PER_DAY * 3600
+    today = beijing_today()
+    
+    pending = []
+    for f in files:
+        if f['name'] in completed:
+            # 同名文件内容已变化（或是另一个同名录音）时重新转写
+            old_hash = completed_hashes.get(f['name'])
+            if not old_hash or not f.get('content_hash') or old_hash == f['content_hash']:
+                continue
+        rule = match_plan_rule(f['name'], rules)
+        remaining = max(0, f['duration'] - done_seconds.get(f['name'], 0))
+        pending.append((rule, remaining, f))
+    far_future = today + timedelta(days=36500)
+    pending.sort(key=lambda x: (x[0]['deadline'] or far_future, -x[0]['priority'], x[1]))
+    
+    capacities = [max(0, day_capacity - used_today)]
+    total = sum(remaining for _, remaining, _ in pending)
+    capacities += [day_capacity] * (int(total // day_capacity) * 2 + 2)
+    tree = _CapacityTree(capacities)
+    day_items = {}
+    overflow = []
+    
+    def place(day, f, seconds, partial):
+        tree.set(day, tree.get(day) - seconds)
+        day_items.setdefault(day, []).append({'file': f, 'seconds': seconds, 'partial': partial})
+    
+    def first_fit(need):
+        nonlocal tree
+        day = tree.first_fit(need)
+        if day < 0:
+            # 天数不够时容量翻倍重建（均摊 O(1)）
+            caps = [tree.get(i) for i in range(len(capacities))]
+            capacities.extend([day_capacity] * len(capacities))
+            tree = _CapacityTree(caps + [day_capacity] * (len(capacities) - len(caps)))
+            day = tree.first_fit(need)
+        return day
+    
+    for rule, remaining, f in pending:
+        size_mb = f['size_mb']
+        if remaining > day_capacity and size_mb <= MAX_FILE_SIZE_MB:
+            # 无法切分又超过一天额度的文件单独占用一天（会超出免费额度）
+            overflow.append(f)
+            continue
+        if size_mb <= MAX_FILE_SIZE_MB or remaining <= 0:
+            place(first_fit(remaining), f, remaining, False)
+            continue
+        # 大文件按预估片段长度拆分到多天
+        seg_len = min(day_capacity, segment_duration_for(size_mb * 1024 * 1024, f['duration']))
+        left = remaining
+        while left > 0:
+            day = first_fit(min(seg_len, left))
+            free = tree.get(day)
+            piece = left if left <= free else (free // seg_len) * seg_len
+            place(day, f, piece, piece < left or left < remaining)
+            left -= piece
+    
+    last = max(day_items) if day_items else -1
+    for f in overflow:
+        last += 1
+        day_items[last] = [{'file': f, 'seconds': f['duration'], 'partial': False}]
     
-    return {
-        'day1': day1_files,
-        'day2': day2_files,
-        'day1_duration': day1_duration,
-        'day2_duration': day2_duration
-    }
+    days = []
+    late = []
+    for day in range(last + 1):
+        items = day_items.get(day, [])
+        date = today + timedelta(days=day)
+        capacity = capacities[0] if day == 0 else day_capacity
+        days.append({
+            'index': day + 1,
+            'date': date,
+            'capacity': capacity,
+            'seconds': sum(item['seconds'] for item in items),
+            'items': items,
+        })
+        for item in items:
+            deadline = match_plan_rule(item['file']['name'], rules)['deadline']
+            if deadline and date > deadline:
+                late.append((item['file']['name'], date, deadline))
+    return {'days': days, 'late': late}
 
-def show_status(input_dir, output_dir, progress_file):
+def show_status(input_dir, output_dir, progress_file, plan_file=None, pool=None):
     """显示当前状态"""
     print("=" * 70)
     print("腾讯云免费转写 - 状态查看")
     print("=" * 70)
     
-    progress = load_progress(progress_file)
-    files = scan_files(input_dir)
-    batches = plan_batches(files, progress)
+    store = ProgressStore(progress_file)
+    progress = store.snapshot()
+    today = beijing_today()
+    used_today = store.usage_on(today)
+    files = scan_files(input_dir, output_dir / SCAN_INDEX_NAME)
+    day_capacity = pool.daily_seconds() if pool else None
+    blocked = pool.daily_seconds() - pool.remaining_total(store) if pool else used_today
+    plan = plan_days(files, progress, blocked, load_plan_rules(plan_file), day_capacity)
     
     total_files = len(files)
     total_duration = sum(f['duration'] for f in files)
     completed_count = len(progress.get("completed", []))
     failed_count = len(progress.get("failed", []))
+    partial_count = len(progress.get("partial", {}))
     
     print()
     print(f"【总体情况】")
@@ -448,56 +3230,137 @@ def show_status(input_dir, output_dir, progress_file):
     print()
     print(f"【处理进度】")
     print(f"  已完成: {completed_count} 个")
+    print(f"  部分完成: {partial_count} 个")
     print(f"  失败: {failed_count} 个")
+    if progress.get("deferred"):
+        print(f"  额度用完、等待重置: {len(progress['deferred'])} 个")
     print(f"  待处理: {total_files - completed_count} 个")
     print()
     print(f"【分批计划】")
-    print(f"  第1天: {len(batches['day1'])} 个文件, {batches['day1_duration']:.2f} 小时")
-    print(f"  第2天: {len(batches['day2'])} 个文件, {batches['day2_duration']:.2f} 小时")
+    # 超出免费额度（动用付费预算）的计划时长
+    free_daily = (sum(a['free_hours'] for a in pool.accounts.values()) if pool else FREE_HOURS_PER_DAY) * 3600
+    exceed = 0
+    for day in plan['days']:
+        hours = day['seconds'] / 3600
+        split_note = sum(1 for item in day['items'] if item['partial'])
+        note = f"（其中 {split_note} 个跨天切分）" if split_note else ""
+        print(f"  第{day['index']}天 {day['date']}: {len(day['items'])} 个文件{note}, {hours:.2f} 小时")
+        free_left = max(0, free_daily - used_today) if day['index'] == 1 else free_daily
+        exceed += max(0, day['seconds'] - min(day['capacity'], free_left)) / 3600
+    if not plan['days']:
+        print(f"  没有待处理的文件")
+    for name, date, deadline in plan['late']:
+        print_warning(f"{name} 计划在 {date} 处理，晚于截止日期 {deadline}")
     print()
-    print(f"【免费额度】")
-    print(f"  每日免费: {FREE_HOURS_PER_DAY} 小时")
-    if batches['day1_duration'] <= FREE_HOURS_PER_DAY and batches['day2_duration'] <= FREE_HOURS_PER_DAY:
+    print(f"【今日额度】（北京时间 {today}，{format_duration(seconds_until_reset())} 后重置）")
+    if pool:
+        # 已用以接口返回的计费时长（账本）为准，括号内为这些已计费任务在提交前估算的时长；
+        # 其他进程已提交但尚未计费的任务不在账本里，这里无从得知
+        usage = store.usage_summary(today)
+        for name, account in pool.accounts.items():
+            count, billed, estimated = usage.get(name, (0, 0, 0))
+            paid = f" + 付费预算 {account['paid_hours']:g}" if account['paid_hours'] else ""
+            label = f"{name}: " if len(pool.accounts) > 1 else ""
+            status = "，服务端提示额度已用完" if store.is_exhausted(name, today) else ""
+            print(f"  {label}每日 {account['free_hours']:g}{paid} 小时，已计费 {billed/3600:.2f} 小时"
+                  f"（{count} 个任务，提交前估算 {estimated/3600:.2f} 小时），"
+                  f"剩余 {max(0, pool.remaining(store, name, today))/3600:.2f} 小时{status}")
+    else:
+        print(f"  每日免费: {FREE_HOURS_PER_DAY} 小时")
+    print(f"  今日已计费: {used_today/3600:.2f} 小时")
+    if exceed <= 0:
         print(f"  预计费用: 0 元 ✅ (在免费额度内)")
     else:
-        exceed = max(0, batches['day1_duration'] - FREE_HOURS_PER_DAY) + max(0, batches['day2_duration'] - FREE_HOURS_PER_DAY)
         print(f"  超出部分: {exceed:.2f} 小时")
         print(f"  预计费用: {exceed * 60 * 0.032:.2f} 元")
     print()
     
+    last_run = load_last_run(output_dir / EVENT_LOG_NAME)
+    if last_run:
+        show_run_summary(last_run)
+    
     if progress.get("last_update"):
         print(f"【最后更新】{progress['last_update']}")
     
     print("=" * 70)
 
-def run_day(day_num, input_dir, output_dir, temp_dir, progress_file, secret_id, secret_key, region, auto_confirm=False):
-    """运行指定天的转写任务"""
+def show_run_summary(run):
+    """打印一次运行的吞吐量和各阶段耗时（来自事件日志中的 run 事件）"""
+    seconds = max(run.get('seconds', 0), 1e-6)
+    started = datetime.fromtimestamp(run['ts'] - run.get('seconds', 0)).strftime("%Y-%m-%d %H:%M:%S")
+    print(f"【最近一次运行】")
+    print(f"  开始时间: {started}，耗时 {format_duration(seconds)}，并发 {run.get('workers', '-')}")
+    print(f"  文件: 成功 {run.get('succeeded', 0)}，失败 {run.get('failed', 0)}，"
+          f"部分完成 {run.get('partial', 0)}，其他 worker 处理 {run.get('skipped', 0)}"
+          + (f"，额度用完 {run['deferred']}" if run.get('deferred') else ""))
+    print(f"  吞吐: {run.get('succeeded', 0) / seconds * 3600:.1f} 文件/小时，"
+          f"{run.get('audio_seconds', 0) / seconds:.1f} 音频小时/小时")
+    stages = run.get('stages', {})
+    retries = sum(st['retries'] for st in stages.values())
+    polls = sum(st['polls'] for name, st in stages.items() if name == 'poll')
+    if retries or polls:
+        print(f"  API 重试 {retries} 次，状态查询 {polls} 次")
+    if stages:
+        print(f"  各阶段耗时（并发执行，累计值可能超过总耗时）:")
+        for name, st in sorted(stages.items(), key=lambda x: -x[1]['seconds']):
+            if name == 'run':
+                continue
+            errors = f"，失败 {st['errors']}" if st['errors'] else ""
+            print(f"    {STAGE_LABELS.get(name, name)}: 累计 {st['seconds']:.1f} 秒，"
+                  f"{st['count']} 次，平均 {st['seconds'] / max(st['count'], 1):.2f} 秒{errors}")
+    print()
+
+def run_day(day_num, input_dir, output_dir, temp_dir, progress_file, secret_id, secret_key, region, auto_confirm=False, workers=MAX_WORKERS, plan_file=None,
+            trim_silence=False, transcode=None, cache=None, settle_seconds=0, pool=None, metrics_file=None,
+            lookahead=PREP_LOOKAHEAD, disk_budget_mb=PREP_DISK_BUDGET_MB, callback_url=None, callback_listen=CALLBACK_LISTEN,
+            url_source=None, url_listen=URL_LISTEN, s3_endpoint=None, formats=OUTPUT_FORMATS):
+    """运行指定天的转写任务
+    
+    pool 为凭据池，默认只用 secret_id/secret_key 这一个账号。每个文件处理前
+    先在输出目录下领取租约，多个进程（或多台机器）可以同时处理同一批文件。
+    各阶段的耗时等指标写入输出目录下的 events.jsonl，指定 metrics_file 时
+    另外写出 Prometheus 文本格式的累计指标。转码和切分由预处理流水线提前
+    进行，最多领先上传 lookahead 个文件、占用 disk_budget_mb 的临时空间。
+    指定 callback_url 时在 callback_listen 上接收识别结果回调，查询仅作兜底。
+    指定 url_source 时音频以签名链接提交，大文件不再切分，见 open_audio_source。
+    formats 为要写出的结果格式（TRANSCRIPT_WRITERS 的键）。
+    """
     print("=" * 70)
     print(f"腾讯云免费转写 - 第 {day_num} 天")
     print("=" * 70)
     
     # 检查 ffmpeg
     try:
-        subprocess.run([FFMPEG, '-version'], capture_output=True, check=True)
-        print_info(f"使用 ffmpeg: {FFMPEG}")
-        print_info(f"使用 ffprobe: {FFPROBE}")
+        subprocess.run([tool_path("ffmpeg"), '-version'], capture_output=True, check=True)
+        print_info(f"使用 ffmpeg: {tool_path('ffmpeg')}")
+        print_info(f"使用 ffprobe: {tool_path('ffprobe')}")
     except Exception as e:
         print_error(f"未找到 ffmpeg，请先安装: brew install ffmpeg (macOS) 或 apt install ffmpeg (Linux)")
         return
     
-    progress = load_progress(progress_file)
-    files = scan_files(input_dir)
-    batches = plan_batches(files, progress)
+    metrics.open(output_dir / EVENT_LOG_NAME)
+    run_start = time.time()
+    pool = pool or CredentialPool.single(secret_id, secret_key, region)
+    store = ProgressStore(progress_file)
+    progress = store.snapshot()
+    used_today = store.usage_on(beijing_today())
+    remaining_today = pool.remaining_total(store)
+    files = scan_files(input_dir, output_dir / SCAN_INDEX_NAME, settle_seconds=settle_seconds)
+    plan = plan_days(files, progress, pool.daily_seconds() - remaining_today, load_plan_rules(plan_file),
+                     pool.daily_seconds())
     
-    if day_num == 1:
-        batch_files = batches['day1']
-        batch_duration = batches['day1_duration']
-    else:
-        batch_files = batches['day2']
-        batch_duration = batches['day2_duration']
+    day = plan['days'][day_num - 1] if day_num <= len(plan['days']) else None
+    batch_items = day['items'] if day else []
+    batch_files = [item['file'] for item in batch_items]
+    batch_duration = day['seconds'] / 3600 if day else 0
+    day_quota = day['capacity'] / 3600 if day else 0
     
     if not batch_files:
-        print_success("没有需要处理的文件！")
+        if day_num == 1 and remaining_today <= 0 and plan['days']:
+            print_warning(f"今日额度已用完，{format_duration(seconds_until_reset())} 后（北京时间零点）重置")
+        else:
+            print_success("没有需要处理的文件！")
+        metrics.close()
         return
     
     print()
@@ -505,10 +3368,12 @@ def run_day(day_num, input_dir, output_dir, temp_dir, progress_file, secret_id,
     print_info(f"输出目录: {output_dir}")
     print_info(f"待处理: {len(batch_files)} 个文件")
     print_info(f"预计时长: {batch_duration:.2f} 小时")
-    print_info(f"免费额度: {FREE_HOURS_PER_DAY} 小时")
+    paid = sum(a['paid_hours'] for a in pool.accounts.values())
+    budget = f"免费额度: {pool.daily_seconds() / 3600 - paid:g} 小时" + (f" + 付费预算 {paid:g} 小时" if paid else "")
+    print_info(f"{budget}（今日已计费 {used_today/3600:.2f} 小时，可用 {day_quota:.2f} 小时）")
     
-    if batch_duration > FREE_HOURS_PER_DAY:
-        print_warning(f"注意: 今日任务超出免费额度 {batch_duration - FREE_HOURS_PER_DAY:.2f} 小时")
+    if batch_duration > day_quota + 1e-6:
+        print_warning(f"注意: 今日任务超出免费额度 {batch_duration - day_quota:.2f} 小时")
     else:
         print_success(f"今日任务在免费额度内 ✅")
     
@@ -518,6 +3383,7 @@ def run_day(day_num, input_dir, output_dir, temp_dir, progress_file, secret_id,
         confirm = input("是否开始转写? (y/n): ").strip().lower()
         if confirm != 'y':
             print("已取消")
+            metrics.close()
             return
     else:
         print_info("自动确认模式，开始转写...")
@@ -526,32 +3392,194 @@ def run_day(day_num, input_dir, output_dir, temp_dir, progress_file, secret_id,
     
     results = []
     processed_duration = 0
+    workers = max(1, min(workers, len(batch_files)))
+    print_info(f"并发数: {workers}")
     
-    for idx, f in enumerate(batch_files, 1):
-        file_path = f['path']
-        duration = f['duration']
-        
-        print_step(f"[{idx}/{len(batch_files)}] 处理: {file_path.name}")
-        print_info(f"时长: {format_duration(duration)}")
+    def _prepare(item):
+        """预处理线程：领取文件，命中缓存则直接返回结果，否则转码并切分
         
+        租约在这里领取，保证其他 worker 不会同时切分同一个文件；
+        预处理失败时释放租约，成功时由上传线程处理完后释放。
+        """
+        f = item['file']
+        if not leases.acquire(f['name']):
+            raise FileClaimed("其他 worker 正在处理")
         try:
-            result_text, raw_data = process_single_file(file_path, temp_dir, secret_id, secret_key, region)
-            save_outputs(output_dir, file_path, result_text, raw_data)
-            
-            progress["completed"].append(file_path.name)
-            processed_duration += duration
-            save_progress(progress_file, progress)
-            
-            results.append((file_path.name, "✅ 成功"))
-            print_success("转写完成")
-            
-        except Exception as e:
-            print_error(f"✗ 失败: {e}")
-            progress["failed"].append(file_path.name)
-            save_progress(progress_file, progress)
-            results.append((file_path.name, f"❌ 失败: {e}"))
+            # 领取前可能已被其他 worker 处理完
+            if f['name'] not in completed_before and store.status_of(f['name']) == "completed":
+                raise FileClaimed("已由其他 worker 完成")
+            with metrics.context(file=f['name']):
+                if cache and f['content_hash']:
+                    cached = cache.get(result_cache_key(f['content_hash']))
+                    if cached:
+                        return {'cached': cached}
+                audio_path = None
+                if transcode:
+                    with metrics.stage("transcode", format=transcode, bytes=f['path'].stat().st_size) as info:
+                        audio_path = transcode_audio(f['path'], Path(temp_dir) / "transcoded", transcode, f['duration'])
+                        info['out_bytes'] = audio_path.stat().st_size
+                # 跨天拆分的文件仍需切分，才能在片段边界处停下
+                segments = prepare_segments(f['path'], temp_dir, f['duration'], store, trim_silence, audio_path,
+                                            whole_file=source is not None and not item['partial'])
+                return {'audio_path': audio_path, 'segments': segments}
+        except BaseException:
+            leases.release(f['name'])
+            raise
+    
+    def _disk_estimate(item):
+        """预处理会产生的临时文件大小（转码或切分时约等于原文件大小）"""
+        f = item['file']
+        split = f['size_mb'] > MAX_FILE_SIZE_MB and (source is None or item['partial'])
+        if transcode or trim_silence or split:
+            return f['size_mb'] * 1024 * 1024
+        return 0
+    
+    def _worker(idx, item):
+        """处理一个已预处理的文件，结果来自缓存时返回 True
         
-        print("-" * 70)
+        完成和部分完成状态在释放租约前写入进度库，其他 worker 随后领取时能看到。
+        """
+        f = item['file']
+        try:
+            prepared = pipeline.get(item)
+        except BaseException:
+            pipeline.release(item)
+            raise
+        try:
+            with metrics.context(file=f['name']), metrics.stage("file", audio_seconds=item['seconds']) as info:
+                try:
+                    from_cache = _process(idx, item, prepared)
+                except SegmentsDeferred:
+                    store.mark_partial(f['name'])
+                    info.update(ok=True, deferred=True)
+                    raise
+                store.mark_completed(f['name'], f['duration'], f['content_hash'])
+                info['cached'] = from_cache
+                return from_cache
+        finally:
+            leases.release(f['name'])
+            pipeline.release(item)
+    
+    def _process(idx, item, prepared):
+        f = item['file']
+        file_path = f['path']
+        if 'cached' in prepared:
+            print_info(f"{file_path.name} 内容与已转写文件相同，直接使用缓存结果")
+            save_outputs(output_dir, file_path, *prepared['cached'], formats=formats)
+            return True
+        # 跨天切分的文件今天只转写计划内的时长
+        max_seconds = item['seconds'] if item['partial'] else None
+        audio_path = prepared['audio_path']
+        account = pool.acquire(store, item['seconds'], prefer=store.segment_account(f['name']))
+        poller = get_poller(account)
+        note = f"，账号 {account['name']}" if len(pool.accounts) > 1 else ""
+        print_step(f"[{idx}/{len(batch_files)}] 开始处理: {file_path.name}（时长 {format_duration(f['duration'])}{note}）")
+        try:
+            sentences, raw_data = process_single_file(file_path, temp_dir, account['secret_id'], account['secret_key'],
+                                                        account['region'], duration=f['duration'],
+                                                        poller=poller, store=store,
+                                                        max_seconds=max_seconds, audio_path=audio_path,
+                                                        account=account['name'], segments=prepared['segments'],
+                                                        callback_url=poller.callback_url, source=source, pool=pool,
+                                                        leases=leases)
+        except MissingSegmentsError as e:
+            # 保留已完成片段的结果（缺失处有标记），文件仍记为失败以便重试
+            save_outputs(output_dir, file_path, e.sentences, e.raw_data_list, formats)
+            raise
+        finally:
+            pool.release(account, item['seconds'])
+        save_outputs(output_dir, file_path, sentences, raw_data, formats)
+        if cache and f['content_hash']:
+            cache.put(result_cache_key(f['content_hash']), sentences, raw_data)
+        if audio_path:
+            audio_path.unlink()
+        return False
+    
+    # 每个账号的在途 TaskId 由同一个轮询器按时长调度查询，工作线程只负责上传和等待；
+    # 回调模式下结果由 receiver 推送给轮询器
+    receiver = None
+    if callback_url:
+        receiver = CallbackReceiver(callback_url, callback_listen)
+        print_info(f"回调模式: 在 {callback_listen} 接收识别结果，回调地址 {callback_url}")
+    source = None
+    if url_source:
+        try:
+            source = open_audio_source(url_source, url_listen, s3_endpoint)
+        except RuntimeError as e:
+            print_error(str(e))
+            if receiver:
+                receiver.close()
+            metrics.close()
+            return
+        print_info(f"URL 上传模式: 音频以限时链接提交（{url_source}）")
+    pollers = {}
+    pollers_lock = threading.Lock()
+    
+    def get_poller(account):
+        with pollers_lock:
+            if account['name'] not in pollers:
+                client = get_client(account['secret_id'], account['secret_key'], account['region'])
+                pollers[account['name']] = TaskPoller(client, callbacks=receiver)
+            return pollers[account['name']]
+    
+    leases = LeaseManager(output_dir / LEASE_DIR_NAME)
+    completed_before = set(progress['completed'])
+    # 预处理（转码、切分）在独立的线程池里按顺序提前进行，受提前量和磁盘预算限制
+    pipeline = PrepPipeline(batch_items, _prepare, limit=workers + lookahead,
+                            disk_budget=disk_budget_mb * 1024 * 1024, estimate=_disk_estimate)
+    
+    # 线程池同时保持多个文件在途：前面的任务仍在服务端处理时，后面的文件已经开始上传；
+    # 每个文件完成时立即写入进度库
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_worker, idx, item): item
+            for idx, item in enumerate(batch_items, 1)
+        }
+        for future in as_completed(futures):
+            item = futures[future]
+            f = item['file']
+            name = f['path'].name
+            try:
+                from_cache = future.result()
+            except FileClaimed as e:
+                results.append((name, f"⏭ 跳过: {e}"))
+                print_info(f"{name} 跳过: {e}")
+            except SegmentsDeferred as e:
+                processed_duration += e.done_seconds
+                results.append((name, f"⏸ 部分完成，剩余 {format_duration(e.remaining_seconds)} 留待下一天"))
+                print_info(f"{name} 今日计划部分已完成，剩余 {format_duration(e.remaining_seconds)} 留待下一天")
+            except QuotaExhausted as e:
+                store.mark_deferred(name, e, f['content_hash'])
+                results.append((name, "⏳ 额度用完，额度重置后重试"))
+                print_warning(f"{name} 未提交: {e}")
+            except Exception as e:
+                print_error(f"✗ {name} 失败: {e}")
+                store.mark_failed(name, e, f['content_hash'])
+                results.append((name, f"❌ 失败: {e}"))
+            else:
+                if from_cache:
+                    results.append((name, "✅ 成功（缓存）"))
+                else:
+                    processed_duration += f['duration']
+                    results.append((name, "✅ 成功"))
+                print_success(f"{name} 转写完成 ({len(results)}/{len(batch_files)})")
+    
+    pipeline.close()
+    leases.close()
+    for poller in pollers.values():
+        poller.close()
+    if receiver:
+        receiver.close()
+    if source:
+        source.close()
+        print_info(f"通过链接提供音频: {source.bytes_served / 1024 / 1024:.1f} MB")
+    for name, poller in pollers.items():
+        prefix = f"[{name}] " if len(pollers) > 1 else ""
+        callbacks = f"，收到回调: {poller.callback_count} 次" if receiver else ""
+        print_info(f"{prefix}状态查询请求: {poller.request_count} 次{callbacks}，API 重试: {poller.client.retry_count} 次")
+    for action, st in get_rate_limiter().stats().items():
+        if st['waited'] or st['throttled']:
+            print_info(f"限速 {action}: 等待 {st['waited']:.1f} 秒，被限频 {st['throttled']} 次，当前 {st['rate']:.1f} 次/秒")
     
     print()
     print("=" * 70)
@@ -559,13 +3587,189 @@ def run_day(day_num, input_dir, output_dir, temp_dir, progress_file, secret_id,
     print("=" * 70)
     
     success_count = sum(1 for _, s in results if s.startswith("✅"))
-    fail_count = len(results) - success_count
+    partial_count = sum(1 for _, s in results if s.startswith("⏸"))
+    skipped_count = sum(1 for _, s in results if s.startswith("⏭"))
+    deferred_count = sum(1 for _, s in results if s.startswith("⏳"))
+    fail_count = len(results) - success_count - partial_count - skipped_count - deferred_count
     
     print(f"成功: {success_count} 个")
+    if partial_count:
+        print(f"部分完成: {partial_count} 个")
+    if skipped_count:
+        print(f"由其他 worker 处理: {skipped_count} 个")
+    if deferred_count:
+        print(f"额度用完、留待重置后: {deferred_count} 个")
     print(f"失败: {fail_count} 个")
     print(f"处理时长: {format_duration(processed_duration)}")
     print(f"结果保存在: {output_dir}")
     print("=" * 70)
+    
+    metrics.emit("run", seconds=round(time.time() - run_start, 3), day=day_num, workers=workers,
+                 files=len(results), succeeded=success_count, failed=fail_count, partial=partial_count,
+                 skipped=skipped_count, deferred=deferred_count, audio_seconds=processed_duration,
+                 billed_seconds=store.usage_on(beijing_today()), stages=metrics.summary())
+    if metrics_file:
+        metrics.write_prometheus(metrics_file)
+    metrics.close()
+
+def settled_state(input_dir, settle_seconds):
+    """输入目录中已写完文件的 (文件名, 大小, 修改时间) 集合，只用 stat，不读文件"""
+    settled_before = time.time() - settle_seconds
+    state = set()
+    with os.scandir(input_dir) as it:
+        for entry in it:
+            if Path(entry.name).suffix.lower() in SUPPORTED and entry.is_file():
+                st = entry.stat()
+                if st.st_mtime <= settled_before:
+                    state.add((entry.name, st.st_size, st.st_mtime_ns))
+    return frozenset(state)
+
+def watch(input_dir, output_dir, temp_dir, progress_file, secret_id, secret_key, region,
+          interval=WATCH_INTERVAL, settle_seconds=WATCH_SETTLE, pool=None, **run_options):
+    """守护模式：持续监视输入目录，新文件写完后在免费额度内自动转写
+    
+    每隔 interval 秒用 stat 比较一次目录，已写完的文件有变化时执行一轮
+    转写（相当于 --day 1 --yes）；今日额度用完后休眠到北京时间零点再继续。
+    """
+    print_step(f"守护模式：监视 {input_dir}（每 {interval} 秒检查一次，文件 {settle_seconds} 秒未修改视为已写完）")
+    pool = pool or CredentialPool.single(secret_id, secret_key, region)
+    store = ProgressStore(progress_file)
+    handled_state = None
+    handled_day = None
+    try:
+        while True:
+            today = beijing_today()
+            if pool.remaining_total(store, today) <= 0:
+                wait = seconds_until_reset() + WATCH_RESET_MARGIN
+                print_info(f"今日额度已用完，{format_duration(wait)} 后（北京时间零点）自动继续")
+                time.sleep(wait)
+                continue
+            
+            state = settled_state(input_dir, settle_seconds)
+            # 新文件写完或日期变化（额度重置、失败/跨天文件需要重试）时才执行一轮
+            if state != handled_state or today != handled_day:
+                try:
+                    run_day(1, input_dir, output_dir, temp_dir, progress_file, secret_id, secret_key, region,
+                            auto_confirm=True, settle_seconds=settle_seconds, pool=pool, **run_options)
+                except Exception as e:
+                    print_error(f"本轮转写出错，{interval} 秒后重试: {e}")
+                else:
+                    handled_state = state
+                    handled_day = today
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print()
+        print_info("守护模式已停止")
+
+# === 库接口 ===
+class TranscriptionResult:
+    """transcribe_many 产出的单个文件结果
+    
+    sentences 为 Sentence 列表，raw 为各片段的原始 Data；转写失败时 error
+    为异常，sentences 和 raw 为空。cached 表示结果来自 ResultCache。
+    """
+    __slots__ = ('path', 'duration', 'sentences', 'raw', 'error', 'cached')
+    
+    def __init__(self, path, duration=0, sentences=(), raw=(), error=None, cached=False):
+        self.path = path
+        self.duration = duration
+        self.sentences = sentences
+        self.raw = raw
+        self.error = error
+        self.cached = cached
+    
+    @property
+    def ok(self):
+        return self.error is None
+    
+    @property
+    def text(self):
+        """与 .txt 结果正文相同格式的文本"""
+        return "".join(_txt_entry(i, s) for i, s in enumerate(self.sentences, 1))
+    
+    def save(self, output_dir, formats=OUTPUT_FORMATS):
+        """按 formats 写出结果文件，返回文件列表"""
+        return save_outputs(output_dir, self.path, self.sentences, self.raw, formats)
+
+def transcribe_many(paths, secret_id=None, secret_key=None, region=None, workers=MAX_WORKERS, temp_dir=None,
+                    on_progress=None, cache=None, transcode=None, trim_silence=False,
+                    callback_url=None, callback_listen=CALLBACK_LISTEN,
+                    url_source=None, url_listen=URL_LISTEN, s3_endpoint=None, quiet=True):
+    """在当前进程内转写一组音频文件，按完成顺序逐个产出 TranscriptionResult
+    
+    供其他程序嵌入调用：不读写进度库、不按免费额度分天规划，也不会询问确认，
+    额度由调用方自行掌握。密钥默认取环境变量 TENCENT_SECRET_ID / TENCENT_SECRET_KEY。
+    这是一个生成器，开始迭代后才提交文件；单个文件失败不会中断迭代，结果的
+    error 字段记录异常。每个文件完成后调用 on_progress(已完成数, 总数, result)。
+    提前停止迭代时未开始的文件被取消，已开始的文件会处理完。
+    temp_dir 默认使用临时目录并在结束时删除；cache 为 ResultCache；
+    quiet 为 True（默认）时不向终端打印进度，这些信息改为记录到名为
+    tencent_asr_batch 的 logger（迭代期间对本进程的所有 print_* 生效）。
+    其余参数含义同 run_day。
+    """
+    env_id, env_key, env_region = get_config()
+    secret_id = secret_id or env_id
+    secret_key = secret_key or env_key
+    region = region or env_region
+    if not secret_id or not secret_key:
+        raise ValueError("缺少腾讯云密钥：请传入 secret_id/secret_key 或设置环境变量 TENCENT_SECRET_ID/TENCENT_SECRET_KEY")
+    paths = [Path(p) for p in paths]
+    if not paths:
+        return
+    # 库调用默认不向终端打印，进度信息改走 logging
+    with quiet_console() if quiet else nullcontext():
+        own_temp = temp_dir is None
+        temp_dir = Path(tempfile.mkdtemp(prefix="tencent-asr-")) if own_temp else Path(temp_dir)
+        receiver = CallbackReceiver(callback_url, callback_listen) if callback_url else None
+        source = open_audio_source(url_source, url_listen, s3_endpoint) if url_source else None
+        poller = TaskPoller(get_client(secret_id, secret_key, region), callbacks=receiver)
+        
+        def transcribe(index, path):
+            duration = 0
+            try:
+                duration = get_audio_duration(path)
+                content_hash = audio_fingerprint(path) if cache else None
+                if content_hash:
+                    cached = cache.get(result_cache_key(content_hash))
+                    if cached:
+                        return TranscriptionResult(path, duration, *cached, cached=True)
+                # 每个文件单独的临时目录，不同目录下的同名文件互不影响
+                file_temp = temp_dir / str(index)
+                audio_path = None
+                if transcode:
+                    audio_path = transcode_audio(path, file_temp / "transcoded", transcode, duration)
+                segments = prepare_segments(path, file_temp, duration, trim_silence=trim_silence,
+                                            audio_path=audio_path, whole_file=source is not None)
+                sentences, raw = process_single_file(path, file_temp, secret_id, secret_key, region,
+                                                     duration=duration, poller=poller, trim_silence=trim_silence,
+                                                     audio_path=audio_path, segments=segments,
+                                                     callback_url=poller.callback_url, source=source)
+                shutil.rmtree(file_temp, ignore_errors=True)
+                if content_hash:
+                    cache.put(result_cache_key(content_hash), sentences, raw)
+                return TranscriptionResult(path, duration, sentences, raw)
+            except Exception as e:
+                return TranscriptionResult(path, duration, error=e)
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(paths))))
+        futures = [executor.submit(transcribe, index, path) for index, path in enumerate(paths)]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                if on_progress:
+                    on_progress(done, len(paths), result)
+                yield result
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+            poller.close()
+            if receiver:
+                receiver.close()
+            if source:
+                source.close()
+            if own_temp:
+                shutil.rmtree(temp_dir, ignore_errors=True)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -585,22 +3789,65 @@ def main():
   
   # 第2天转写
   python3 tencent_asr_batch.py --input ./audio --output ./transcripts --day 2
+  
+  # 守护模式：持续转写新放入的录音
+  python3 tencent_asr_batch.py --input ./audio --output ./transcripts --watch
         """
     )
     parser.add_argument('--input', '-i', help='音频文件输入目录')
     parser.add_argument('--output', '-o', help='转写结果输出目录')
-    parser.add_argument('--day', type=int, choices=[1, 2], help='运行第几天的任务（利用免费额度分批）')
+    parser.add_argument('--day', type=int, help='运行第几天的任务（利用免费额度分批，今天为第1天）')
+    parser.add_argument('--plan-file', help='优先级/截止日期规则（JSON），影响分批顺序')
+    parser.add_argument('--trim-silence', action='store_true', help='在静音处切分并去掉长静音，减少计费时长')
+    parser.add_argument('--transcode', choices=sorted(TRANSCODE_FORMATS), help='上传前转码为 16kHz 单声道紧凑格式')
+    parser.add_argument('--cache-dir', help=f'结果缓存目录（默认为输出目录下的 {CACHE_DIR_NAME}）')
+    parser.add_argument('--cache-max-mb', type=int, default=CACHE_MAX_MB, help=f'结果缓存大小上限（默认 {CACHE_MAX_MB} MB）')
+    parser.add_argument('--no-cache', action='store_true', help='不使用结果缓存')
+    parser.add_argument('--watch', action='store_true', help='守护模式：持续监视输入目录，在每日免费额度内自动转写新文件')
+    parser.add_argument('--watch-interval', type=float, default=WATCH_INTERVAL, help=f'守护模式检查目录的间隔秒数（默认 {WATCH_INTERVAL}）')
+    parser.add_argument('--settle', type=float, default=WATCH_SETTLE, help=f'文件多少秒未修改视为已写完（默认 {WATCH_SETTLE}）')
+    parser.add_argument('--paid-hours', type=float, default=PAID_HOURS_PER_DAY,
+                        help='每天允许超出免费额度的付费时长（小时，默认 0：只用免费额度）')
+    parser.add_argument('--credentials', help='凭据池文件（JSON），多个账号的免费额度分别统计，按剩余额度分配文件')
+    parser.add_argument('--lookahead', type=int, default=PREP_LOOKAHEAD,
+                        help=f'除正在上传的文件外，最多提前转码/切分的文件数（默认 {PREP_LOOKAHEAD}）')
+    parser.add_argument('--disk-budget-mb', type=int, default=PREP_DISK_BUDGET_MB,
+                        help=f'提前准备的临时文件总大小上限（默认 {PREP_DISK_BUDGET_MB} MB）')
+    parser.add_argument('--callback-url', help='回调模式：腾讯云可访问到的公网地址（转发到 --callback-listen），识别结果由服务端推送')
+    parser.add_argument('--callback-listen', default=CALLBACK_LISTEN, help=f'本地接收回调的监听地址（默认 {CALLBACK_LISTEN}）')
+    parser.add_argument('--url-source', help='URL 上传模式：内置文件服务的公网地址（转发到 --url-listen），或 s3://bucket/prefix')
+    parser.add_argument('--url-listen', default=URL_LISTEN, help=f'内置文件服务的监听地址（默认 {URL_LISTEN}）')
+    parser.add_argument('--s3-endpoint', help='S3 兼容存储（如 MinIO）的地址，默认使用 AWS')
+    parser.add_argument('--formats', default=",".join(OUTPUT_FORMATS),
+                        help='结果格式，逗号分隔：txt、srt、vtt、jsonl（默认 txt；原始 JSON 总会保存）')
+    parser.add_argument('--metrics-file', help='运行结束时写出 Prometheus 文本格式的指标文件')
     parser.add_argument('--status', action='store_true', help='查看当前状态')
     parser.add_argument('--reset', action='store_true', help='重置进度')
     parser.add_argument('--yes', '-y', action='store_true', help='跳过确认直接执行')
+    parser.add_argument('--workers', '-j', type=int, default=MAX_WORKERS, help=f'同时处理的文件数（默认 {MAX_WORKERS}）')
+    parser.add_argument('--qps-create', type=float, default=ACTION_QPS["CreateRecTask"],
+                        help=f'CreateRecTask 每秒请求上限（默认 {ACTION_QPS["CreateRecTask"]}，0 表示不限）')
+    parser.add_argument('--qps-describe', type=float, default=ACTION_QPS["DescribeTaskStatus"],
+                        help=f'DescribeTaskStatus 每秒请求上限（默认 {ACTION_QPS["DescribeTaskStatus"]}，0 表示不限）')
     
     args = parser.parse_args()
+    if args.day is not None and args.day < 1:
+        parser.error("--day 必须是正整数")
+    if args.watch and args.day:
+        parser.error("--watch 不能与 --day 同时使用")
+    
+    try:
+        load_requests()
+    except ImportError:
+        print("正在安装 requests...")
+        os.system(f"{sys.executable} -m pip install requests -q")
+        load_requests()
     
     # 检查环境变量（仅在需要时）
     global SECRET_ID, SECRET_KEY, REGION
     if args.input or args.output or args.day or args.status or args.reset:
         SECRET_ID, SECRET_KEY, REGION = get_config()
-        if not SECRET_ID or not SECRET_KEY:
+        if not args.credentials and (not SECRET_ID or not SECRET_KEY):
             print_error("❌ 错误: 请设置环境变量 TENCENT_SECRET_ID 和 TENCENT_SECRET_KEY")
             print("   方法1: export TENCENT_SECRET_ID='your_id'")
             print("   方法2: 创建 .env 文件（需要 python-dotenv）")
@@ -624,23 +3871,53 @@ def main():
     input_dir = Path(args.input).resolve()
     output_dir = Path(args.output).resolve()
     temp_dir = output_dir / "temp_segments"
-    progress_file = output_dir / "progress.json"
+    progress_file = output_dir / PROGRESS_DB_NAME
     
     if not input_dir.exists():
         print_error(f"输入目录不存在: {input_dir}")
         sys.exit(1)
     
     if args.reset:
-        if progress_file.exists():
-            progress_file.unlink()
+        ProgressStore(progress_file).reset()
         print_success("进度已重置")
         return
     
-    if args.status or (not args.day):
-        show_status(input_dir, output_dir, progress_file)
+    if args.credentials:
+        pool = CredentialPool(load_credentials(args.credentials, REGION, args.paid_hours))
+    else:
+        pool = CredentialPool.single(SECRET_ID, SECRET_KEY, REGION, args.paid_hours)
+    
+    if args.status or (not args.day and not args.watch):
+        show_status(input_dir, output_dir, progress_file, plan_file=args.plan_file, pool=pool)
+        return
+    
+    formats = tuple(dict.fromkeys(fmt.strip().lower() for fmt in args.formats.split(",") if fmt.strip()))
+    unknown = [fmt for fmt in formats if fmt not in TRANSCRIPT_WRITERS]
+    if unknown or not formats:
+        print_error(f"不支持的结果格式: {', '.join(unknown) or args.formats}（可选 {', '.join(TRANSCRIPT_WRITERS)}）")
+        sys.exit(1)
+    
+    cache = None
+    if not args.no_cache:
+        cache = ResultCache(args.cache_dir or output_dir / CACHE_DIR_NAME, args.cache_max_mb * 1024 * 1024)
+    
+    limiter = get_rate_limiter()
+    limiter.set_rate("CreateRecTask", args.qps_create)
+    limiter.set_rate("DescribeTaskStatus", args.qps_describe)
+    
+    run_options = dict(workers=args.workers, plan_file=args.plan_file, trim_silence=args.trim_silence,
+                       transcode=args.transcode, cache=cache, pool=pool, metrics_file=args.metrics_file,
+                       lookahead=args.lookahead, disk_budget_mb=args.disk_budget_mb,
+                       callback_url=args.callback_url, callback_listen=args.callback_listen,
+                       url_source=args.url_source, url_listen=args.url_listen, s3_endpoint=args.s3_endpoint,
+                       formats=formats)
+    if args.watch:
+        watch(input_dir, output_dir, temp_dir, progress_file, SECRET_ID, SECRET_KEY, REGION,
+              interval=args.watch_interval, settle_seconds=args.settle, **run_options)
         return
     
-    run_day(args.day, input_dir, output_dir, temp_dir, progress_file, SECRET_ID, SECRET_KEY, REGION, auto_confirm=args.yes)
+    run_day(args.day, input_dir, output_dir, temp_dir, progress_file, SECRET_ID, SECRET_KEY, REGION,
+            auto_confirm=args.yes, **run_options)
 
 if __name__ == "__main__":
     main()
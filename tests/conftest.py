@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""测试公共夹具：在进程内启动 benchmarks/mock_asr_server.py 的模拟服务"""
+
+import struct
+import sys
+import wave
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import tencent_asr_batch as asr  # noqa: E402
+from mock_asr_server import MockAsrServer, MockAsrService  # noqa: E402
+
+SECRET_ID = "mock-id"
+SECRET_KEY = "mock-key"
+REGION = "ap-shanghai"
+
+def make_wav(path, seconds, sample_rate=8000):
+    """生成指定时长的 16 位单声道 WAV（静音），不依赖 ffmpeg"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(struct.pack("<h", 0) * int(seconds * sample_rate))
+    return path
+
+@pytest.fixture
+def mock_service():
+    """识别很快完成的模拟服务配置；测试可在启动前修改其属性"""
+    return MockAsrService(rtf=0.0, min_processing=0.05, seed=1)
+
+@pytest.fixture
+def mock_server(mock_service, monkeypatch):
+    """启动模拟服务并让被测代码的请求都发往它，同时缩短轮询和重试等待"""
+    with MockAsrServer(mock_service) as server:
+        monkeypatch.setattr(asr, "API_ENDPOINT", server.url)
+        # 客户端按密钥缓存并记住了地址，每个测试重新创建
+        monkeypatch.setattr(asr, "_clients", {})
+        monkeypatch.setattr(asr, "POLL_FIRST_DELAY", 0.05)
+        monkeypatch.setattr(asr, "POLL_RTF", 0.0)
+        monkeypatch.setattr(asr, "RETRY_BASE_DELAY", 0.01)
+        yield server
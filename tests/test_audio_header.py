@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""纯 Python 音频头解析（read_audio_header）"""
+
+import shutil
+import subprocess
+
+import pytest
+
+from conftest import asr, make_wav
+
+# MPEG-1 Layer III，128 kbps，44.1 kHz，无 CRC：每帧 417 字节、1152 个采样
+MP3_HEADER = b"\xff\xfb\x90\x00"
+MP3_FRAME_LEN = 417
+MP3_FRAME_SECONDS = 1152 / 44100
+
+def mp3_frames(count, first_frame=None):
+    frames = [first_frame] if first_frame else []
+    frames += [MP3_HEADER + b"\x00" * (MP3_FRAME_LEN - 4)] * (count - len(frames))
+    return b"".join(frames)
+
+def test_wav_duration(tmp_path):
+    path = make_wav(tmp_path / "a.wav", 12.5, sample_rate=16000)
+    info = asr.read_audio_header(path)
+    assert info['duration'] == pytest.approx(12.5)
+    assert info['codec'] == "pcm_s16le"
+    assert info['bitrate'] == 16000 * 16
+
+def test_wav_with_unpatched_data_size(tmp_path):
+    # 流式写入时 data 长度可能仍是 0，应按文件实际大小计算
+    path = make_wav(tmp_path / "a.wav", 3, sample_rate=8000)
+    raw = bytearray(path.read_bytes())
+    pos = raw.index(b"data")
+    raw[pos + 4:pos + 8] = b"\x00\x00\x00\x00"
+    path.write_bytes(bytes(raw))
+    assert asr.read_audio_header(path)['duration'] == pytest.approx(3)
+
+def test_mp3_cbr_with_id3(tmp_path):
+    id3 = b"ID3\x04\x00\x00\x00\x00\x00\x20" + b"\x00" * 32
+    path = tmp_path / "a.mp3"
+    path.write_bytes(id3 + mp3_frames(100))
+    info = asr.read_audio_header(path)
+    assert info['codec'] == "mp3"
+    assert info['duration'] == pytest.approx(100 * MP3_FRAME_SECONDS, rel=0.01)
+
+def test_mp3_xing_frame_count(tmp_path):
+    # 立体声 MPEG-1 的 side info 为 32 字节，Xing 头紧随其后
+    xing = b"Xing" + (1).to_bytes(4, "big") + (500).to_bytes(4, "big")
+    first = MP3_HEADER + b"\x00" * 32 + xing
+    first += b"\x00" * (MP3_FRAME_LEN - len(first))
+    path = tmp_path / "a.mp3"
+    path.write_bytes(mp3_frames(10, first))
+    assert asr.read_audio_header(path)['duration'] == pytest.approx(500 * MP3_FRAME_SECONDS)
+
+@pytest.mark.parametrize("name,data", [
+    ("a.wav", b"RIFF\x00\x00\x00\x00WAVEjunk"),
+    ("a.mp3", b"\x00" * 4096),
+    ("a.flac", b"fLaC" + b"\x00" * 10),
+    ("a.m4a", b"\x00\x00\x00\x08free"),
+    ("a.ogg", b"OggS" + b"\x00" * 10),
+    ("a.txt", b"hello"),
+])
+def test_unparseable_returns_none(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    assert asr.read_audio_header(path) is None
+
+@pytest.mark.skipif(not shutil.which(asr.tool_path("ffmpeg")), reason="需要 ffmpeg")
+@pytest.mark.parametrize("ext,args", [
+    ("mp3", ["-c:a", "libmp3lame", "-b:a", "64k"]),
+    ("flac", ["-c:a", "flac"]),
+    ("m4a", ["-c:a", "aac", "-b:a", "64k"]),
+    ("ogg", ["-c:a", "libopus", "-b:a", "32k"]),
+])
+def test_encoded_files(tmp_path, ext, args):
+    # 编码器的前后填充最多几十毫秒
+    path = tmp_path / f"a.{ext}"
+    result = subprocess.run([asr.tool_path("ffmpeg"), "-v", "error", "-f", "lavfi",
+                             "-i", "sine=frequency=440:duration=7.3:sample_rate=16000", *args, str(path)])
+    if result.returncode != 0:
+        pytest.skip(f"ffmpeg 不支持 {args[1]}")
+    assert asr.read_audio_header(path)['duration'] == pytest.approx(7.3, abs=0.1)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""对模拟服务运行的关键流程：上传、断点续传、额度、租约、回调和整天批处理"""
+
+import json
+import math
+import shutil
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import asr, make_wav, SECRET_ID, SECRET_KEY, REGION
+from mock_asr_server import AUDIO_KBPS, SENTENCE_SECONDS, MockAsrService
+
+def mock_seconds(path):
+    """模拟服务按字节数估算的计费时长"""
+    return path.stat().st_size * 8 / (AUDIO_KBPS * 1000)
+
+def transcribe(path, tmp_path, **kwargs):
+    return asr.process_single_file(path, tmp_path / "tmp", SECRET_ID, SECRET_KEY, REGION, **kwargs)
+
+def test_direct_upload(tmp_path, mock_server):
+    path = make_wav(tmp_path / "a.wav", 2)
+    sentences, raw = transcribe(path, tmp_path, duration=2)
+    assert len(raw) == 1
+    assert raw[0]["AudioDuration"] == pytest.approx(mock_seconds(path), abs=0.001)
+    assert len(sentences) == math.ceil(mock_seconds(path) / SENTENCE_SECONDS)
+    assert mock_server.service.snapshot()["auth_failures"] == 0
+
+def test_segment_checkpoint_resume(tmp_path, mock_server):
+    # 断点：片段 0 已有结果，片段 1 已提交任务，片段 2 尚未提交
+    path = make_wav(tmp_path / "long.wav", 30)
+    seg_dir = asr.segment_dir(tmp_path / "tmp", path)
+    segs = [make_wav(seg_dir / f"long_part{i:03d}.wav", 1) for i in range(3)]
+    st = path.stat()
+    store = asr.ProgressStore(tmp_path / "progress.db")
+    store.save_segments(path.name, f"{st.st_size}:{st.st_mtime_ns}", [
+        {'index': i, 'path': seg, 'start_time': i * 10, 'duration': 10} for i, seg in enumerate(segs)
+    ])
+    done = {"TaskId": 1, "Status": 2, "AudioDuration": 10, "Result": "",
+            **MockAsrService.fake_result(1, SENTENCE_SECONDS)}
+    store.set_segment_result(path.name, 0, done)
+    task_id = asr.create_task(segs[1], SECRET_ID, SECRET_KEY, REGION)
+    store.set_segment_task(path.name, 1, task_id)
+
+    sentences, raw = transcribe(path, tmp_path, duration=30, store=store)
+
+    stats = mock_server.service.snapshot()
+    assert stats["tasks_created"] == 2
+    assert stats["requests"]["CreateRecTask"] == 2
+    assert [d["TaskId"] for d in raw] == [1, task_id, task_id + 1]
+    # 句子时间加上了片段在原文件中的偏移
+    assert [s.start_ms for s in sentences if s.text.startswith(f"任务{task_id}第1句")] == [10000]
+    assert store.load_segments(path.name, f"{st.st_size}:{st.st_mtime_ns}") == []
+    assert not seg_dir.exists()
+
+def test_create_task_not_retried_after_internal_error(tmp_path, mock_server):
+    # InternalError 时任务可能已经建好，重试会重复计费
+    mock_server.service.fail_rate = 1.0
+    path = make_wav(tmp_path / "a.wav", 1)
+    with pytest.raises(asr.TencentApiError) as e:
+        asr.create_task(path, SECRET_ID, SECRET_KEY, REGION)
+    assert e.value.code == "InternalError"
+    assert mock_server.service.snapshot()["requests"]["CreateRecTask"] == 1
+
+def test_create_task_not_retried_after_connection_dropped(tmp_path, monkeypatch):
+    # 服务端收到请求后断开连接：任务可能已经建好，只有连接前的失败才能重试
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    listener.settimeout(0.05)
+    accepted = []
+    stop = threading.Event()
+
+    def drop():
+        while not stop.is_set():
+            try:
+                conn, _ = listener.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                accepted.append(conn.recv(65536))
+
+    thread = threading.Thread(target=drop, daemon=True)
+    thread.start()
+    monkeypatch.setattr(asr, "_clients", {})
+    monkeypatch.setattr(asr, "RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(asr, "API_ENDPOINT", f"http://127.0.0.1:{listener.getsockname()[1]}")
+    path = make_wav(tmp_path / "a.wav", 1)
+    try:
+        with pytest.raises(asr.load_requests().ConnectionError):
+            asr.create_task(path, SECRET_ID, SECRET_KEY, REGION)
+    finally:
+        stop.set()
+        thread.join()
+        listener.close()
+    assert len(accepted) == 1
+
+def test_describe_retried_after_internal_error(mock_server):
+    task_id = asr.get_client(SECRET_ID, SECRET_KEY, REGION).call(
+        "CreateRecTask", {"SourceType": 1, "Data": "AAAA", "DataLen": 3})["Data"]["TaskId"]
+    mock_server.service.fail_rate = 1.0
+    with pytest.raises(asr.TencentApiError):
+        asr.describe_task(task_id, SECRET_ID, SECRET_KEY, REGION)
+    assert mock_server.service.snapshot()["requests"]["DescribeTaskStatus"] == asr.API_RETRIES + 1
+
+def test_poller_does_not_retry_inside_client(mock_server):
+    # 轮询线程上的查询失败直接按轮询间隔重排，不在客户端里退避
+    client = asr.get_client(SECRET_ID, SECRET_KEY, REGION)
+    task_id = client.call("CreateRecTask", {"SourceType": 1, "Data": "AAAA", "DataLen": 3})["Data"]["TaskId"]
+    mock_server.service.fail_rate = 1.0
+    poller = asr.TaskPoller(client)
+    try:
+        future = poller.submit(task_id)
+        deadline = time.time() + 5
+        while poller.request_count < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        mock_server.service.fail_rate = 0.0
+        assert future.result(timeout=10)["Status"] == 2
+    finally:
+        poller.close()
+    assert mock_server.service.snapshot()["requests"]["DescribeTaskStatus"] == poller.request_count
+
+def test_server_quota_error_marks_account_exhausted(tmp_path, mock_server):
+    mock_server.service.quota_seconds = 1
+    path = make_wav(tmp_path / "a.wav", 2)
+    store = asr.ProgressStore(tmp_path / "progress.db")
+    pool = asr.CredentialPool.single(SECRET_ID, SECRET_KEY, REGION)
+    with pytest.raises(asr.QuotaExhausted):
+        transcribe(path, tmp_path, duration=2, store=store, pool=pool, account=SECRET_ID)
+    assert store.is_exhausted(SECRET_ID, asr.beijing_today())
+    assert pool.remaining(store, SECRET_ID) == 0
+    assert pool._inflight[SECRET_ID] == 0
+
+def test_ledger_gate_blocks_submission(tmp_path, mock_server):
+    path = make_wav(tmp_path / "a.wav", 2)
+    store = asr.ProgressStore(tmp_path / "progress.db")
+    pool = asr.CredentialPool([{'name': "a", 'secret_id': SECRET_ID, 'secret_key': SECRET_KEY, 'region': REGION,
+                                'free_hours': 1 / 3600}])
+    with pytest.raises(asr.QuotaExhausted):
+        transcribe(path, tmp_path, duration=2, store=store, pool=pool, account="a")
+    assert mock_server.service.snapshot()["tasks_created"] == 0
+
+def test_publish_failure_releases_reservation(tmp_path, mock_server):
+    class BrokenSource:
+        def publish(self, path):
+            raise OSError("上传失败")
+
+        def unpublish(self, url):
+            raise AssertionError("没有发布成功的链接不应撤销")
+
+    path = make_wav(tmp_path / "a.wav", 1)
+    pool = asr.CredentialPool.single(SECRET_ID, SECRET_KEY, REGION)
+    with pytest.raises(OSError):
+        transcribe(path, tmp_path, duration=1, store=asr.ProgressStore(tmp_path / "progress.db"),
+                   pool=pool, account=SECRET_ID, source=BrokenSource())
+    assert pool._inflight[SECRET_ID] == 0
+
+def test_lost_lease_stops_submission(tmp_path, mock_server):
+    path = make_wav(tmp_path / "a.wav", 1)
+    leases = asr.LeaseManager(tmp_path / "leases", worker_id="me")
+    try:
+        assert leases.acquire(path.name)
+        # 另一个 worker 接手了租约
+        (tmp_path / "leases" / f"{path.name}.lease").write_text(
+            json.dumps({'worker': "other", 'expires': time.time() + 300}))
+        with pytest.raises(asr.LeaseLost):
+            transcribe(path, tmp_path, duration=1, leases=leases)
+    finally:
+        leases.close()
+    assert mock_server.service.snapshot()["tasks_created"] == 0
+    assert json.loads((tmp_path / "leases" / f"{path.name}.lease").read_text())["worker"] == "other"
+
+def test_lease_exclusive_until_expired(tmp_path):
+    a = asr.LeaseManager(tmp_path, ttl=0.2, worker_id="a")
+    b = asr.LeaseManager(tmp_path, ttl=0.2, worker_id="b")
+    try:
+        assert a.acquire("f.mp3")
+        assert not b.acquire("f.mp3")
+        a._stop.set()
+        a._thread.join()
+        time.sleep(0.3)
+        assert b.acquire("f.mp3")
+        with pytest.raises(asr.LeaseLost):
+            a.check("f.mp3")
+        b.check("f.mp3")
+    finally:
+        a.close()
+        b.close()
+
+def test_expired_lease_is_not_renewed(tmp_path, monkeypatch):
+    # 续约线程耽搁到租约过期后，不能再覆盖可能已被别人领取的租约
+    monkeypatch.setattr(asr, "LEASE_RENEW_INTERVAL", 0.05)
+    leases = asr.LeaseManager(tmp_path, ttl=0.01, worker_id="a")
+    try:
+        assert leases.acquire("f.mp3")
+        deadline = time.time() + 5
+        while "f.mp3" not in leases._lost and time.time() < deadline:
+            time.sleep(0.01)
+        with pytest.raises(asr.LeaseLost):
+            leases.check("f.mp3")
+        assert json.loads((tmp_path / "f.mp3.lease").read_text())["expires"] < time.time()
+    finally:
+        leases.close()
+
+def test_callback_completion(tmp_path, mock_server, monkeypatch):
+    monkeypatch.setattr(asr, "CALLBACK_SAFETY_DELAY", 30)
+    receiver = asr.CallbackReceiver("http://unused", "127.0.0.1:0")
+    receiver.url = f"http://127.0.0.1:{receiver.httpd.server_address[1]}/{receiver.token}"
+    poller = asr.TaskPoller(asr.get_client(SECRET_ID, SECRET_KEY, REGION), callbacks=receiver)
+    try:
+        path = make_wav(tmp_path / "a.wav", 1)
+        sentences, _ = transcribe(path, tmp_path, duration=1, poller=poller, callback_url=poller.callback_url)
+    finally:
+        poller.close()
+        receiver.close()
+    assert sentences
+    assert poller.callback_count == 1
+    assert poller.request_count == 0
+    assert mock_server.service.snapshot()["callbacks_sent"] == 1
+
+def test_unclaimed_callbacks_are_bounded(monkeypatch):
+    monkeypatch.setattr(asr, "CALLBACK_EARLY_MAX", 3)
+    receiver = asr.CallbackReceiver("http://unused", "127.0.0.1:0")
+    try:
+        for task_id in range(10):
+            receiver.deliver({"requestId": str(task_id), "code": "0", "text": ""})
+        assert list(receiver._early) == [7, 8, 9]
+        assert receiver.take_early(9)["TaskId"] == 9
+        monkeypatch.setattr(asr, "CALLBACK_EARLY_TTL", 0)
+        time.sleep(0.01)
+        assert receiver.take_early(8) is None
+    finally:
+        receiver.close()
+
+def test_callback_rejects_wrong_token_and_large_body(monkeypatch):
+    monkeypatch.setattr(asr, "CALLBACK_MAX_BODY", 100)
+    receiver = asr.CallbackReceiver("http://unused", "127.0.0.1:0")
+    base = f"http://127.0.0.1:{receiver.httpd.server_address[1]}"
+
+    def post(path, body):
+        request = urllib.request.Request(base + path, data=body, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=10) as resp:
+                return resp.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    try:
+        assert post("/wrong", b"x" * 10000) == 404
+        assert post(f"/{receiver.token}", b"x" * 101) == 413
+        assert post(f"/{receiver.token}", b"requestId=5&code=0&text=") == 200
+        assert receiver.take_early(5)["TaskId"] == 5
+    finally:
+        receiver.close()
+
+@pytest.mark.skipif(not shutil.which(asr.tool_path("ffmpeg")), reason="run_day 启动前检查 ffmpeg")
+def test_run_day_end_to_end(tmp_path, mock_server):
+    input_dir = tmp_path / "in"
+    output_dir = tmp_path / "out"
+    for i in range(3):
+        make_wav(input_dir / f"f{i}.wav", 1 + i)
+
+    def run():
+        asr.run_day(1, input_dir, output_dir, output_dir / "tmp", output_dir / asr.PROGRESS_DB_NAME,
+                    SECRET_ID, SECRET_KEY, REGION, auto_confirm=True, workers=2, formats=("txt", "srt"))
+
+    run()
+    assert sorted(p.name for p in output_dir.glob("*.txt")) == ["f0.txt", "f1.txt", "f2.txt"]
+    assert len(list(output_dir.glob("*.srt"))) == 3
+    store = asr.ProgressStore(output_dir / asr.PROGRESS_DB_NAME)
+    assert store.names("completed") == {"f0.wav", "f1.wav", "f2.wav"}
+    assert store.usage_on(asr.beijing_today()) == pytest.approx(
+        sum(mock_seconds(p) for p in input_dir.iterdir()), abs=0.01)
+    # 再次运行不会重复提交
+    run()
+    assert mock_server.service.snapshot()["tasks_created"] == 3
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""跨天装箱规划（plan_days、_CapacityTree）"""
+
+import json
+import random
+
+import pytest
+
+from conftest import asr
+
+DAY = 3600
+
+def audio(name, seconds, size_mb=1):
+    return {'name': name, 'path': name, 'duration': seconds, 'size_mb': size_mb, 'content_hash': None}
+
+def planned(plan):
+    """{文件名: [(第几天, 秒数, 是否部分)]}"""
+    result = {}
+    for day in plan['days']:
+        for item in day['items']:
+            result.setdefault(item['file']['name'], []).append((day['index'], item['seconds'], item['partial']))
+    return result
+
+def test_capacity_tree_first_fit_matches_linear_scan():
+    rng = random.Random(7)
+    caps = [rng.uniform(0, 100) for _ in range(37)]
+    tree = asr._CapacityTree(caps)
+    for _ in range(300):
+        need = rng.uniform(0, 110)
+        expected = next((i for i, c in enumerate(caps) if c >= need), -1)
+        assert tree.first_fit(need) == expected
+        i = rng.randrange(len(caps))
+        caps[i] = rng.uniform(0, 100)
+        tree.set(i, caps[i])
+        assert tree.get(i) == caps[i]
+
+def test_small_files_fill_days_in_order():
+    files = [audio(f"f{i}.mp3", 0.4 * DAY) for i in range(5)]
+    plan = asr.plan_days(files, {}, day_capacity=DAY)
+    for day in plan['days']:
+        assert day['seconds'] <= day['capacity']
+    assert [d['seconds'] for d in plan['days']] == pytest.approx([0.8 * DAY, 0.8 * DAY, 0.4 * DAY])
+
+def test_used_today_shrinks_first_day():
+    files = [audio("a.mp3", 0.5 * DAY), audio("b.mp3", 0.5 * DAY)]
+    plan = asr.plan_days(files, {}, used_today=0.6 * DAY, day_capacity=DAY)
+    assert plan['days'][0]['capacity'] == pytest.approx(0.4 * DAY)
+    assert plan['days'][0]['items'] == []
+    assert plan['days'][1]['seconds'] == pytest.approx(DAY)
+
+def test_completed_and_partial_progress():
+    files = [audio("done.mp3", 0.5 * DAY), audio("half.mp3", 0.8 * DAY)]
+    progress = {'completed': ["done.mp3"], 'partial': {"half.mp3": 0.5 * DAY}}
+    assert planned(asr.plan_days(files, progress, day_capacity=DAY)) == {"half.mp3": [(1, pytest.approx(0.3 * DAY), False)]}
+
+def test_large_file_split_at_segment_boundaries():
+    # 超过上传上限的文件会被切分，可以拆到多天
+    big = audio("big.mp3", 2.5 * DAY, size_mb=asr.MAX_FILE_SIZE_MB * 4)
+    seg_len = asr.segment_duration_for(big['size_mb'] * 1024 * 1024, big['duration'])
+    pieces = planned(asr.plan_days([big], {}, day_capacity=DAY))["big.mp3"]
+    assert sum(seconds for _, seconds, _ in pieces) == pytest.approx(big['duration'])
+    assert len(pieces) >= 3
+    assert all(partial for _, _, partial in pieces)
+    for _, seconds, _ in pieces[:-1]:
+        assert seconds / seg_len == pytest.approx(round(seconds / seg_len))
+
+def test_unsplittable_long_file_gets_its_own_day():
+    files = [audio("long.mp3", 1.5 * DAY), audio("short.mp3", 0.2 * DAY)]
+    result = planned(asr.plan_days(files, {}, day_capacity=DAY))
+    assert result["short.mp3"] == [(1, pytest.approx(0.2 * DAY), False)]
+    assert result["long.mp3"] == [(2, pytest.approx(1.5 * DAY), False)]
+
+def test_deadline_and_priority_order():
+    rules = [
+        {'match': "urgent_*", 'priority': 0, 'deadline': asr.beijing_today()},
+        {'match': "vip_*", 'priority': 10, 'deadline': None},
+    ]
+    files = [audio("plain.mp3", 0.6 * DAY), audio("vip_a.mp3", 0.6 * DAY), audio("urgent_a.mp3", 0.6 * DAY)]
+    result = planned(asr.plan_days(files, {}, rules=rules, day_capacity=DAY))
+    assert [result[n][0][0] for n in ("urgent_a.mp3", "vip_a.mp3", "plain.mp3")] == [1, 2, 3]
+
+def test_rules_file_without_deadline(tmp_path):
+    plan_file = tmp_path / "plan.json"
+    plan_file.write_text(json.dumps([{"match": "*.wav", "priority": 5},
+                                     {"match": "late_*", "deadline": "2000-01-01"}]), encoding="utf-8")
+    rules = asr.load_plan_rules(plan_file)
+    assert rules[0]['deadline'] is None
+    assert rules[1]['priority'] == 0
+    files = [audio("a.mp3", 0.6 * DAY), audio("b.wav", 0.6 * DAY), audio("late_c.mp3", 0.1 * DAY)]
+    plan = asr.plan_days(files, {}, rules=rules, day_capacity=DAY)
+    assert [n for n, *_ in plan['late']] == ["late_c.mp3"]
+    assert planned(plan)["b.wav"][0][0] == 1
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""TC3-HMAC-SHA256 签名和流式请求体，用模拟服务的独立实现校验"""
+
+import base64
+import hashlib
+import json
+
+import pytest
+
+from conftest import asr, SECRET_ID, SECRET_KEY, REGION
+from mock_asr_server import MockAsrService, MockError
+
+HOST = "asr.tencentcloudapi.com"
+
+def mock_headers(headers):
+    """模拟服务参与校验的请求头（与其 HTTP 处理器取出的字段一致）"""
+    return {
+        "Authorization": headers["Authorization"],
+        "X-TC-Timestamp": headers["X-TC-Timestamp"],
+        "content-type": headers["Content-Type"],
+        "host": headers["Host"],
+        "x-tc-action": headers["X-TC-Action"].lower(),
+    }
+
+@pytest.fixture
+def client():
+    return asr.AsrClient(SECRET_ID, SECRET_KEY, REGION, endpoint=f"https://{HOST}")
+
+def test_signature_accepted_by_mock(client):
+    body = json.dumps({"TaskId": 1234}).encode()
+    now = int(asr.time.time())
+    headers = client.sign_tc3("asr", HOST, "DescribeTaskStatus", asr.API_VERSION, body, now)
+    MockAsrService().verify(mock_headers(headers), body)
+
+def test_signature_rejects_tampering(client):
+    body = json.dumps({"TaskId": 1234}).encode()
+    now = int(asr.time.time())
+    headers = client.sign_tc3("asr", HOST, "DescribeTaskStatus", asr.API_VERSION, body, now)
+    with pytest.raises(MockError) as e:
+        MockAsrService().verify(mock_headers(headers), body.replace(b"1234", b"1235"))
+    assert e.value.code == "AuthFailure.SignatureFailure"
+    with pytest.raises(MockError):
+        MockAsrService(credentials={SECRET_ID: "other-key"}).verify(mock_headers(headers), body)
+
+def test_signature_known_value(client):
+    # 固定输入的签名值，防止规范请求串或密钥派生被意外改动
+    headers = client.sign_tc3("asr", HOST, "CreateRecTask", "2019-06-14", {"EngineModelType": "16k_zh"}, 1700000000)
+    assert headers["Authorization"] == (
+        "TC3-HMAC-SHA256 Credential=mock-id/2023-11-14/asr/tc3_request, "
+        "SignedHeaders=content-type;host;x-tc-action, "
+        "Signature=bb02063d046c4d6cbfdce82fd361b6f58a7027ac6b812654443ff4a0615f632e"
+    )
+
+def test_signing_key_follows_utc_date(client):
+    # 派生密钥按 UTC 日期缓存，跨日后必须重新计算，结果与新客户端一致
+    for ts in (1700000000, 1700000000 + 86400, 1700000000):
+        fresh = asr.AsrClient(SECRET_ID, SECRET_KEY, REGION, endpoint=f"https://{HOST}")
+        expected = fresh.sign_tc3("asr", HOST, "CreateRecTask", "2019-06-14", b"{}", ts)
+        assert client.sign_tc3("asr", HOST, "CreateRecTask", "2019-06-14", b"{}", ts) == expected
+
+@pytest.mark.parametrize("size", [0, 1, 2, 3, asr.UPLOAD_CHUNK_BYTES + 1, 3 * asr.UPLOAD_CHUNK_BYTES])
+def test_streamed_body_matches_in_memory_json(tmp_path, size):
+    audio = tmp_path / "a.bin"
+    audio.write_bytes(bytes(range(256)) * (size // 256) + bytes(range(size % 256)))
+    payload = {"EngineModelType": "16k_zh", "SourceType": 1}
+    with asr.Base64JsonBody(audio, payload) as body:
+        streamed = b""
+        while True:
+            chunk = body.read(7777)
+            if not chunk:
+                break
+            streamed += chunk
+        assert len(streamed) == len(body)
+        assert body.sha256() == hashlib.sha256(streamed).hexdigest()
+        body.rewind()
+        assert body.read() == streamed
+    data = json.loads(streamed)
+    assert base64.b64decode(data["Data"]) == audio.read_bytes()
+    assert data["DataLen"] == size
+    assert data["EngineModelType"] == "16k_zh"
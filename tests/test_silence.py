@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""静音裁剪：片段规划、有声区间拼接和时间映射回原文件"""
+
+import math
+import shutil
+import struct
+import wave
+
+import pytest
+
+from conftest import asr
+
+def make_speech_wav(path, pattern, sample_rate=8000):
+    """按 [(秒数, 是否有声), ...] 生成 WAV，有声部分为 440Hz 正弦波"""
+    frames = []
+    for seconds, loud in pattern:
+        count = int(seconds * sample_rate)
+        amplitude = 12000 if loud else 0
+        frames.extend(round(amplitude * math.sin(2 * math.pi * 440 * i / sample_rate)) for i in range(count))
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(struct.pack(f"<{len(frames)}h", *frames))
+    return path
+
+def test_plan_packs_ranges_and_drops_blips():
+    # 有声 0-10、40-50、80-80.1（咔嗒声）、110-130；静音都够长，会被丢弃
+    silences = [(10, 40), (50, 80), (80.1, 110)]
+    pad = asr.SILENCE_PADDING
+    segments = asr.plan_silence_segments(130, silences, max_len=25)
+    assert segments == [
+        [(0.0, 10 + pad), (40 - pad, 50 + pad)],
+        [(110 - pad, 130)],
+    ]
+    for ranges in segments:
+        assert sum(end - start for start, end in ranges) <= 25
+
+def test_plan_splits_long_range_at_silence():
+    # 短静音不丢弃，但可以作为超长区间的切分点
+    segments = asr.plan_silence_segments(100, [(55, 56)], max_len=60)
+    assert segments == [[(0.0, 55.5)], [(55.5, 100)]]
+
+def test_remap_sentences_across_joins():
+    # 片段由原文件 10-20 秒和 50-60 秒拼成
+    offsets = [(0.0, 10.0), (10.0, 50.0)]
+    sentences = [
+        asr.Sentence(1000, 10000, 0, "前", (("前", 0, 9000),)),
+        asr.Sentence(9000, 12000, 1, "跨", (("跨", 0, 500), ("接", 1500, 3000))),
+        asr.TextNote(15000, 15000, None, "说明"),
+    ]
+    result = asr.remap_sentences(sentences, offsets)
+    assert [(s.start_ms, s.end_ms) for s in result] == [(11000, 20000), (19000, 52000), (55000, 55000)]
+    assert result[0].words == (("前", 0, 9000),)
+    assert result[1].words == (("跨", 0, 500), ("接", 31500, 33000))
+    assert isinstance(result[2], asr.TextNote)
+
+def test_offsets_survive_checkpoint(tmp_path):
+    store = asr.ProgressStore(tmp_path / "progress.db")
+    segs = [{'index': 0, 'path': tmp_path / "a_part000.wav", 'start_time': 10, 'duration': 20,
+             'offsets': [(0.0, 10.0), (10.0, 50.0)]},
+            {'index': 1, 'path': tmp_path / "a_part001.wav", 'start_time': 70, 'duration': 5}]
+    store.save_segments("a.wav", "sig", segs)
+    loaded = store.load_segments("a.wav", "sig")
+    assert loaded[0]['offsets'] == [(0.0, 10.0), (10.0, 50.0)]
+    assert 'offsets' not in loaded[1]
+
+@pytest.mark.skipif(not shutil.which(asr.tool_path("ffmpeg")), reason="需要 ffmpeg")
+def test_split_joins_kept_ranges(tmp_path):
+    path = make_speech_wav(tmp_path / "it's.wav", [(4, True), (6, False), (0.1, True), (6, False), (5, True)])
+    segments = asr.split_audio_on_silence(path, tmp_path / "out")
+    assert len(segments) == 1
+    seg = segments[0]
+    pad = asr.SILENCE_PADDING
+    assert seg['offsets'][0] == (0.0, 0.0)
+    assert seg['offsets'][1][0] == pytest.approx(4 + pad, abs=0.05)
+    assert seg['offsets'][1][1] == pytest.approx(16.1 - pad, abs=0.05)
+    assert seg['duration'] == pytest.approx(4 + 5 + 2 * pad, abs=0.1)
+    # 流复制按数据包边界截取，每个接缝最多差一个包
+    assert asr.read_audio_header(seg['path'])['duration'] == pytest.approx(seg['duration'], abs=0.1)
+    assert [p.name for p in (tmp_path / "out").iterdir()] == [seg['path'].name]
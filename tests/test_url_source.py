@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""URL 上传模式：Range 解析和签名链接文件服务"""
+
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from conftest import asr
+
+@pytest.mark.parametrize("header,expected", [
+    (None, None),
+    ("", None),
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=990-5000", (990, 999)),
+    (" bytes=0-0 ", (0, 0)),
+    ("bytes=1000-", False),
+    ("bytes=50-10", False),
+    ("bytes=-", None),
+    ("bytes=0-1,5-9", None),
+    ("items=0-1", None),
+])
+def test_parse_byte_range(header, expected):
+    assert asr.parse_byte_range(header, 1000) == expected
+
+@pytest.fixture
+def file_server():
+    server = asr.AudioFileServer("http://unused", listen="127.0.0.1:0")
+    server.public_url = f"http://127.0.0.1:{server.httpd.server_address[1]}"
+    yield server
+    server.close()
+
+def fetch(url, range_header=None, method="GET"):
+    request = urllib.request.Request(url, method=method)
+    if range_header:
+        request.add_header("Range", range_header)
+    try:
+        with urllib.request.urlopen(request, timeout=10) as resp:
+            return resp.status, dict(resp.headers), resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), b""
+
+def test_serves_signed_links_with_ranges(tmp_path, file_server):
+    path = tmp_path / "录音 1.mp3"
+    data = bytes(range(256)) * 40
+    path.write_bytes(data)
+    url = file_server.publish(path)
+
+    status, headers, body = fetch(url)
+    assert (status, body) == (200, data)
+    assert headers["Accept-Ranges"] == "bytes"
+
+    status, headers, body = fetch(url, "bytes=100-199")
+    assert (status, body) == (206, data[100:200])
+    assert headers["Content-Range"] == f"bytes 100-199/{len(data)}"
+
+    status, headers, _ = fetch(url, f"bytes={len(data)}-")
+    assert status == 416
+    assert headers["Content-Range"] == f"bytes */{len(data)}"
+
+    status, headers, body = fetch(url, method="HEAD")
+    assert (status, body, headers["Content-Length"]) == (200, b"", str(len(data)))
+    # 字节数在响应发出后才累计
+    deadline = time.time() + 5
+    while file_server.bytes_served < len(data) + 100 and time.time() < deadline:
+        time.sleep(0.01)
+    assert file_server.bytes_served == len(data) + 100
+
+def test_rejects_tampered_expired_and_revoked_links(tmp_path, file_server):
+    path = tmp_path / "a.mp3"
+    path.write_bytes(b"x" * 10)
+    url = file_server.publish(path)
+    assert fetch(url.replace("sig=", "sig=0"))[0] == 403
+    expires = url.split("expires=")[1].split("&")[0]
+    assert fetch(url.replace(f"expires={expires}", f"expires={int(expires) + 1}"))[0] == 403
+    file_server.ttl = -10
+    assert fetch(file_server.publish(path))[0] == 403
+    file_server.unpublish(url)
+    assert fetch(url)[0] == 403